@@ -1,13 +1,29 @@
 import aiohttp
 from typing import Dict, Any, Optional
 import logging
-from config import API_USERNAME, API_PASSWORD, API_BASE_URL
+from config import (
+    API_USERNAME, API_PASSWORD, API_BASE_URL, API_AUTH_URL, API_ORDER_CACHE_SIZE, API_ORDER_CACHE_TTL,
+    API_ORDER_CACHE_DEFAULT_TTL, API_TOKEN_REFRESH_MARGIN, API_TOKEN_DEFAULT_LIFETIME, API_TIMEOUT_TOTAL,
+    API_TIMEOUT_CONNECT, API_TIMEOUT_READ, API_POOL_SIZE, API_POOL_PER_HOST, API_KEEPALIVE_SECONDS,
+    API_DNS_CACHE_SECONDS, API_MAX_CONCURRENT_REQUESTS, API_RETRY_ATTEMPTS, API_RETRY_BACKOFF_INITIAL,
+    API_RETRY_BACKOFF_MAX, API_BREAKER_FAILURES, API_BREAKER_RECOVERY_SECONDS, API_ORDERS_PAGE_SIZE,
+    API_ORDERS_ID_PARAM, API_ORDERS_LIST_RETRY_SECONDS, API_STATUS_FANOUT
+)
+from auth import TokenManager
+from metrics import LatencyStats
+from order_cache import OrderCache
+from resilience import (
+    RETRYABLE_STATUSES, RetryableStatus, CircuitOpenError, CircuitBreaker, BackoffWait, is_retryable, parse_retry_after
+)
 
 from typing import List, Dict, Any, Optional, Callable, Tuple
 import asyncio
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
 from datetime import datetime
 import pytz
-from tenacity import retry, stop_after_attempt
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt
 MONTHS = {
     "01": "января", "02": "февраля", "03": "марта", "04": "апреля",
     "05": "мая", "06": "июня", "07": "июля", "08": "августа",
@@ -28,79 +44,264 @@ def format_created_at(created_at: str) -> str:
         return "Не указано"
 
 
+def format_order(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Привести сделку из ответа API к виду, который используют обработчики."""
+    return {
+        "deal_id": data["id"],
+        "merchant_name": data.get("merchant_name", "Unknown"),
+        "integrator_name": data.get("integrator", {}).get("name", "Unknown"),
+        "recipient": data.get("recipient", "N/A"),
+        "card": data.get("card", "N/A"),
+        "bank_name": data.get("bankName", "N/A"),
+        "sbp_type": "СБП" if data.get("is_sbp") else "Карта",
+        "sum": data.get("sum", 0.0),
+        "currency": data.get("currency", "RUB"),
+        "status": data.get("status", "unknown"),
+        "created_at": format_created_at(data.get("createdAt", "")),
+        "integrator_order_id": f"ID интегратора: {data.get('integratorOrderId', 'N/A')}" if data.get("integratorOrderId") else ""
+    }
+
+
+def list_items(data: Any) -> Optional[List[Dict[str, Any]]]:
+    """Элементы страницы списка сделок (голый список или обёртка с items/data/...)."""
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ("items", "data", "orders", "content", "results"):
+            if isinstance(data.get(key), list):
+                return data[key]
+    return None
+
+
 
 class PayphoriaAPI:
     def __init__(self):
         self.session: Optional[aiohttp.ClientSession] = None
-        self.token_cache: Dict[int, str] = {}
+        # Все сотрудники работают под одной учётной записью API_USERNAME — и токен у них общий
+        self.tokens = TokenManager(self._login, API_TOKEN_REFRESH_MARGIN, API_TOKEN_DEFAULT_LIFETIME)
+        self.order_cache = OrderCache(API_ORDER_CACHE_SIZE, API_ORDER_CACHE_TTL, API_ORDER_CACHE_DEFAULT_TTL)
+        # Не больше API_MAX_CONCURRENT_REQUESTS запросов к API одновременно, остальные ждут очереди
+        self._limit = asyncio.Semaphore(API_MAX_CONCURRENT_REQUESTS)
+        self.in_flight = 0
+        self.queued = 0
+        self.latency = LatencyStats()
+        self.breaker = CircuitBreaker(API_BREAKER_FAILURES, API_BREAKER_RECOVERY_SECONDS)
+        self.retries: Dict[str, int] = {}
+        # Список orders с фильтром по id не поддерживается — до этого момента опрашиваем по одной
+        self._list_disabled_until = 0.0
 
     async def start(self):
-        """Инициализация сессии."""
-        self.session = aiohttp.ClientSession()
+        """Инициализация сессии и фонового обновления токена."""
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=API_TIMEOUT_TOTAL, connect=API_TIMEOUT_CONNECT, sock_read=API_TIMEOUT_READ),
+            connector=aiohttp.TCPConnector(
+                limit=API_POOL_SIZE,
+                limit_per_host=API_POOL_PER_HOST,
+                keepalive_timeout=API_KEEPALIVE_SECONDS,
+                ttl_dns_cache=API_DNS_CACHE_SECONDS
+            )
+        )
+        self.tokens.start()
 
     async def close(self):
         """Закрытие сессии."""
+        await self.tokens.stop()
         if self.session:
             await self.session.close()
 
-    @retry(stop=stop_after_attempt(3))
-    async def get_token(self, user_id: int, order_id: Optional[str] = None) -> Optional[str]:
-        """Получить токен."""
-        if user_id in self.token_cache:
-            return self.token_cache[user_id]
+    @asynccontextmanager
+    async def _http(self, method: str, endpoint: str, url: str, **kwargs):
+        """HTTP-запрос с ограничением числа одновременных запросов и замером задержки по эндпоинту."""
+        self.queued += 1
+        async with self._limit:
+            self.queued -= 1
+            self.in_flight += 1
+            started = time.perf_counter()
+            ok = False
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    ok = response.status < 500
+                    yield response
+            finally:
+                self.in_flight -= 1
+                self.latency.record(endpoint, time.perf_counter() - started, ok)
+
+    async def _send(self, method: str, endpoint: str, url: str, parse: bool = True, **kwargs) -> Tuple[int, Any]:
+        """Один запрос через предохранитель; повторяемые статусы поднимаются как RetryableStatus."""
+        self.breaker.check()
+        try:
+            async with self._http(method, endpoint, url, **kwargs) as response:
+                status = response.status
+                if status in RETRYABLE_STATUSES:
+                    raise RetryableStatus(status, parse_retry_after(response.headers.get("Retry-After")))
+                data = await response.json() if parse and status == 200 else None
+        except BaseException as e:
+            if is_retryable(e):
+                self.breaker.failure()
+            else:
+                self.breaker.release()
+            raise
+        self.breaker.success()
+        return status, data
 
-        async with self.session.post(
-            API_BASE_URL + "users/login",
+    def _count_retry(self, retry_state: RetryCallState) -> None:
+        """Учесть повтор запроса по причине отказа."""
+        error = retry_state.outcome.exception()
+        reason = str(error.status) if isinstance(error, RetryableStatus) else type(error).__name__
+        self.retries[reason] = self.retries.get(reason, 0) + 1
+        logger.warning(f"Повтор запроса к API ({reason}), попытка {retry_state.attempt_number + 1}")
+
+    async def _request(self, method: str, endpoint: str, url: str, idempotent: bool, **kwargs) -> Tuple[int, Any]:
+        """Запрос к API: идемпотентные повторяются с экспоненциальной паузой и джиттером."""
+        if not idempotent:
+            return await self._send(method, endpoint, url, **kwargs)
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(API_RETRY_ATTEMPTS),
+            wait=BackoffWait(API_RETRY_BACKOFF_INITIAL, API_RETRY_BACKOFF_MAX),
+            retry=retry_if_exception(is_retryable),
+            before_sleep=self._count_retry,
+            reraise=True
+        ):
+            with attempt:
+                return await self._send(method, endpoint, url, **kwargs)
+
+    async def _login(self) -> Optional[str]:
+        """Вход в API под общей учётной записью (POST не повторяется: повтор делает TokenManager)."""
+        status, data = await self._request(
+            "POST", "users/login", API_AUTH_URL, idempotent=False,
             json={"username": API_USERNAME, "password": API_PASSWORD}
-        ) as response:
+        )
+        if status == 200:
+            return data.get("accessToken")
+        logger.error(f"Ошибка авторизации: {status}")
+        return None
 
-            if response.status == 200:
-                data = await response.json()
+    async def get_token(self, user_id: Optional[int] = None, order_id: Optional[str] = None) -> Optional[str]:
+        """Получить действующий токен (общий для всех пользователей)."""
+        return await self.tokens.get()
 
-                token = data.get("accessToken")
-                self.token_cache[user_id] = token
+    async def _get(self, path: str, endpoint: Optional[str] = None, token: Optional[str] = None,
+                   parse: bool = True) -> Tuple[int, Any]:
+        """GET-запрос к API; с общим токеном при ответе 401 — один перелогин и повтор."""
+        managed = token is None
+        if managed:
+            token = await self.tokens.get()
+            if not token:
+                return 401, None
+        for attempt in range(2):
+            status, data = await self._request(
+                "GET", endpoint or path, API_BASE_URL + path, idempotent=True, parse=parse,
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            # Перелогин вне слота семафора: иначе при полной очереди вход ждал бы сам себя
+            if status != 401 or not managed or attempt:
+                break
+            token = await self.tokens.unauthorized(token)
+            if not token:
+                break
+        return status, data
 
-                return token
-            logger.error(f"Ошибка авторизации: {response.status}")
-            return None
+    async def get_order(self, order_id: str, user_id: int, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """Получить данные сделки (из кэша или одним общим запросом на всех вызывающих).
 
-    @retry(stop=stop_after_attempt(3))
-    async def get_order(self, order_id: str, user_id: int) -> Optional[Dict[str, Any]]:
-        """Получить данные сделки."""
-        token = await self.get_token(user_id)
+        fresh=True пропускает кэш, когда важен текущий статус (подтверждение перевода в успех).
+        """
+        return await self.order_cache.fetch(order_id, lambda: self._fetch_order(order_id, user_id), fresh=fresh)
 
-        if not token:
+    async def _fetch_order(self, order_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        """Запросить данные сделки у API."""
+        try:
+            status, data = await self._get(f"orders/{order_id}", "orders/{id}")
+        except CircuitOpenError:
             return None
-
-        async with self.session.get(
-            API_BASE_URL + f"orders/{order_id}",
-            headers={"Authorization": f"Bearer {token}"}
-        ) as response:
-
-            if response.status == 200:
-                data = await response.json()
-                logger.debug(f"получена сделка {order_id}: {response.status}")
-                return {
-                    "deal_id": data["id"],
-                    "merchant_name": data.get("merchant_name", "Unknown"),
-                    "integrator_name": data.get("integrator", {}).get("name", "Unknown"),
-                    "recipient": data.get("recipient", "N/A"),
-                    "card": data.get("card", "N/A"),
-                    "bank_name": data.get("bankName", "N/A"),
-                    "sbp_type": "СБП" if data.get("is_sbp") else "Карта",
-                    "sum": data.get("sum", 0.0),
-                    "currency": data.get("currency", "RUB"),
-                    "status": data.get("status", "unknown"),
-                    "created_at": format_created_at(data.get("createdAt", "")),
-                    "integrator_order_id": f"ID интегратора: {data.get('integratorOrderId', 'N/A')}" if data.get("integratorOrderId") else ""
-                }
-            logger.error(f"Ошибка получения сделки {order_id}: {response.status}")
+        except (RetryableStatus, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Ошибка получения сделки {order_id}: {e!r}")
             return None
 
-    async def validate_token(self, user_id: int, token: str) -> bool:
-        """Проверить токен."""
-        async with self.session.get(
-            API_BASE_URL + "orders",
-            headers={"Authorization": f"Bearer {token}"}
-        ) as response:
-            return response.status == 200
\ No newline at end of file
+        if status == 200:
+            logger.debug(f"получена сделка {order_id}: {status}")
+            return format_order(data)
+        logger.error(f"Ошибка получения сделки {order_id}: {status}")
+        return None
+
+    async def get_orders(self, order_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Данные набора сделок: пакетно через список orders, иначе по одной с ограничением параллельности."""
+        if not order_ids:
+            return {}
+        if time.monotonic() >= self._list_disabled_until:
+            orders = await self._list_orders(order_ids)
+            if orders is not None:
+                return orders
+            logger.warning(f"Список orders с фильтром недоступен, опрос по одной сделке на {API_ORDERS_LIST_RETRY_SECONDS} с")
+            self._list_disabled_until = time.monotonic() + API_ORDERS_LIST_RETRY_SECONDS
+        return await self._fan_out(order_ids)
+
+    async def _list_orders(self, order_ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Постраничный запрос списка сделок по id; None, если фильтр или формат ответа не поддерживаются."""
+        orders: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(order_ids), API_ORDERS_PAGE_SIZE):
+            chunk = order_ids[i:i + API_ORDERS_PAGE_SIZE]
+            wanted = set(chunk)
+            page = 1
+            while True:
+                query = urlencode({API_ORDERS_ID_PARAM: ",".join(chunk), "page": page, "limit": API_ORDERS_PAGE_SIZE})
+                try:
+                    status, data = await self._get(f"orders?{query}", "orders")
+                except CircuitOpenError:
+                    return orders
+                except (RetryableStatus, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error(f"Ошибка получения списка сделок: {e!r}")
+                    return orders
+                if status != 200:
+                    return None
+                items = list_items(data)
+                # Сервер, игнорирующий фильтр, вернул бы чужие сделки — тогда список бесполезен
+                if items is None or any(item.get("id") not in wanted for item in items):
+                    return None
+                new = [item for item in items if item["id"] not in orders]
+                for item in new:
+                    order = format_order(item)
+                    orders[order["deal_id"]] = order
+                    self.order_cache.put(order["deal_id"], order)
+                pages = (data.get("pages") or data.get("totalPages")) if isinstance(data, dict) else None
+                # Страница без новых сделок — сервер не листает, дальше те же данные
+                if not new or wanted <= orders.keys() or (page >= pages if pages else len(items) < API_ORDERS_PAGE_SIZE):
+                    break
+                page += 1
+        return orders
+
+    async def _fan_out(self, order_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Запросить сделки по одной, не больше API_STATUS_FANOUT одновременно."""
+        limit = asyncio.Semaphore(API_STATUS_FANOUT)
+
+        async def fetch(order_id: str) -> Optional[Dict[str, Any]]:
+            async with limit:
+                return await self.get_order(order_id, None, fresh=True)
+
+        results = await asyncio.gather(*(fetch(order_id) for order_id in order_ids))
+        return {order_id: order for order_id, order in zip(order_ids, results) if order}
+
+    async def validate_token(self, user_id: int, token: Optional[str] = None) -> bool:
+        """Проверить токен (по умолчанию общий, с перелогином при 401)."""
+        if token == self.tokens.token:
+            token = None
+        try:
+            status, _ = await self._get("orders", token=token, parse=False)
+        except (CircuitOpenError, RetryableStatus, aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+        return status == 200
+
+    def available(self) -> bool:
+        """Можно ли сейчас обращаться к API (предохранитель не разомкнут)."""
+        return not self.breaker.is_open
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики клиента API."""
+        return {
+            "http": {"in_flight": self.in_flight, "queued": self.queued},
+            "breaker": self.breaker.stats(),
+            "retries": dict(self.retries),
+            "endpoints": self.latency.summary(),
+            "tokens": self.tokens.stats(),
+            "order_cache": self.order_cache.stats()
+        }
@@ -0,0 +1,124 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+
+def jwt_expiry(token: str) -> Optional[float]:
+    """Момент истечения JWT (поле exp) без проверки подписи."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+
+class TokenManager:
+    """Токен доступа одной учётной записи API: срок действия, фоновое обновление и единичный перелогин."""
+
+    def __init__(self, login: Callable[[], Awaitable[Optional[str]]], refresh_margin: float, default_lifetime: float,
+                 retry_delay: float = 10):
+        """Инициализация менеджера; login выполняет вход и возвращает токен."""
+        self._login = login
+        self.refresh_margin = refresh_margin
+        self.default_lifetime = default_lifetime
+        self.retry_delay = retry_delay
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self.issued_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.logins = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def valid(self) -> bool:
+        """Есть ли неистёкший токен."""
+        return self.token is not None and time.time() < self.expires_at
+
+    async def get(self) -> Optional[str]:
+        """Действующий токен (с входом, если токена нет или он истёк)."""
+        if self.valid():
+            return self.token
+        return await self.refresh(stale=self.token)
+
+    async def refresh(self, stale: Optional[str] = None) -> Optional[str]:
+        """Войти заново, если токен stale ещё не заменили другие вызывающие."""
+        logins = self.logins
+        async with self._lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос (сервер может выдать и тот же токен)
+            if self.valid() and (self.token != stale or self.logins != logins):
+                return self.token
+            try:
+                token = await self._login()
+            except Exception as e:
+                logger.error(f"Ошибка входа в API: {e}")
+                token = None
+            if not token:
+                self.failures += 1
+                # Старый токен ещё пригоден, если не истёк и не был отвергнут
+                if not self.valid():
+                    self.token = None
+                    self.expires_at = 0.0
+                return self.token
+            self.token = token
+            self.issued_at = time.time()
+            self.expires_at = jwt_expiry(token) or self.issued_at + self.default_lifetime
+            self.logins += 1
+            logger.info(f"Получен токен API, действует до {time.strftime('%H:%M:%S', time.localtime(self.expires_at))}")
+            return token
+
+    async def unauthorized(self, token: Optional[str]) -> Optional[str]:
+        """Ответ 401 на запрос с токеном token: один перелогин на всю пачку запросов."""
+        self.rejected += 1
+        if token is not None and token == self.token:
+            self.expires_at = 0.0
+        return await self.refresh(stale=token)
+
+    def start(self) -> None:
+        """Запустить фоновое обновление токена до истечения."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        """Остановить фоновое обновление."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _margin(self) -> float:
+        """Запас до истечения: не больше половины срока жизни короткого токена."""
+        return min(self.refresh_margin, (self.expires_at - self.issued_at) / 2)
+
+    async def _refresh_loop(self) -> None:
+        """Обновлять токен заранее, до истечения срока действия."""
+        while True:
+            if self.token is not None:
+                await asyncio.sleep(max(self.expires_at - self._margin() - time.time(), 0))
+                # Токен могли обновить по ответу 401, пока ждали
+                if self.valid() and time.time() < self.expires_at - self._margin():
+                    continue
+            failures = self.failures
+            await self.refresh(stale=self.token)
+            if self.failures > failures:
+                await asyncio.sleep(self.retry_delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики входов."""
+        return {
+            "valid": self.valid(),
+            "expires_in": max(0, int(self.expires_at - time.time())) if self.token else 0,
+            "logins": self.logins,
+            "failures": self.failures,
+            "unauthorized": self.rejected,
+        }
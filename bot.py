@@ -4,10 +4,19 @@ import os
 from logging.handlers import RotatingFileHandler
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from database import Database
+from config import (
+    BOT_TOKEN, WEBHOOK_ENABLED, TG_GLOBAL_PER_SECOND, TG_CHAT_PER_SECOND, TG_GROUP_PER_MINUTE, TG_CHAT_BURST,
+    TG_SEND_CONCURRENCY, TG_SEND_MAX_ATTEMPTS, TG_OUTBOX_DRAIN_SECONDS, ADMIN_IDS, DAY_START, DAY_END,
+    SLA_DAY_SECONDS, SLA_NIGHT_SECONDS, SLA_ADMIN_ESCALATION_SECONDS, SCHEDULER_DRAIN_SECONDS, SCHEDULER_RESTART_SECONDS
+)
+from database import AsyncDatabase
 from api import PayphoriaAPI
 from handlers import commands, callbacks, messages, edited_messages, tasks
+from webhook import WebhookReceiver
+from outbox import Outbox, OutboxMiddleware
+from deferred import DeferredJobs
+from sla import SlaCalendar, SlaEngine
+from scheduler import Scheduler
 
 if not os.path.exists('logs'):
         os.makedirs('logs')
@@ -25,11 +34,20 @@ logger = logging.getLogger(__name__)
 
 async def main():
     bot = Bot(token=BOT_TOKEN)
+    outbox = Outbox(TG_GLOBAL_PER_SECOND, TG_CHAT_PER_SECOND, TG_GROUP_PER_MINUTE, TG_CHAT_BURST,
+                    TG_SEND_CONCURRENCY, TG_SEND_MAX_ATTEMPTS, TG_OUTBOX_DRAIN_SECONDS)
+    bot.session.middleware(OutboxMiddleware(outbox))
     dp = Dispatcher(storage=MemoryStorage())
-    db = Database()
+    db = AsyncDatabase()
 
 
     api = PayphoriaAPI()
+    deferred = DeferredJobs(db)
+    messages.register_jobs(deferred, bot, db, api)
+    sla = SlaEngine(bot, db, SlaCalendar(DAY_START, DAY_END, SLA_DAY_SECONDS, SLA_NIGHT_SECONDS),
+                    SLA_ADMIN_ESCALATION_SECONDS, ADMIN_IDS)
+    scheduler = Scheduler(SCHEDULER_DRAIN_SECONDS, SCHEDULER_RESTART_SECONDS)
+    tasks.register_tasks(scheduler, bot, db, api)
 
     dp.include_router(commands.router)
     dp.include_router(callbacks.router)
@@ -38,15 +56,28 @@ async def main():
     dp.include_router(tasks.router)
 
     await api.start()
+    outbox.start()
+    await deferred.start()
+    await sla.start()
+    webhook = WebhookReceiver(bot, db, api) if WEBHOOK_ENABLED else None
 
     try:
-        await tasks.start_tasks(bot, db, api)
+        if webhook:
+            await webhook.start()
+        scheduler.start()
 
-        await dp.start_polling(bot, db=db, api=api)
+        await dp.start_polling(bot, db=db, api=api, outbox=outbox, deferred=deferred, sla=sla, scheduler=scheduler)
 
     finally:
+        if webhook:
+            await webhook.stop()
+        await scheduler.stop()
+        await sla.stop()
+        await deferred.stop()
         await api.close()
+        await outbox.stop()
         await bot.session.close()
+        await db.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -8,11 +8,75 @@ API_USERNAME: str = "SupportBublik"
 API_PASSWORD: str = "SOSAL7777"
 API_BASE_URL: str = "https://api.payphoria.space/payphoria/api/v1/"
 API_AUTH_URL: str = API_BASE_URL + "users/login"
+API_TOKEN_REFRESH_MARGIN: int = 60  # Обновлять токен заранее, за столько секунд до истечения
+API_TOKEN_DEFAULT_LIFETIME: int = 3600  # Если в токене нет поля exp
+API_TIMEOUT_TOTAL: float = 20  # Предел на весь запрос к API, сек
+API_TIMEOUT_CONNECT: float = 5
+API_TIMEOUT_READ: float = 10  # Между пакетами ответа
+API_POOL_SIZE: int = 50  # Соединений в пуле всего
+API_POOL_PER_HOST: int = 20
+API_KEEPALIVE_SECONDS: float = 30
+API_DNS_CACHE_SECONDS: int = 300
+API_MAX_CONCURRENT_REQUESTS: int = 16  # Одновременных запросов к API, остальные ждут очереди
+API_RETRY_ATTEMPTS: int = 3  # Попыток для GET-запросов (5xx, 429, таймауты, обрывы соединения)
+API_RETRY_BACKOFF_INITIAL: float = 0.5  # Первая пауза, далее удваивается, со случайным джиттером
+API_RETRY_BACKOFF_MAX: float = 10
+API_BREAKER_FAILURES: int = 5  # Отказов подряд, после которых запросы к API приостанавливаются
+API_BREAKER_RECOVERY_SECONDS: float = 30
+API_ORDERS_PAGE_SIZE: int = 100  # Сделок на страницу списка orders при пакетном опросе статусов
+API_ORDERS_ID_PARAM: str = "ids"  # Параметр фильтра списка orders по id (через запятую)
+API_ORDERS_LIST_RETRY_SECONDS: int = 600  # Через сколько снова пробовать список, если фильтр не поддержан
+API_STATUS_FANOUT: int = 8  # Одновременных GET orders/{id}, когда список недоступен
+WEBHOOK_ENABLED: bool = False  # Приём уведомлений о статусах сделок от Payphoria
+WEBHOOK_HOST: str = "0.0.0.0"
+WEBHOOK_PORT: int = 8080
+WEBHOOK_PATH: str = "/payphoria/orders"
+WEBHOOK_SECRET: str = ""  # Общий секрет для HMAC-подписи уведомлений
+WEBHOOK_MAX_SKEW_SECONDS: int = 300  # Уведомления старше этого отклоняются (защита от повтора)
+WEBHOOK_RECONCILE_SECONDS: int = 120  # При включённом вебхуке опрос статусов — редкая сверка
+RECONCILE_CONCURRENCY: int = 16  # Сколько сделок завершается одновременно за цикл сверки
+RECONCILE_RETRY_BASE_SECONDS: int = 30  # Пауза после ошибки по сделке, с каждой следующей ошибкой удваивается
+RECONCILE_RETRY_MAX_SECONDS: int = 900
+RECONCILE_ALERT_FAILURES: int = 3  # После скольких ошибок подряд по одной сделке уведомить админов
+CHECK_DEALS_INTERVAL_SECONDS: int = 20  # Период сверки сделок (check_deals)
+CHECK_DEALS_JITTER_SECONDS: float = 2  # Случайная добавка к периоду, чтобы не совпадать с другими задачами
+CHECK_DEALS_MAX_RUNTIME_SECONDS: int = 600  # Дольше этого цикл сверки прерывается
+SCHEDULER_DRAIN_SECONDS: float = 15  # Сколько ждать идущие задачи при остановке бота
+SCHEDULER_RESTART_SECONDS: float = 5  # Через сколько перезапускать упавший цикл расписания
+TG_GLOBAL_PER_SECOND: float = 30  # Лимиты Telegram на отправку: всего по боту
+TG_CHAT_PER_SECOND: float = 1  # В личный чат
+TG_GROUP_PER_MINUTE: float = 20  # В группу
+TG_CHAT_BURST: int = 3  # Сколько сообщений в чат можно отправить подряд без ожидания
+TG_SEND_CONCURRENCY: int = 8  # Одновременных запросов к Telegram из очереди
+TG_SEND_MAX_ATTEMPTS: int = 5  # Попыток отправки после ответов retry_after
+TG_OUTBOX_DRAIN_SECONDS: float = 10  # Сколько досылать очередь при остановке бота
+API_ORDER_CACHE_SIZE: int = 2048
+API_ORDER_CACHE_TTL: Dict[str, float] = {"success": 3600}  # Срок жизни в кэше по статусу сделки, сек
+API_ORDER_CACHE_DEFAULT_TTL: float = 5  # Для остальных статусов: проверка check_deals должна видеть свежий статус
+DEAL_ID_LOOKUP_CONCURRENCY: int = 4  # Одновременных проверок deal_id из одного сообщения
+INTEGRATOR_MATCH_DISTANCE: int = 2  # Допустимые опечатки в имени интегратора из сделки
 SLA_DAY_SECONDS: int = 2400
 SLA_NIGHT_SECONDS: int = 3600
 DAY_START: str = "10:00"  # MSK
 DAY_END: str = "22:00"  # MSK
+SLA_ADMIN_ESCALATION_SECONDS: int = 1200  # Через сколько после просрочки напомнить админам, 0 — не напоминать
 EDIT_TIMEOUT_SECONDS: int = 30
+ALBUM_WINDOW_MS: int = 600  # Сколько ждать следующую часть альбома, прежде чем обработать его целиком
+DB_BACKEND: str = "jsonl"  # jsonl | sqlite
+DB_SQLITE_PATH: str = "data/pspw.db"
+DB_APPEND_ONLY: bool = True  # Вставки и изменения дописываются в конец файла
+DB_IN_MEMORY: bool = True  # Таблицы загружаются в память с индексами, запись сквозная
+DB_OFFSET_TABLES: list[str] = ["messages", "proof_messages", "sla_notifications"]  # Не грузятся в память, поиск по индексу смещений
+DB_EXECUTOR_WORKERS: int = 4
+DB_GROUP_COMMIT_MS: int = 5  # Окно групповой фиксации записей, 0 — писать сразу
+DB_COMPACT_INTERVAL_SECONDS: int = 300
+DB_COMPACT_MAX_BYTES: int = 5 * 1024 * 1024
+DB_COMPACT_GARBAGE_RATIO: float = 0.5
+DB_ARCHIVE_DIR: str = "data/archive"  # Сжатые дневные сегменты сделок, сообщений и доказательств
+DB_ARCHIVE_CACHE_SEGMENTS: int = 8
+# Закрытые сделки, уходящие в архив на следующий день. Отклонённые остаются до конца смены:
+# по ним ещё приходят доказательства и апелляции, а пути их обработки читают только живую таблицу.
+DB_ARCHIVE_STATUSES: list[str] = ["completed"]
 
 HELP_TEXT: Dict[str, str] = {
     "help": """
@@ -41,6 +105,7 @@ HELP_TEXT: Dict[str, str] = {
 ➖ /remove_user <user_id> — Удалить
 👥 /manage_users — Сотрудники
 🔗 /bind_merchant <name> — Привязать
+📊 /api_stats — Метрики API
 
 Примеры:
 - /candles Payphoria вкл
@@ -103,6 +168,7 @@ RESPONSE_TEMPLATES: Dict[str, str] = {
         "Ожидают интегратора:\n{pending_deals}"
     ),
     "sla_expired": "⏰ SLA истёк для сделки <code>{deal_id}</code> у мерчанта {merchant_name}! ⏳",
+    "sla_escalated": "🚨 Сделка <code>{deal_id}</code> у мерчанта {merchant_name} просрочена на {minutes} мин, обработчик не ответил!",
     "integrator_approve_error": "⚠️ Сначала отправьте КБ по сделке <code>{deal_id}</code>, затем попробуйте снова! 📋",
     "integrator_reject_sla": "⚖️ Интегратор попытался отменить <code>{deal_id}</code> после SLA! ⏳",
     "integrator_reject_notify": "⚠️ Сделка <code>{deal_id}</code> отклонена интегратором: {reason_text}",
@@ -1,69 +1,163 @@
-import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, AsyncIterator
 import logging
 import uuid
 from datetime import datetime
 import pytz
+from config import (
+    DB_BACKEND, DB_APPEND_ONLY, DB_IN_MEMORY, DB_OFFSET_TABLES, DB_SQLITE_PATH, DB_EXECUTOR_WORKERS, DB_GROUP_COMMIT_MS,
+    DB_ARCHIVE_DIR, DB_ARCHIVE_CACHE_SEGMENTS, DB_ARCHIVE_STATUSES
+)
+from storage.archive import Archive, ARCHIVE_TABLES, row_day
+from storage.base import Storage, TABLES
 
 logger = logging.getLogger(__name__)
 
-class Database:
-    """Класс для работы с базой данных бота PSPWare на основе JSON Lines."""
+# Таблицы, которые изменяет метод Database. Остальные методы только читают.
+WRITE_TABLES: Dict[str, Tuple[str, ...]] = {
+    "add_merchant": ("merchants",),
+    "delete_merchant": ("merchants",),
+    "update_merchant_handler": ("merchants",),
+    "merge_cascade": ("cascades",),
+    "delete_cascade": ("cascades",),
+    "add_deal": ("deals",),
+    "update_deal_status": ("deals",),
+    "archive_deals_except": tuple(ARCHIVE_TABLES),
+    "rotate_closed_days": tuple(ARCHIVE_TABLES),
+    "add_message": ("messages",),
+    "add_stat": ("stats",),
+    "save_user_token": ("users",),
+    "add_appeal": ("appeals",),
+    "add_sla_notification": ("sla_notifications",),
+    "add_shift": ("shifts",),
+    "add_proof_message": ("proof_messages",),
+    "save_deferred_job": ("deferred_jobs",),
+    "delete_deferred_job": ("deferred_jobs",),
+    "compact_if_needed": tuple(TABLES),
+}
+
+
+def create_storage() -> Storage:
+    """Создать хранилище согласно настройкам."""
+    group_commit = DB_GROUP_COMMIT_MS > 0
+    if DB_BACKEND == "sqlite":
+        from storage.sqlite import SqliteStorage
+        return SqliteStorage(Path(DB_SQLITE_PATH), group_commit=group_commit)
+    from storage.jsonl import JsonlStorage
+    return JsonlStorage(Path("data"), append_only=DB_APPEND_ONLY, in_memory=DB_IN_MEMORY, group_commit=group_commit,
+                        offset_tables=DB_OFFSET_TABLES)
+
+
+class TransactionAborted(Exception):
+    """Шаг транзакции не выполнен: все её изменения отменяются."""
 
-    def __init__(self):
-        """Инициализация директории и файлов базы данных."""
-        self.data_dir = Path("data")
-        self.data_dir.mkdir(exist_ok=True)
-        self.files = {
-            "users": self.data_dir / "users.jsonl",
-            "merchants": self.data_dir / "merchants.jsonl",
-            "cascades": self.data_dir / "cascades.jsonl",
-            "deals": self.data_dir / "deals.jsonl",
-            "messages": self.data_dir / "messages.jsonl",
-            "sla_notifications": self.data_dir / "sla_notifications.jsonl",
-            "stats": self.data_dir / "stats.jsonl",
-            "shifts": self.data_dir / "shifts.jsonl",
-            "appeals": self.data_dir / "appeals.jsonl",
-            "proof_messages": self.data_dir / "proof_messages.jsonl"
-        }
-        for file in self.files.values():
-            if not file.exists():
-                file.touch()
-
-    def _read_jsonl(self, file_path: Path) -> List[Dict[str, Any]]:
-        """Чтение JSON Lines файла."""
+
+class Database:
+    """Класс для работы с базой данных бота PSPWare."""
+
+    def __init__(self, storage: Optional[Storage] = None, archive: Optional[Archive] = None):
+        """Инициализация хранилища и архива."""
+        self.storage = storage or create_storage()
+        self.archive = archive or Archive(Path(DB_ARCHIVE_DIR), DB_ARCHIVE_CACHE_SEGMENTS)
+        # Растёт при каждом изменении интеграторов: по нему сбрасываются построенные над ними индексы
+        self.cascades_version = 0
+
+    def _first(self, table: str, index: str, *values: Any) -> Dict[str, Any]:
+        """Первая строка с заданными значениями полей индекса."""
+        rows = self.storage.select(table, index, *values)
+        return rows[0] if rows else {}
+
+    def _with_archive(self, table: str, rows: List[Dict[str, Any]], start: Optional[str], end: Optional[str],
+                      predicate: Callable[[Dict[str, Any]], bool] = lambda row: True) -> List[Dict[str, Any]]:
+        """Дополнить строки горячей таблицы архивом, если запрошен диапазон дней."""
+        if not start and not end:
+            return rows
+        in_range = lambda row: (not start or row_day(table, row) >= start) and (not end or row_day(table, row) <= end)
+        archived = [r for r in self.archive.read(table, start, end) if predicate(r)]
+        return archived + [r for r in rows if in_range(r)]
+
+    def _archive_deals(self, deals: List[Dict[str, Any]]) -> int:
+        """Перенести сделки вместе с их сообщениями в архив и убрать из горячих таблиц."""
+        deal_ids = {d["deal_id"] for d in deals}
+        if not deal_ids:
+            return 0
+        moved: Dict[str, List[Dict[str, Any]]] = {}
+        kept: Dict[str, List[Dict[str, Any]]] = {}
+        for table in ARCHIVE_TABLES:
+            rows = self.storage.all(table)
+            moved[table] = [r for r in rows if r.get("deal_id") in deal_ids]
+            kept[table] = [r for r in rows if r.get("deal_id") not in deal_ids]
+        # Сначала архив на диске, потом усечение горячих таблиц: сбой не теряет данные
+        for table, rows in moved.items():
+            if rows:
+                self.archive.write(table, rows)
+        with self.storage.batch(ARCHIVE_TABLES):
+            for table, rows in moved.items():
+                if rows:
+                    self.storage.replace(table, kept[table])
+        return len(deal_ids)
+
+    def rotate_closed_days(self) -> bool:
+        """Перенести в архив завершённые сделки прошедших дней."""
         try:
-            with file_path.open("r", encoding="utf-8") as f:
-                return [json.loads(line) for line in f if line.strip()]
+            today = datetime.now(pytz.timezone("Europe/Moscow")).strftime("%Y-%m-%d")
+            closed = [
+                d for status in DB_ARCHIVE_STATUSES for d in self.storage.select("deals", "status", status)
+                if row_day("deals", d) < today
+            ]
+            if closed:
+                logger.info(f"Перенесено в архив {self._archive_deals(closed)} завершённых сделок")
+            return True
         except Exception as e:
-            logger.error(f"Ошибка чтения {file_path}: {e}")
-            return []
+            logger.error(f"Ошибка переноса сделок в архив: {e}")
+            return False
+
+    def compact_if_needed(self) -> None:
+        """Фоновое обслуживание хранилища (ротация архива и сжатие журналов)."""
+        self.rotate_closed_days()
+        self.storage.compact_if_needed()
+
+    def flush(self) -> None:
+        """Сбросить накопленные изменения на диск."""
+        self.storage.flush()
 
-    def _write_jsonl(self, file_path: Path, data: List[Dict[str, Any]]) -> None:
-        """Запись данных в JSON Lines файл."""
+    def apply(self, calls: List[Tuple[str, tuple, dict]]) -> List[Any]:
+        """Применить набор изменяющих вызовов как одно целое.
+
+        Методы Database сообщают об ошибке возвратом False: такой шаг отменяет весь набор,
+        и тогда для каждого вызова возвращается False.
+        """
+        tables = {table for name, _, _ in calls for table in WRITE_TABLES[name]}
+        results = []
         try:
-            with file_path.open("w", encoding="utf-8") as f:
-                for item in data:
-                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            with self.storage.batch(tables):
+                for name, args, kwargs in calls:
+                    result = getattr(self, name)(*args, **kwargs)
+                    if result is False:
+                        raise TransactionAborted(f"{name}{args} не выполнен")
+                    results.append(result)
         except Exception as e:
-            logger.error(f"Ошибка записи {file_path}: {e}")
+            logger.error(f"Транзакция отменена: {e}")
+            return [False] * len(calls)
+        return results
 
     def add_merchant(self, name: str, display_name: str, chat_id: Optional[int] = None, handler_id: Optional[int] = None) -> bool:
         """Добавить мерчанта."""
         try:
-            merchants = self._read_jsonl(self.files["merchants"])
-            if any(m["name"] == name for m in merchants):
+            if self.storage.select("merchants", "name", name):
                 logger.warning(f"Мерчант {name} уже существует")
                 return False
-            merchants.append({
+            self.storage.insert("merchants", {
                 "name": name,
                 "display_name": display_name,
                 "chat_id": chat_id,
                 "merchant_id": str(uuid.uuid4()),
                 "handler_id": handler_id
             })
-            self._write_jsonl(self.files["merchants"], merchants)
             logger.info(f"Добавлен мерчант {name}")
             return True
         except Exception as e:
@@ -73,12 +167,10 @@ class Database:
     def delete_merchant(self, name: str) -> bool:
         """Удалить мерчанта."""
         try:
-            merchants = self._read_jsonl(self.files["merchants"])
-            new_merchants = [m for m in merchants if m["name"] != name]
-            if len(new_merchants) == len(merchants):
+            if not self.storage.select("merchants", "name", name):
                 logger.warning(f"Мерчант {name} не найден")
                 return False
-            self._write_jsonl(self.files["merchants"], new_merchants)
+            self.storage.delete("merchants", {"name": name})
             logger.info(f"Удалён мерчант {name}")
             return True
         except Exception as e:
@@ -87,35 +179,33 @@ class Database:
 
     def get_merchant(self, chat_id: Optional[int] = None, name: Optional[str] = None) -> Dict[str, Any]:
         """Получить мерчанта по chat_id или name."""
-        merchants = self._read_jsonl(self.files["merchants"])
-        for merchant in merchants:
-            if (chat_id and merchant.get("chat_id") == chat_id) or (name and merchant["name"] == name):
-                return merchant
-        return {}
+        merchant = self._first("merchants", "chat_id", chat_id) if chat_id else {}
+        if not merchant and name:
+            merchant = self._first("merchants", "name", name)
+        return merchant
 
     def get_merchants(self) -> List[Dict[str, Any]]:
         """Получить всех мерчантов."""
-        return self._read_jsonl(self.files["merchants"])
+        return self.storage.all("merchants")
 
     def merge_cascade(self, name: str, display_name: str, chat_id: Optional[int] = None, needs_external_id: Optional[bool] = None) -> bool:
         """Добавить или обновить интегратора."""
         try:
-            cascades = self._read_jsonl(self.files["cascades"])
-            existing = next((c for c in cascades if c["name"] == name), None)
-            if existing:
-                existing["display_name"] = display_name
+            if self.storage.select("cascades", "name", name):
+                fields: Dict[str, Any] = {"display_name": display_name}
                 if chat_id is not None:
-                    existing["chat_id"] = chat_id
+                    fields["chat_id"] = chat_id
                 if needs_external_id is not None:
-                    existing["needs_external_id"] = needs_external_id
+                    fields["needs_external_id"] = needs_external_id
+                self.storage.patch("cascades", {"name": name}, fields)
             else:
-                cascades.append({
+                self.storage.insert("cascades", {
                     "name": name,
                     "display_name": display_name,
                     "chat_id": chat_id,
                     "needs_external_id": needs_external_id if needs_external_id is not None else False
                 })
-            self._write_jsonl(self.files["cascades"], cascades)
+            self.cascades_version += 1
             logger.info(f"Обновлён/добавлен интегратор {name}")
             return True
         except Exception as e:
@@ -125,12 +215,11 @@ class Database:
     def delete_cascade(self, name: str) -> bool:
         """Удалить интегратора."""
         try:
-            cascades = self._read_jsonl(self.files["cascades"])
-            new_cascades = [c for c in cascades if c["name"] != name]
-            if len(new_cascades) == len(cascades):
+            if not self.storage.select("cascades", "name", name):
                 logger.warning(f"Интегратор {name} не найден")
                 return False
-            self._write_jsonl(self.files["cascades"], new_cascades)
+            self.storage.delete("cascades", {"name": name})
+            self.cascades_version += 1
             logger.info(f"Удалён интегратор {name}")
             return True
         except Exception as e:
@@ -139,16 +228,19 @@ class Database:
 
     def get_cascades(self) -> List[Dict[str, Any]]:
         """Получить всех интеграторов."""
-        return self._read_jsonl(self.files["cascades"])
+        return self.storage.all("cascades")
+
+    def get_cascade(self, chat_id: int) -> Dict[str, Any]:
+        """Получить интегратора по chat_id."""
+        return self._first("cascades", "chat_id", chat_id)
 
     def add_deal(self, deal_id: str, merchant_chat_id: int, message_id: int, status: str, sent_time: float, merchant_id: str, handler_id: int) -> bool:
         """Добавить сделку."""
         try:
-            deals = self._read_jsonl(self.files["deals"])
-            if any(d["deal_id"] == deal_id for d in deals):
+            if self.storage.select("deals", "deal_id", deal_id):
                 logger.warning(f"Сделка {deal_id} уже существует")
                 return False
-            deals.append({
+            self.storage.insert("deals", {
                 "deal_id": deal_id,
                 "merchant_chat_id": merchant_chat_id,
                 "message_id": message_id,
@@ -157,30 +249,31 @@ class Database:
                 "merchant_id": merchant_id,
                 "handler_id": handler_id
             })
-            self._write_jsonl(self.files["deals"], deals)
             logger.info(f"Добавлена сделка {deal_id}")
             return True
         except Exception as e:
             logger.error(f"Ошибка добавления сделки {deal_id}: {e}")
             return False
 
-    def get_deals(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Получить сделки по статусу."""
-        deals = self._read_jsonl(self.files["deals"])
+    def get_deals(self, status: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Получить сделки по статусу (с архивом за дни start..end, если указаны)."""
         if status:
-            return [d for d in deals if d["status"] == status]
-        return deals
+            deals = self.storage.select("deals", "status", status)
+        else:
+            deals = self.storage.all("deals")
+        return self._with_archive("deals", deals, start, end, lambda d: not status or d["status"] == status)
+
+    def get_deal(self, deal_id: str) -> Dict[str, Any]:
+        """Получить сделку по deal_id."""
+        return self._first("deals", "deal_id", deal_id)
 
     def update_deal_status(self, deal_id: str, status: str) -> bool:
         """Обновить статус сделки."""
         try:
-            deals = self._read_jsonl(self.files["deals"])
-            for deal in deals:
-                if deal["deal_id"] == deal_id:
-                    deal["status"] = status
-                    self._write_jsonl(self.files["deals"], deals)
-                    logger.info(f"Обновлён статус сделки {deal_id} на {status}")
-                    return True
+            if self.storage.select("deals", "deal_id", deal_id):
+                self.storage.patch("deals", {"deal_id": deal_id}, {"status": status})
+                logger.info(f"Обновлён статус сделки {deal_id} на {status}")
+                return True
             logger.warning(f"Сделка {deal_id} не найдена")
             return False
         except Exception as e:
@@ -190,24 +283,29 @@ class Database:
     def add_message(self, deal_id: str, chat_id: int, message_id: int, user_id: int, sent_time: float) -> bool:
         """Добавить сообщение."""
         try:
-            messages = self._read_jsonl(self.files["messages"])
-            messages.append({
+            self.storage.insert("messages", {
                 "deal_id": deal_id,
                 "chat_id": chat_id,
                 "message_id": message_id,
                 "user_id": user_id,
                 "sent_time": sent_time
             })
-            self._write_jsonl(self.files["messages"], messages)
             logger.info(f"Добавлено сообщение для сделки {deal_id}")
             return True
         except Exception as e:
             logger.error(f"Ошибка добавления сообщения для {deal_id}: {e}")
             return False
 
-    def get_messages(self, deal_id: Optional[str] = None, chat_id: Optional[int] = None, message_id: Optional[int] = None) -> List[Dict[str, Any]]:
-        """Получить сообщения по deal_id, chat_id или message_id."""
-        messages = self._read_jsonl(self.files["messages"])
+    def get_messages(self, deal_id: Optional[str] = None, chat_id: Optional[int] = None, message_id: Optional[int] = None,
+                     start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Получить сообщения по deal_id, chat_id или message_id (с архивом за дни start..end, если указаны)."""
+        if chat_id and message_id:
+            messages = self.storage.select("messages", "chat_message", chat_id, message_id)
+        elif deal_id:
+            messages = self.storage.select("messages", "deal_id", deal_id)
+        else:
+            messages = self.storage.all("messages")
+        messages = self._with_archive("messages", messages, start, end)
         if deal_id:
             messages = [m for m in messages if m["deal_id"] == deal_id]
         if chat_id:
@@ -219,21 +317,20 @@ class Database:
     def add_stat(self, user_id: int, stat_type: str, merchant_name: str, count: int = 1) -> bool:
         """Добавить статистику."""
         try:
-            stats = self._read_jsonl(self.files["stats"])
             date = datetime.now(pytz.timezone("Europe/Moscow")).strftime("%Y-%m-%d")
-            existing = next((s for s in stats if s["user_id"] == user_id and s["date"] == date), None)
+            existing = self._first("stats", "user_date", user_id, date)
             if existing:
-                existing[stat_type] = existing.get(stat_type, 0) + count
+                fields: Dict[str, Any] = {stat_type: existing.get(stat_type, 0) + count}
                 if merchant_name not in existing.get("merchants", []):
-                    existing["merchants"] = existing.get("merchants", []) + [merchant_name]
+                    fields["merchants"] = existing.get("merchants", []) + [merchant_name]
+                self.storage.patch("stats", {"user_id": user_id, "date": date}, fields)
             else:
-                stats.append({
+                self.storage.insert("stats", {
                     "user_id": user_id,
                     "date": date,
                     stat_type: count,
                     "merchants": [merchant_name] if merchant_name else []
                 })
-            self._write_jsonl(self.files["stats"], stats)
             logger.info(f"Добавлена статистика {stat_type} для {user_id}")
             return True
         except Exception as e:
@@ -242,25 +339,19 @@ class Database:
 
     def get_stats(self, user_id: int, date: str) -> Dict[str, Any]:
         """Получить статистику за день."""
-        stats = self._read_jsonl(self.files["stats"])
-        for stat in stats:
-            if stat["user_id"] == user_id and stat["date"] == date:
-                return stat
-        return {}
+        return self._first("stats", "user_date", user_id, date)
 
     def save_user_token(self, user_id: int, token: Optional[str]) -> bool:
         """Сохранить или удалить токен пользователя."""
         try:
-            users = self._read_jsonl(self.files["users"])
-            existing = next((u for u in users if u["user_id"] == user_id), None)
+            existing = self._first("users", "user_id", user_id)
             if existing:
                 if token is None:
-                    users = [u for u in users if u["user_id"] != user_id]
+                    self.storage.delete("users", {"user_id": user_id})
                 else:
-                    existing["token"] = token
+                    self.storage.patch("users", {"user_id": user_id}, {"token": token})
             elif token:
-                users.append({"user_id": user_id, "token": token})
-            self._write_jsonl(self.files["users"], users)
+                self.storage.insert("users", {"user_id": user_id, "token": token})
             logger.info(f"Обновлён токен для пользователя {user_id}")
             return True
         except Exception as e:
@@ -269,30 +360,24 @@ class Database:
 
     def get_user(self, user_id: int) -> Dict[str, Any]:
         """Получить пользователя."""
-        users = self._read_jsonl(self.files["users"])
-        for user in users:
-            if user["user_id"] == user_id:
-                return user
-        return {}
+        return self._first("users", "user_id", user_id)
 
     def get_users(self) -> List[Dict[str, Any]]:
         """Получить всех пользователей."""
-        return self._read_jsonl(self.files["users"])
+        return self.storage.all("users")
 
     def add_appeal(self, deal_id: str, user_id: int, is_manual: bool) -> bool:
         """Добавить апелляцию."""
         try:
-            appeals = self._read_jsonl(self.files["appeals"])
-            if any(a["deal_id"] == deal_id for a in appeals):
+            if self.storage.select("appeals", "deal_id", deal_id):
                 logger.warning(f"Апелляция для {deal_id} уже существует")
                 return False
-            appeals.append({
+            self.storage.insert("appeals", {
                 "deal_id": deal_id,
                 "user_id": user_id,
                 "is_manual": is_manual,
                 "created_at": datetime.now(pytz.timezone("Europe/Moscow")).timestamp()
             })
-            self._write_jsonl(self.files["appeals"], appeals)
             logger.info(f"Добавлена апелляция для {deal_id}")
             return True
         except Exception as e:
@@ -301,45 +386,41 @@ class Database:
 
     def get_appeals(self, deal_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Получить апелляции."""
-        appeals = self._read_jsonl(self.files["appeals"])
         if deal_id:
-            return [a for a in appeals if a["deal_id"] == deal_id]
-        return appeals
+            return self.storage.select("appeals", "deal_id", deal_id)
+        return self.storage.all("appeals")
 
     def add_sla_notification(self, deal_id: str, message_id: int, sent: bool) -> bool:
         """Добавить SLA-уведомление."""
         try:
-            sla_notifications = self._read_jsonl(self.files["sla_notifications"])
-            sla_notifications.append({
+            self.storage.insert("sla_notifications", {
                 "deal_id": deal_id,
                 "message_id": message_id,
                 "sent": sent,
                 "sent_time": datetime.now(pytz.timezone("Europe/Moscow")).timestamp()
             })
-            self._write_jsonl(self.files["sla_notifications"], sla_notifications)
             logger.info(f"Добавлено SLA-уведомление для {deal_id}")
             return True
         except Exception as e:
             logger.error(f"Ошибка добавления SLA-уведомления для {deal_id}: {e}")
             return False
 
-    def get_sla_notifications(self, deal_id: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Получить SLA-уведомления."""
-        sla_notifications = self._read_jsonl(self.files["sla_notifications"])
+    def get_sla_notifications(self, deal_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Получить SLA-уведомления (с архивом за дни start..end, если указаны)."""
         if deal_id:
-            return [n for n in sla_notifications if n["deal_id"] == deal_id]
-        return sla_notifications
+            notifications = self.storage.select("sla_notifications", "deal_id", deal_id)
+        else:
+            notifications = self.storage.all("sla_notifications")
+        return self._with_archive("sla_notifications", notifications, start, end, lambda n: not deal_id or n["deal_id"] == deal_id)
 
     def add_shift(self, user_id: int, start_time: float, end_time: Optional[float] = None) -> bool:
         """Добавить смену."""
         try:
-            shifts = self._read_jsonl(self.files["shifts"])
-            shifts.append({
+            self.storage.insert("shifts", {
                 "user_id": user_id,
                 "start_time": start_time,
                 "end_time": end_time
             })
-            self._write_jsonl(self.files["shifts"], shifts)
             logger.info(f"Добавлена смена для {user_id}")
             return True
         except Exception as e:
@@ -348,56 +429,243 @@ class Database:
 
     def get_shifts(self, user_id: int) -> List[Dict[str, Any]]:
         """Получить смены пользователя."""
-        shifts = self._read_jsonl(self.files["shifts"])
-        return [s for s in shifts if s["user_id"] == user_id]
+        return self.storage.select("shifts", "user_id", user_id)
 
     def add_proof_message(self, deal_id: str, message_id: int) -> bool:
         """Добавить сообщение с доказательствами."""
         try:
-            proof_messages = self._read_jsonl(self.files["proof_messages"])
-            proof_messages.append({
+            self.storage.insert("proof_messages", {
                 "deal_id": deal_id,
                 "message_id": message_id,
                 "created_at": datetime.now(pytz.timezone("Europe/Moscow")).timestamp()
             })
-            self._write_jsonl(self.files["proof_messages"], proof_messages)
             logger.info(f"Добавлено доказательство для {deal_id}")
             return True
         except Exception as e:
             logger.error(f"Ошибка добавления доказательства для {deal_id}: {e}")
             return False
 
-    def get_proof_messages(self, deal_id: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Получить сообщения с доказательствами."""
-        proof_messages = self._read_jsonl(self.files["proof_messages"])
+    def get_proof_messages(self, deal_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Получить сообщения с доказательствами (с архивом за дни start..end, если указаны)."""
         if deal_id:
-            return [p for p in proof_messages if p["deal_id"] == deal_id]
-        return proof_messages
+            proofs = self.storage.select("proof_messages", "deal_id", deal_id)
+        else:
+            proofs = self.storage.all("proof_messages")
+        return self._with_archive("proof_messages", proofs, start, end, lambda p: not deal_id or p["deal_id"] == deal_id)
+
+    def save_deferred_job(self, job_key: str, kind: str, due: float, payload: Dict[str, Any]) -> bool:
+        """Сохранить отложенную задачу (задача с тем же ключом заменяется)."""
+        try:
+            row = {"job_key": job_key, "kind": kind, "due": due, "payload": payload}
+            if self.storage.select("deferred_jobs", "job_key", job_key):
+                self.storage.patch("deferred_jobs", {"job_key": job_key}, row)
+            else:
+                self.storage.insert("deferred_jobs", row)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения отложенной задачи {job_key}: {e}")
+            return False
+
+    def delete_deferred_job(self, job_key: str) -> bool:
+        """Удалить отложенную задачу."""
+        try:
+            if self.storage.select("deferred_jobs", "job_key", job_key):
+                self.storage.delete("deferred_jobs", {"job_key": job_key})
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка удаления отложенной задачи {job_key}: {e}")
+            return False
+
+    def get_deferred_jobs(self) -> List[Dict[str, Any]]:
+        """Получить все отложенные задачи."""
+        return self.storage.all("deferred_jobs")
 
-    def delete_deals_except(self, status: str) -> bool:
-        """Удалить все сделки, кроме указанного статуса."""
+    def archive_deals_except(self, status: str) -> bool:
+        """Перенести в архив все сделки, кроме указанного статуса."""
         try:
-            deals = self._read_jsonl(self.files["deals"])
-            new_deals = [d for d in deals if d["status"] == status]
-            self._write_jsonl(self.files["deals"], new_deals)
-            logger.info(f"Удалены сделки, кроме статуса {status}")
+            deals = [d for d in self.storage.all("deals") if d["status"] != status]
+            logger.info(f"Перенесено в архив {self._archive_deals(deals)} сделок, кроме статуса {status}")
             return True
         except Exception as e:
-            logger.error(f"Ошибка удаления сделок: {e}")
+            logger.error(f"Ошибка переноса сделок в архив: {e}")
             return False
 
     def update_merchant_handler(self, merchant_name: str, handler_id: int) -> bool:
         """Обновить handler_id для мерчанта."""
         try:
-            merchants = self._read_jsonl(self.files["merchants"])
-            for merchant in merchants:
-                if merchant["name"] == merchant_name:
-                    merchant["handler_id"] = handler_id
-                    self._write_jsonl(self.files["merchants"], merchants)
-                    logger.info(f"Обновлён handler_id для мерчанта {merchant_name}")
-                    return True
+            if self.storage.select("merchants", "name", merchant_name):
+                self.storage.patch("merchants", {"name": merchant_name}, {"handler_id": handler_id})
+                logger.info(f"Обновлён handler_id для мерчанта {merchant_name}")
+                return True
             logger.warning(f"Мерчант {merchant_name} не найден")
             return False
         except Exception as e:
             logger.error(f"Ошибка обновления handler_id для {merchant_name}: {e}")
-            return False
\ No newline at end of file
+            return False
+
+
+class Transaction:
+    """Изменения, накопленные внутри AsyncDatabase.transaction().
+
+    Поддерживает изменяющие методы Database (add_deal, add_message, add_stat,
+    update_deal_status, ...), но только запоминает вызовы. Результаты вызовов
+    появляются в results после фиксации.
+    """
+
+    def __init__(self):
+        self.calls: List[Tuple[str, tuple, dict]] = []
+        self.results: List[Any] = []
+
+    @property
+    def tables(self) -> Tuple[str, ...]:
+        """Таблицы, которые затрагивает транзакция."""
+        return tuple(sorted({table for name, _, _ in self.calls for table in WRITE_TABLES[name]}))
+
+    def __getattr__(self, name: str) -> Callable:
+        if name not in WRITE_TABLES:
+            raise AttributeError(f"Метод {name} нельзя вызвать в транзакции")
+
+        def stage(*args, **kwargs) -> None:
+            self.calls.append((name, args, kwargs))
+        return stage
+
+
+class GroupCommitWriter:
+    """Групповая фиксация изменений.
+
+    Изменения всех обработчиков за короткое окно сбрасываются на диск одним
+    flush() хранилища, после чего ожидающие вызовы завершаются.
+    """
+
+    def __init__(self, flush: Callable[[], Any], window: float):
+        """flush — корутина-функция, сбрасывающая буфер хранилища."""
+        self.flush = flush
+        self.window = window
+        self._waiters: List[asyncio.Future] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def commit(self) -> None:
+        """Дождаться, пока уже применённые изменения станут долговечными."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_later())
+        await waiter
+
+    async def _flush_later(self) -> None:
+        """Подождать окно, забрать накопившихся ожидающих и сбросить буфер."""
+        await asyncio.sleep(self.window)
+        self._task = None
+        await self._flush_waiters()
+
+    async def drain(self) -> None:
+        """Дождаться всех запланированных сбросов, чтобы ни одна подтверждаемая запись не потерялась."""
+        while self._task is not None:
+            await self._task
+        if self._waiters:
+            await self._flush_waiters()
+
+    async def _flush_waiters(self) -> None:
+        """Сбросить буфер и завершить накопившихся ожидающих."""
+        waiters, self._waiters = self._waiters, []
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка групповой фиксации: {e}")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database.
+
+    Методы те же, что у Database, но возвращают корутины. Ввод-вывод
+    выполняется в отдельном пуле потоков, запись в каждую таблицу
+    сериализуется, чтение идёт параллельно. Если хранилище поддерживает
+    групповую фиксацию, изменяющий вызов завершается после сброса пачки на диск.
+    """
+
+    def __init__(self, db: Optional[Database] = None, workers: int = DB_EXECUTOR_WORKERS, commit_window_ms: int = DB_GROUP_COMMIT_MS):
+        """Инициализация пула потоков и блокировок таблиц."""
+        self.db = db or Database()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self._locks = {table: asyncio.Lock() for table in TABLES}
+        self.writer: Optional[GroupCommitWriter] = None
+        if self.db.storage.group_commit:
+            self.writer = GroupCommitWriter(lambda: self._run(self.db.flush), commit_window_ms / 1000)
+        self._listeners: List[Callable[[str, tuple, dict], None]] = []
+
+    def add_listener(self, listener: Callable[[str, tuple, dict], None]) -> None:
+        """Подписаться на изменения: listener(метод, args, kwargs) вызывается после каждой записи."""
+        self._listeners.append(listener)
+
+    def _notify(self, calls: List[Tuple[str, tuple, dict]]) -> None:
+        """Сообщить подписчикам о выполненных изменениях."""
+        for listener in self._listeners:
+            for name, args, kwargs in calls:
+                try:
+                    listener(name, args, kwargs)
+                except Exception as e:
+                    logger.error(f"Ошибка подписчика изменений базы на {name}: {e}")
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        """Выполнить функцию в пуле потоков базы."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Transaction]:
+        """Накопить изменения нескольких таблиц и применить их одной фиксацией.
+
+        Если блок завершился исключением или один из шагов не выполнен (вернул False),
+        ни одно изменение не применяется.
+        """
+        tx = Transaction()
+        yield tx
+        if tx.calls:
+            tx.results = await self._write(tx.tables, self.db.apply, tx.calls)
+            if all(result is not False for result in tx.results):
+                self._notify(tx.calls)
+
+    async def _write(self, tables: Tuple[str, ...], func: Callable, *args, **kwargs) -> Any:
+        """Выполнить изменяющий метод под блокировками его таблиц."""
+        async with AsyncExitStack() as stack:
+            for table in sorted(tables):
+                await stack.enter_async_context(self._locks[table])
+            result = await self._run(func, *args, **kwargs)
+        # Блокировки уже отпущены: следующие записи попадут в ту же пачку
+        if self.writer:
+            await self.writer.commit()
+        return result
+
+    def __getattr__(self, name: str) -> Callable:
+        method = getattr(self.db, name)
+        if name.startswith("_") or not callable(method):
+            return method
+        tables = WRITE_TABLES.get(name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            if tables:
+                result = await self._write(tables, method, *args, **kwargs)
+                self._notify([(name, args, kwargs)])
+                return result
+            return await self._run(method, *args, **kwargs)
+        return call
+
+    async def close(self) -> None:
+        """Дождаться записи и групповой фиксации, затем закрыть пул потоков и хранилище."""
+        async with AsyncExitStack() as stack:
+            # Под всеми блокировками новых записей нет, а завершённые уже ждут фиксации в writer
+            for table in sorted(self._locks):
+                await stack.enter_async_context(self._locks[table])
+            if self.writer:
+                await self.writer.drain()
+            self.executor.shutdown(wait=True)
+            self.db.flush()
+            self.db.storage.close()
@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class DeferredJobs:
+    """Отложенные задачи с ключом вместо ожидания внутри обработчика.
+
+    Задача по уже занятому ключу заменяет прежнюю (правка сообщения переносит его проверку).
+    Задачи одного ключа не выполняются одновременно: срок, наступивший во время выполнения,
+    ждёт его окончания, а cancel() дожидается идущего выполнения.
+    Задачи хранятся в таблице deferred_jobs до выполнения, поэтому переживают перезапуск;
+    просроченные за время простоя выполняются сразу после старта.
+    """
+
+    def __init__(self, db: AsyncDatabase):
+        """Инициализация очереди."""
+        self.db = db
+        self._handlers: Dict[str, JobHandler] = {}
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # (срок, номер, ключ); устаревшие элементы пропускаются по номеру в _current
+        self._heap: List[Tuple[float, int, str]] = []
+        self._current: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        # Ключ -> идущее выполнение
+        self._active: Dict[str, asyncio.Task] = {}
+        self.scheduled = 0
+        self.replaced = 0
+        self.cancelled = 0
+        self.executed = 0
+        self.failed = 0
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """Задать обработчик задач вида kind; он получает payload задачи."""
+        self._handlers[kind] = handler
+
+    async def start(self) -> None:
+        """Загрузить сохранённые задачи и запустить выполнение."""
+        for job in await self.db.get_deferred_jobs():
+            self._push(dict(job))
+        if self._jobs:
+            logger.info(f"Восстановлено отложенных задач: {len(self._jobs)}")
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить выполнение; невыполненные задачи остаются в базе до следующего запуска."""
+        if self._runner:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _push(self, job: Dict[str, Any]) -> None:
+        seq = next(self._seq)
+        self._jobs[job["job_key"]] = job
+        self._current[job["job_key"]] = seq
+        heapq.heappush(self._heap, (job["due"], seq, job["job_key"]))
+        self._wakeup.set()
+
+    async def schedule(self, job_key: str, kind: str, payload: Dict[str, Any], delay: float) -> None:
+        """Запланировать задачу через delay секунд, заменив ожидающую с тем же ключом."""
+        if kind not in self._handlers:
+            raise ValueError(f"Нет обработчика отложенных задач {kind}")
+        if job_key in self._jobs:
+            self.replaced += 1
+        self.scheduled += 1
+        job = {"job_key": job_key, "kind": kind, "due": time.time() + delay, "payload": payload}
+        # Сначала в память: cancel() во время сохранения должен найти задачу. Удаление строки
+        # (после выполнения или отмены) встанет за сохранением в очередь блокировки таблицы
+        self._push(job)
+        await self.db.save_deferred_job(job_key, kind, job["due"], payload)
+
+    async def cancel(self, job_key: str) -> bool:
+        """Отменить ожидающую задачу и дождаться идущего выполнения с тем же ключом; False, если ожидающей нет."""
+        cancelled = self._jobs.pop(job_key, None) is not None
+        if cancelled:
+            self._current.pop(job_key, None)
+            self.cancelled += 1
+            await self.db.delete_deferred_job(job_key)
+        active = self._active.get(job_key)
+        if active:
+            # Отмена вызывающего не прерывает саму задачу
+            await asyncio.wait([active])
+        return cancelled
+
+    async def _run(self) -> None:
+        """Выполнять задачи по сроку."""
+        while True:
+            while self._heap and self._current.get(self._heap[0][2]) != self._heap[0][1]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                timeout = None
+            else:
+                timeout = self._heap[0][0] - time.time()
+                if timeout <= 0:
+                    _, _, job_key = heapq.heappop(self._heap)
+                    del self._current[job_key]
+                    # Пока идёт выполнение с этим ключом, задача ждёт в _jobs и запустится после него
+                    if job_key not in self._active:
+                        self._start(self._jobs.pop(job_key))
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start(self, job: Dict[str, Any]) -> None:
+        task = asyncio.create_task(self._execute(job))
+        self._active[job["job_key"]] = task
+        self._running.add(task)
+        task.add_done_callback(lambda done: self._on_done(job["job_key"], done))
+
+    def _on_done(self, job_key: str, task: asyncio.Task) -> None:
+        """Снять отметку выполнения и вернуть в очередь задачу, срок которой наступил во время него."""
+        self._running.discard(task)
+        if self._active.get(job_key) is task:
+            del self._active[job_key]
+        if job_key in self._jobs and job_key not in self._current:
+            self._push(self._jobs[job_key])
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        """Выполнить задачу и удалить её из базы, если её не перепланировали за это время."""
+        try:
+            await self._handlers[job["kind"]](job["payload"])
+            self.executed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка отложенной задачи {job['job_key']}: {e}")
+        if job["job_key"] not in self._jobs:
+            await self.db.delete_deferred_job(job["job_key"])
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики очереди."""
+        return {
+            "pending": len(self._jobs),
+            "running": len(self._running),
+            "scheduled": self.scheduled,
+            "replaced": self.replaced,
+            "cancelled": self.cancelled,
+            "executed": self.executed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+logger = logging.getLogger(__name__)
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """Собирает части альбома (общий media_group_id) и передаёт обработчику один вызов.
+
+    Telegram присылает альбом отдельными апдейтами на каждое фото. Первый апдейт ждёт,
+    пока части перестанут приходить (window секунд тишины), остальные только добавляются
+    к нему. Обработчик получает сообщение с подписью (или первое) и весь альбом в data["album"].
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not isinstance(event, Message) or not event.media_group_id:
+            return await handler(event, data)
+        key = (event.chat.id, event.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(event)
+            return None
+        album = self._albums[key] = [event]
+        try:
+            size = 0
+            while size != len(album):
+                size = len(album)
+                await asyncio.sleep(self.window)
+        finally:
+            del self._albums[key]
+        album.sort(key=lambda message: message.message_id)
+        logger.debug(f"Альбом {event.media_group_id} в чате {event.chat.id}: {len(album)} сообщений")
+        data["album"] = album
+        return await handler(next((message for message in album if message.caption), album[0]), data)
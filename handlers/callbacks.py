@@ -3,8 +3,9 @@ from datetime import datetime
 import pytz
 from aiogram import Router
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Message
-from database import Database
+from database import AsyncDatabase
 from api import PayphoriaAPI
+from outbox import send_in_background, PRIORITY_ADMIN, PRIORITY_CARDS
 from config import RESPONSE_TEMPLATES, CONSTANTS, KEYBOARDS, ADMIN_IDS
 from handlers.utils import send_message_with_media, set_reaction_on_chain, create_keyboard, log_errors, find_integrator_chat, \
     get_media
@@ -14,14 +15,14 @@ logger = logging.getLogger(__name__)
 router = Router()
 
 @router.callback_query(lambda c: c.data.split(":")[0] in ["approve", "reject", "view"])
-async def handle_action(callback: CallbackQuery, db: Database, api: PayphoriaAPI) -> None:
+async def handle_action(callback: CallbackQuery, db: AsyncDatabase, api: PayphoriaAPI) -> None:
     """Обработка действий по сделке."""
 
     callback_action = callback.data.split(":")[0]
 
     callback_origin_deal_id = callback.data.split(":")[1]
 
-    messages = db.get_messages(chat_id=callback.message.chat.id, deal_id=callback_origin_deal_id)
+    messages = await db.get_messages(chat_id=callback.message.chat.id, deal_id=callback_origin_deal_id)
 
     if not messages:
         await callback.message.delete()
@@ -30,16 +31,16 @@ async def handle_action(callback: CallbackQuery, db: Database, api: PayphoriaAPI
     deal_id = callback_origin_deal_id
 
 
-    deal = next((d for d in db.get_deals() if d["deal_id"] == deal_id), None)
+    deal = await db.get_deal(deal_id)
     if not deal:
         await callback.message.delete()
         return
 
     if callback_action == "approve":
-        integrator = await find_integrator_chat(deal_id, api, db)
+        deal_data = await api.get_order(deal_id, callback.from_user.id)
+        integrator = await find_integrator_chat(deal_id, api, db, deal_data)
         # integrator = None
         if integrator:
-            deal_data = await api.get_order(deal_id, callback.from_user.id)
             media = await get_media(callback.message)
 
 
@@ -51,12 +52,14 @@ async def handle_action(callback: CallbackQuery, db: Database, api: PayphoriaAPI
                 RESPONSE_TEMPLATES["deal_info"].format(**deal_data),
                 media,
                 reply_markup=create_keyboard("integrator_approve", {'deal_id': deal_id, 'chat_id': 0}),
+                priority=PRIORITY_CARDS
             )
 
             print(callback.answer().text)
 
-            db.update_deal_status(deal_id, "awaiting_integrator")
-            db.add_stat(callback.from_user.id, "approved", deal_data["merchant_name"])
+            async with db.transaction() as tx:
+                tx.update_deal_status(deal_id, "awaiting_integrator")
+                tx.add_stat(callback.from_user.id, "approved", deal_data["merchant_name"])
 
         else:
 
@@ -73,7 +76,7 @@ async def handle_action(callback: CallbackQuery, db: Database, api: PayphoriaAPI
 
     elif callback_action == "reject":
 
-        message = next((d for d in db.get_deals() if d["deal_id"] == deal_id), None)
+        message = await db.get_deal(deal_id)
 
         merch_chat_id = message['merchant_chat_id']
 
@@ -93,11 +96,11 @@ async def handle_action(callback: CallbackQuery, db: Database, api: PayphoriaAPI
             callback.message.text + "\n" + CONSTANTS["VIEWED"],
             reply_markup=None
         )
-        db.add_stat(callback.from_user.id, "viewed", "N/A")
+        await db.add_stat(callback.from_user.id, "viewed", "N/A")
     await callback.answer()
 
 @router.callback_query(lambda c: c.data.startswith("reason_"))
-async def handle_reject_reason(callback: CallbackQuery, db: Database, api: PayphoriaAPI) -> None:
+async def handle_reject_reason(callback: CallbackQuery, db: AsyncDatabase, api: PayphoriaAPI) -> None:
     """Обработка причины отклонения."""
     reason = callback.data
 
@@ -105,14 +108,14 @@ async def handle_reject_reason(callback: CallbackQuery, db: Database, api: Payph
 
 
 
-    messages = db.get_messages(chat_id=callback.message.chat.id, message_id=callback.message.message_id - 1)
+    messages = await db.get_messages(chat_id=callback.message.chat.id, message_id=callback.message.message_id - 1)
     if not messages:
         await callback.message.delete()
         return
 
 
     deal_id = messages[-1]["deal_id"]
-    deal = next((d for d in db.get_deals() if d["deal_id"] == deal_id), None)
+    deal = await db.get_deal(deal_id)
 
     print(213123123,messages[-1])
 
@@ -132,30 +135,31 @@ async def handle_reject_reason(callback: CallbackQuery, db: Database, api: Payph
 
 
 
-    await set_reaction_on_chain(callback.message.bot, callback.message, ["👎"])
+    await set_reaction_on_chain(callback.message.bot, callback.message, ["👎"], db)
 
 
-    db.update_deal_status(deal_id, "rejected")
-    db.add_stat(callback.from_user.id, "rejected", "completed")
+    async with db.transaction() as tx:
+        tx.update_deal_status(deal_id, "rejected")
+        tx.add_stat(callback.from_user.id, "rejected", "completed")
     for admin_id in ADMIN_IDS:
-        await callback.message.bot.send_message(
+        send_in_background(callback.message.bot.send_message(
             admin_id,
             RESPONSE_TEMPLATES["integrator_reject_notify"].format(deal_id=deal_id, reason_text=reason_text)
-        )
+        ), PRIORITY_ADMIN)
     await callback.message.delete()
     await callback.answer()
 
 @router.callback_query(lambda c: c.data.startswith("integrator_approve"))
-async def handle_integrator_approve(callback: CallbackQuery, db: Database, api: PayphoriaAPI) -> None:
+async def handle_integrator_approve(callback: CallbackQuery, db: AsyncDatabase, api: PayphoriaAPI) -> None:
     """Обработка одобрения интегратором."""
 
     print('await approve')
 
-    messages = db.get_messages(chat_id=callback.message.chat.id, message_id=callback.message.message_id)
+    messages = await db.get_messages(chat_id=callback.message.chat.id, message_id=callback.message.message_id)
     if not messages:
         return
     deal_id = messages[0]["deal_id"]
-    deal = next((d for d in db.get_deals() if d["deal_id"] == deal_id), None)
+    deal = await db.get_deal(deal_id)
     if not deal:
         await callback.message.delete()
         return
@@ -164,15 +168,16 @@ async def handle_integrator_approve(callback: CallbackQuery, db: Database, api:
 
 
 
-    deal_data = await api.get_order(deal_id, callback.from_user.id)
+    deal_data = await api.get_order(deal_id, callback.from_user.id, fresh=True)
     if deal_data and deal_data.get("status") == "success":
         await callback.message.reply(
             deal["merchant_chat_id"],
             RESPONSE_TEMPLATES["deal_completed"].format(deal_id=deal_id)
         )
-        await set_reaction_on_chain(callback.message.bot,callback.message, ["👍"])
-        db.update_deal_status(deal_id, "completed")
-        db.add_stat(callback.from_user.id, "completed", deal_data["merchant_name"])
+        await set_reaction_on_chain(callback.message.bot,callback.message, ["👍"], db)
+        async with db.transaction() as tx:
+            tx.update_deal_status(deal_id, "completed")
+            tx.add_stat(callback.from_user.id, "completed", deal_data["merchant_name"])
         await callback.message.delete()
 
     else:
@@ -183,13 +188,13 @@ async def handle_integrator_approve(callback: CallbackQuery, db: Database, api:
     await callback.answer()
 
 @router.callback_query(lambda c: c.data.startswith("integrator_reject"))
-async def handle_integrator_reject(callback: CallbackQuery, db: Database) -> None:
+async def handle_integrator_reject(callback: CallbackQuery, db: AsyncDatabase) -> None:
     """Обработка отклонения интегратором."""
-    messages = db.get_messages(chat_id=callback.message.chat.id, message_id=callback.message.message_id)
+    messages = await db.get_messages(chat_id=callback.message.chat.id, message_id=callback.message.message_id)
     if not messages:
         return
     deal_id = messages[0]["deal_id"]
-    deal = next((d for d in db.get_deals() if d["deal_id"] == deal_id), None)
+    deal = await db.get_deal(deal_id)
     if not deal:
         await callback.message.delete()
         return
@@ -206,7 +211,7 @@ async def handle_integrator_reject(callback: CallbackQuery, db: Database) -> Non
     await callback.answer()
 
 @router.callback_query(lambda c: c.data.startswith("integrator_proof"))
-async def handle_integrator_proof(callback: CallbackQuery, db: Database) -> None:
+async def handle_integrator_proof(callback: CallbackQuery, db: AsyncDatabase) -> None:
     """Обработка доказательств от интегратора."""
 
     callback_action = callback.data.split(":")[0]
@@ -214,7 +219,7 @@ async def handle_integrator_proof(callback: CallbackQuery, db: Database) -> None
     callback_origin_deal_id = callback.data.split(":")[1]
 
 
-    messages = db.get_messages(chat_id=callback.message.chat.id, deal_id=callback_origin_deal_id)
+    messages = await db.get_messages(chat_id=callback.message.chat.id, deal_id=callback_origin_deal_id)
 
 
     if not messages:
@@ -225,7 +230,7 @@ async def handle_integrator_proof(callback: CallbackQuery, db: Database) -> None
 
     print(message_to_react)
 
-    deal = next((d for d in db.get_deals() if d["deal_id"] == callback_origin_deal_id), None)
+    deal = await db.get_deal(callback_origin_deal_id)
     if not deal:
         await callback.message.delete()
         return
@@ -240,7 +245,7 @@ async def handle_integrator_proof(callback: CallbackQuery, db: Database) -> None
             RESPONSE_TEMPLATES["integrator_proof_sent"].format(deal_id=deal_id),
             media
         )
-        await set_reaction_on_chain(callback.message.bot, callback.message, ["👀"])
+        await set_reaction_on_chain(callback.message.bot, callback.message, ["👀"], db)
         await callback.message.delete()
 
     elif callback.data == "integrator_proof_reject":
@@ -251,13 +256,13 @@ async def handle_integrator_proof(callback: CallbackQuery, db: Database) -> None
     await callback.answer()
 
 @router.callback_query(lambda c: c.data == "YES")
-async def handle_shift_stop_confirm(callback: CallbackQuery, db: Database, message:Message) -> None:
+async def handle_shift_stop_confirm(callback: CallbackQuery, db: AsyncDatabase, message:Message) -> None:
     """Подтверждение завершения смены."""
     date = datetime.now(pytz.timezone("Europe/Moscow")).strftime("%Y-%m-%d")
-    stats = db.get_stats(callback.from_user.id, date)
-    count = len([d for d in db.get_deals() if d["status"] != "awaiting_integrator"])
-    # Удаление сделок (реализация в Database)
-    db.delete_deals_except(status="awaiting_integrator")
+    stats = await db.get_stats(callback.from_user.id, date)
+    count = len([d for d in await db.get_deals() if d["status"] != "awaiting_integrator"])
+    # Перенос закрытых сделок в архив (реализация в Database)
+    await db.archive_deals_except(status="awaiting_integrator")
     await callback.message.bot.send_message(
         callback.message.chat.id,
         RESPONSE_TEMPLATES["shift_stop_report"].format(
@@ -289,11 +294,11 @@ async def handle_shift_stop_cancel(callback: CallbackQuery) -> None:
     await callback.answer()
 
 @router.callback_query(lambda c: c.data.startswith("merchant_"))
-async def _handle_merchant_select(callback: CallbackQuery, db: Database) -> None:
+async def _handle_merchant_select(callback: CallbackQuery, db: AsyncDatabase) -> None:
     """Выбор мерчанта."""
 
     merchant_name = callback.data[len("merchant_"):]  # Получаем имя мерчанта
-    merchant = db.get_merchant(name=merchant_name)  # Получаем информацию о мерчанте
+    merchant = await db.get_merchant(name=merchant_name)  # Получаем информацию о мерчанте
 
     buttons = []
 
@@ -301,13 +306,13 @@ async def _handle_merchant_select(callback: CallbackQuery, db: Database) -> None
     if merchant:
         if merchant["handler_id"] is None:
             # Если handler_id пустой, устанавливаем его на текущего пользователя
-            db.update_merchant_handler(merchant["name"], callback.from_user.id)
+            await db.update_merchant_handler(merchant["name"], callback.from_user.id)
             await callback.message.edit_text(f"Мерчант {merchant['display_name']} выбран.")
         else:
             # Если handler_id уже установлен, убираем его (устанавливаем на null)
-            db.update_merchant_handler(merchant["name"], None)
+            await db.update_merchant_handler(merchant["name"], None)
             await callback.message.edit_text(f"Мерчант {merchant['display_name']} отменен.")
-    merchants = db.get_merchants()
+    merchants = await db.get_merchants()
     # Обновляем клавиатуру после изменения состояния
     for m in merchants:
         is_selected = m['handler_id'] == callback.from_user.id  # Проверяем, выбран ли мерчант
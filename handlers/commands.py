@@ -4,8 +4,10 @@ from aiogram import Router, F, Dispatcher
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton,BotCommand
 from aiogram.filters import Command, CommandStart, Filter, or_f
 from config import HELP_TEXT, ADMIN_COMMANDS, ADMIN_IDS, RESPONSE_TEMPLATES, CONSTANTS
-from database import Database
+from database import AsyncDatabase
+from api import PayphoriaAPI
 from handlers.utils import require_auth, require_admin, create_keyboard,send_message_with_media
+from handlers.tasks import reconcile_stats
 import logging
 logger = logging.getLogger(__name__)
 
@@ -29,9 +31,9 @@ async def cmd_help(message: Message, **kwargs) -> None:
 
 @router.message(Command("merchant_list"))
 @require_auth
-async def cmd_merchant_list(message: Message, db: Database, **kwargs) -> None:
+async def cmd_merchant_list(message: Message, db: AsyncDatabase, **kwargs) -> None:
     """Обработка команды /merchant_list."""
-    merchants = db.get_merchants()
+    merchants = await db.get_merchants()
     if not merchants:
         await message.reply("Нет доступных мерчантов.")
         return
@@ -46,25 +48,25 @@ async def cmd_merchant_list(message: Message, db: Database, **kwargs) -> None:
 
 @router.message(Command("shift_start"))
 @require_auth
-async def cmd_shift_start(message: Message, db: Database, **kwargs) -> None:
+async def cmd_shift_start(message: Message, db: AsyncDatabase, **kwargs) -> None:
     """Обработка команды /shift_start."""
-    db.add_shift(message.from_user.id, datetime.now().timestamp())
-    db.add_stat(message.from_user.id, "taken", "N/A")
+    await db.add_shift(message.from_user.id, datetime.now().timestamp())
+    await db.add_stat(message.from_user.id, "taken", "N/A")
     await message.reply(RESPONSE_TEMPLATES["shift_start"].format(time=datetime.now(pytz.timezone("Europe/Moscow")).strftime("%H:%M:%S")))
 
 @router.message(Command("shift_stop"))
 @require_auth
-async def cmd_shift_stop(message: Message, db: Database, **kwargs) -> None:
+async def cmd_shift_stop(message: Message, db: AsyncDatabase, **kwargs) -> None:
     """Обработка команды /shift_stop."""
     await message.reply(RESPONSE_TEMPLATES["shift_stop_confirm"], reply_markup=create_keyboard("yes_no"))
 
 @router.message(Command("stats"))
 @require_auth
-async def cmd_stats(message: Message, db: Database, **kwargs) -> None:
+async def cmd_stats(message: Message, db: AsyncDatabase, **kwargs) -> None:
     """Обработка команды /stats."""
     date = datetime.now(pytz.timezone("Europe/Moscow")).strftime("%Y-%m-%d")
-    stats = db.get_stats(message.from_user.id, date)
-    pending_deals = "\n".join([f"<code>{d['deal_id']}</code>" for d in db.get_deals(status="awaiting_integrator")])
+    stats = await db.get_stats(message.from_user.id, date)
+    pending_deals = "\n".join([f"<code>{d['deal_id']}</code>" for d in await db.get_deals(status="awaiting_integrator")])
     await message.reply(
         RESPONSE_TEMPLATES["stats"].format(
             date=date,
@@ -85,19 +87,19 @@ async def cmd_stats(message: Message, db: Database, **kwargs) -> None:
 
 @router.message(Command("get_chats"))
 @require_auth
-async def cmd_get_chats(message: Message, db: Database, **kwargs) -> None:
+async def cmd_get_chats(message: Message, db: AsyncDatabase, **kwargs) -> None:
     """Обработка команды /get_chats."""
-    merchants = db.get_merchants()
-    cascades = db.get_cascades()
+    merchants = await db.get_merchants()
+    cascades = await db.get_cascades()
     chats = [f"Мерчант: {m['display_name']} ({m['chat_id']})" for m in merchants] + \
             [f"Интегратор: {c['display_name']} ({c['chat_id']})" for c in cascades]
     await message.reply("\n".join(chats) or CONSTANTS["NO_CHAT"])
 
 @router.message(Command("list_cascades"))
 @require_auth
-async def cmd_get_cascades(message: Message, db: Database, **kwargs) -> None:
+async def cmd_get_cascades(message: Message, db: AsyncDatabase, **kwargs) -> None:
     """Обработка команды /get_cascades."""
-    cascades = db.get_cascades()
+    cascades = await db.get_cascades()
 
     if not cascades:
         await send_message_with_media(
@@ -126,7 +128,7 @@ async def cmd_get_cascades(message: Message, db: Database, **kwargs) -> None:
 
 @router.message(Command("link"))
 @require_admin
-async def cmd_link(message: Message, db: Database, **kwargs) -> None:
+async def cmd_link(message: Message, db: AsyncDatabase, **kwargs) -> None:
     """Обработка команды /link."""
     args = message.text.split()[1:]
     if len(args) < 2 or args[0].lower() not in ["m", "i"]:
@@ -135,18 +137,42 @@ async def cmd_link(message: Message, db: Database, **kwargs) -> None:
     chat_type, name = args[0], args[1]
     chat_id = int(args[2]) if len(args) > 2 else message.chat.id
     if chat_type == "m":
-        db.add_merchant(name, name, chat_id=chat_id)
+        await db.add_merchant(name, name, chat_id=chat_id)
     else:
-        db.merge_cascade(name, name, chat_id=chat_id)
+        await db.merge_cascade(name, name, chat_id=chat_id)
     await message.reply(f"✅ Чат привязан к {name}")
 
 
+@router.message(Command("api_stats"))
+@require_admin
+async def cmd_api_stats(message: Message, api: PayphoriaAPI, **kwargs) -> None:
+    """Обработка команды /api_stats."""
+    lines = []
+    sections = dict(api.stats())
+    sections["reconcile"] = reconcile_stats()
+    if kwargs.get("outbox"):
+        sections.update({f"telegram_{name}": values for name, values in kwargs["outbox"].stats().items()})
+    if kwargs.get("deferred"):
+        sections["deferred"] = kwargs["deferred"].stats()
+    if kwargs.get("sla"):
+        sections["sla"] = kwargs["sla"].stats()
+    if kwargs.get("scheduler"):
+        sections.update({f"job_{name}": values for name, values in kwargs["scheduler"].stats().items()})
+    for section, values in sections.items():
+        lines.append(f"<b>{section}</b>")
+        for name, value in values.items():
+            if isinstance(value, dict):
+                value = ", ".join(f"{k}={v}" for k, v in value.items())
+            lines.append(f"  {name}: {value}")
+    await message.reply("\n".join(lines), parse_mode="HTML")
+
+
 
 # Преобразуем команды в объекты BotCommand
 
 @router.message(Command("/add_merchant"))
 @require_admin
-async def cmd_admin(message: Message, db: Database, **kwargs) -> None:
+async def cmd_admin(message: Message, db: AsyncDatabase, **kwargs) -> None:
 
 
     """Обработка админ-команд."""
@@ -162,7 +188,7 @@ async def cmd_admin(message: Message, db: Database, **kwargs) -> None:
             if len(args) < required_args:
                 await message.reply(f"Формат: /{cmd} {' '.join(['<arg>' for _ in range(required_args)])}")
                 return
-            result = ADMIN_COMMANDS[cmd]["action"](db, args)
+            result = await ADMIN_COMMANDS[cmd]["action"](db, args)
             if result:
                 await message.reply(ADMIN_COMMANDS[cmd]["success"].format(*args))
             else:
@@ -2,17 +2,18 @@ from aiogram import Router
 from aiogram.types import Message
 from datetime import datetime
 import logging
-from database import Database
+from database import AsyncDatabase
 from api import PayphoriaAPI
+from deferred import DeferredJobs
 from .messages import handle_message
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 @router.edited_message()
-async def handle_edited_message(message: Message, db: Database, api: PayphoriaAPI) -> None:
+async def handle_edited_message(message: Message, db: AsyncDatabase, api: PayphoriaAPI, deferred: DeferredJobs | None = None) -> None:
     """Обработка отредактированных сообщений."""
     if not message.edit_date or (message.edit_date - message.date.timestamp()) > 30:
         logger.debug(f"Игнорируем редактирование сообщения {message.message_id} после 30 секунд")
         return
-    await handle_message(message, db, api)
\ No newline at end of file
+    await handle_message(message, db, api, deferred=deferred)
\ No newline at end of file
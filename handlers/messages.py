@@ -1,28 +1,33 @@
-from aiogram import Router, F
+from aiogram import Router, F, Bot
 from aiogram.types import Message
 import asyncio
 import logging
 from datetime import datetime
 import pytz
-from database import Database
+from database import AsyncDatabase
 from api import PayphoriaAPI
-from config import CONSTANTS, RESPONSE_TEMPLATES, IGNORED_USERS
+from outbox import PRIORITY_CARDS
+from deferred import DeferredJobs
+from config import CONSTANTS, RESPONSE_TEMPLATES, IGNORED_USERS, ALBUM_WINDOW_MS, EDIT_TIMEOUT_SECONDS
 from handlers.utils import get_deal_ids, get_media, send_message_with_media, set_reaction_on_chain, create_keyboard, find_integrator_chat
+from handlers.albums import AlbumMiddleware
 
 router = Router()
+router.message.middleware(AlbumMiddleware(ALBUM_WINDOW_MS / 1000))
 logger = logging.getLogger(__name__)
 
 
 
 
-async def process_deal(message: Message, deal_id: str, db: Database, api: PayphoriaAPI, merchant: dict | None) -> None:
-    """Обработка сделки."""
+async def process_deal(message: Message, deal_id: str, db: AsyncDatabase, api: PayphoriaAPI, merchant: dict | None,
+                       album: list[Message] | None = None) -> None:
+    """Обработка сделки (album — все сообщения альбома, если сделку прислали альбомом)."""
     deal_data = await api.get_order(deal_id, message.from_user.id)
     if not deal_data:
         logger.warning(f"Невалидный deal_id: {deal_id}")
         return
     handler_id = merchant["handler_id"] if merchant else list(CONSTANTS["ADMIN_IDS"])[0]
-    media = await get_media(message)
+    media = await get_media(message, album)
 
 
     msg = await send_message_with_media(
@@ -30,45 +35,91 @@ async def process_deal(message: Message, deal_id: str, db: Database, api: Paypho
         str(handler_id),
         RESPONSE_TEMPLATES["deal_info"].format(**deal_data),
         media,
-        reply_markup=create_keyboard("action",{'deal_id':deal_data['deal_id'], 'chat_id':message.chat.id})
+        reply_markup=create_keyboard("action",{'deal_id':deal_data['deal_id'], 'chat_id':message.chat.id}),
+        priority=PRIORITY_CARDS
     )
 
 
-    db.add_deal(
-        deal_id=deal_id,
-        merchant_chat_id=message.chat.id,
-        message_id=message.message_id,
-        status="awaiting",
-        sent_time=message.date.timestamp(),
-        merchant_id=merchant["merchant_id"] if merchant else "",
-        handler_id=handler_id
-    )
-
-    db.add_message(deal_id, handler_id, message.message_id, handler_id, msg.date.timestamp())
-    db.add_stat(handler_id, "taken", deal_data["merchant_name"])
+    # Сделка, её сообщение и статистика сохраняются одной фиксацией
+    async with db.transaction() as tx:
+        tx.add_deal(
+            deal_id=deal_id,
+            merchant_chat_id=message.chat.id,
+            message_id=message.message_id,
+            status="awaiting",
+            sent_time=message.date.timestamp(),
+            merchant_id=merchant["merchant_id"] if merchant else "",
+            handler_id=handler_id
+        )
+        tx.add_message(deal_id, handler_id, message.message_id, handler_id, msg.date.timestamp())
+        tx.add_stat(handler_id, "taken", deal_data["merchant_name"])
 
     if merchant:
         await message.reply(RESPONSE_TEMPLATES["deal_accepted"].format(deal_id=deal_id), parse_mode="HTML")
-        await set_reaction_on_chain(message.bot, message, ["👀"])
+        await set_reaction_on_chain(message.bot, message, ["👀"], db)
+
+
+
+
+
+
+def edit_job_key(message: Message) -> str:
+    """Ключ отложенной проверки сообщения: правка того же сообщения (или любой части альбома) заменяет проверку."""
+    return f"{message.chat.id}:{message.media_group_id or message.message_id}"
+
+
+async def resolve_merchant_media(message: Message, db: AsyncDatabase, api: PayphoriaAPI, merchant: dict,
+                                 album: list[Message] | None = None) -> None:
+    """Медиа мерчанта без deal_id после срока на редактирование: ищем deal_id ещё раз."""
+    deal_id = await get_deal_ids(message, api, db)  # Проверяем цепочку ответов
+    if deal_id:
+        await process_deal(message, deal_id, db, api, merchant, album)
 
+        logger.debug('пользователь отредактировал и добавил deal id ')
 
+    elif any(a["deal_id"] == deal_id for a in await db.get_appeals()):
+        media = await get_media(message, album)
+        msg = await send_message_with_media(
+            message.bot,
+            merchant["handler_id"],
+            RESPONSE_TEMPLATES["proofs_added"].format(deal_id=deal_id),
+            media
+        )
+        async with db.transaction() as tx:
+            tx.add_message(deal_id, merchant["handler_id"], msg.message_id, message.from_user.id, msg.date.timestamp())
+            tx.add_proof_message(deal_id, msg.message_id)
 
 
+def register_jobs(deferred: DeferredJobs, bot: Bot, db: AsyncDatabase, api: PayphoriaAPI) -> None:
+    """Обработчики отложенных задач сообщений."""
+    async def merchant_media(payload: dict) -> None:
+        message = Message.model_validate(payload["message"]).as_(bot)
+        album = [Message.model_validate(part).as_(bot) for part in payload["album"]] if payload.get("album") else None
+        merchant = await db.get_merchant(chat_id=message.chat.id)
+        if merchant:
+            await resolve_merchant_media(message, db, api, merchant, album)
 
+    deferred.register("merchant_media", merchant_media)
 
-async def handle_message(message: Message, db: Database, api: PayphoriaAPI) -> None:
+
+async def handle_message(message: Message, db: AsyncDatabase, api: PayphoriaAPI, album: list[Message] | None = None,
+                         deferred: DeferredJobs | None = None) -> None:
     """Обработка сообщений: сделки, кб внешний, медиа, апелляции."""
     if message.from_user.id in IGNORED_USERS and message.chat.type != "private":
         logger.debug(f"Игнорируем сообщение от {message.from_user.id}")
         return
     if message.sticker:
         return
+    if deferred:
+        # Правка сообщения, ожидающего проверки: новая версия обрабатывается вместо отложенной,
+        # а если проверка уже выполняется — после неё, чтобы сделка не обрабатывалась дважды одновременно
+        await deferred.cancel(edit_job_key(message))
 
     text = message.text or message.caption or ""
-    deal_id = await get_deal_ids(message, api)
+    deal_id = await get_deal_ids(message, api, db)
 
-    merchant = db.get_merchant(chat_id=message.chat.id)
-    cascade = next((c for c in db.get_cascades() if c["chat_id"] == message.chat.id), None)
+    merchant = await db.get_merchant(chat_id=message.chat.id)
+    cascade = await db.get_cascade(chat_id=message.chat.id)
 
     # Обработка "кб внешний"
     if "кб внешний" in text.lower() and deal_id and (merchant or message.chat.type == "private"):
@@ -83,7 +134,7 @@ async def handle_message(message: Message, db: Database, api: PayphoriaAPI) -> N
                 RESPONSE_TEMPLATES["kb_request"].format(deal_id=deal_id),
                 []
             )
-            integrator = await find_integrator_chat(deal_id, api, db)
+            integrator = await find_integrator_chat(deal_id, api, db, deal_data)
 
             if integrator:
                 await send_message_with_media(
@@ -93,23 +144,23 @@ async def handle_message(message: Message, db: Database, api: PayphoriaAPI) -> N
                     []
                 )
             if merchant:
-                await set_reaction_on_chain(message.bot, message, ["⚡️"])
+                await set_reaction_on_chain(message.bot, message, ["⚡️"], db)
         return
 
     # Медиа от интегратора для rejected сделок
 
     if cascade and (message.photo or message.video or message.document):
         if deal_id:
-            deal = next((d for d in db.get_deals() if d["deal_id"] == deal_id and d["status"] == "rejected"), None)
-            if deal:
-                media = await get_media(message)
+            deal = await db.get_deal(deal_id)
+            if deal.get("status") == "rejected":
+                media = await get_media(message, album)
                 await send_message_with_media(
                     message.bot,
                     deal["merchant_chat_id"],
                     RESPONSE_TEMPLATES["integrator_proof_accepted"].format(deal_id=deal_id),
                     []
                 )
-                await set_reaction_on_chain(message.bot, message, ["👀"])
+                await set_reaction_on_chain(message.bot, message, ["👀"], db)
                 msg = await send_message_with_media(
                     message.bot,
                     deal["handler_id"],
@@ -117,8 +168,9 @@ async def handle_message(message: Message, db: Database, api: PayphoriaAPI) -> N
                     media,
                     reply_markup=create_keyboard("integrator_proof")
                 )
-                db.add_message(deal_id, deal["handler_id"], msg.message_id, message.from_user.id, msg.date.timestamp())
-                db.add_proof_message(deal_id, msg.message_id)
+                async with db.transaction() as tx:
+                    tx.add_message(deal_id, deal["handler_id"], msg.message_id, message.from_user.id, msg.date.timestamp())
+                    tx.add_proof_message(deal_id, msg.message_id)
         return
 
 
@@ -127,41 +179,36 @@ async def handle_message(message: Message, db: Database, api: PayphoriaAPI) -> N
 
         logger.debug('добавлено медиа без deal id ')
 
-        await asyncio.sleep(30)  # Ждём 30 секунд на редактирование
-        deal_id = await get_deal_ids(message, api)  # Проверяем цепочку ответов
-        if deal_id:
-            await process_deal(message, deal_id, db, api, merchant)
-
-            logger.debug('пользователь отредактировал и добавил deal id ')
-
-        elif any(a["deal_id"] == deal_id for a in db.get_appeals()):
-            media = await get_media(message)
-            msg = await send_message_with_media(
-                message.bot,
-                merchant["handler_id"],
-                RESPONSE_TEMPLATES["proofs_added"].format(deal_id=deal_id),
-                media
-            )
-            db.add_message(deal_id, merchant["handler_id"], msg.message_id, message.from_user.id, msg.date.timestamp())
-            db.add_proof_message(deal_id, msg.message_id)
+        # Ждём редактирования, не занимая обработчик
+        if deferred:
+            payload = {
+                "message": message.model_dump(mode="json", exclude_none=True),
+                "album": [part.model_dump(mode="json", exclude_none=True) for part in album] if album else None,
+            }
+            await deferred.schedule(edit_job_key(message), "merchant_media", payload, EDIT_TIMEOUT_SECONDS)
+        else:
+            await asyncio.sleep(EDIT_TIMEOUT_SECONDS)
+            await resolve_merchant_media(message, db, api, merchant, album)
         return
 
     # Сделки или ручные апелляции
     if deal_id and (merchant or message.chat.type == "private"):
-        if message.chat.type == "private" and any(a["deal_id"] == deal_id for a in db.get_appeals()):
-            media = await get_media(message)
-            handler_id = next((a["user_id"] for a in db.get_appeals() if a["deal_id"] == deal_id), list(CONSTANTS["ADMIN_IDS"])[0])
+        if message.chat.type == "private" and any(a["deal_id"] == deal_id for a in await db.get_appeals()):
+            media = await get_media(message, album)
+            handler_id = next((a["user_id"] for a in await db.get_appeals() if a["deal_id"] == deal_id), list(CONSTANTS["ADMIN_IDS"])[0])
             msg = await send_message_with_media(
                 message.bot,
                 handler_id,
                 RESPONSE_TEMPLATES["proofs_added"].format(deal_id=deal_id),
                 media
             )
-            db.add_message(deal_id, handler_id, msg.message_id, message.from_user.id, msg.date.timestamp())
-            db.add_proof_message(deal_id, msg.message_id)
+            async with db.transaction() as tx:
+                tx.add_message(deal_id, handler_id, msg.message_id, message.from_user.id, msg.date.timestamp())
+                tx.add_proof_message(deal_id, msg.message_id)
         else:
-            await process_deal(message, deal_id, db, api, merchant)
+            await process_deal(message, deal_id, db, api, merchant, album)
 
 @router.message(F.text | F.caption | F.photo | F.video | F.document)
-async def message_handler(message: Message, db: Database, api: PayphoriaAPI) -> None:
-    await handle_message(message, db, api)
\ No newline at end of file
+async def message_handler(message: Message, db: AsyncDatabase, api: PayphoriaAPI, album: list[Message] | None = None,
+                          deferred: DeferredJobs | None = None) -> None:
+    await handle_message(message, db, api, album, deferred)
\ No newline at end of file
@@ -1,88 +1,172 @@
 from aiogram import Router, Bot
 from aiogram.types import Message, Chat
 import asyncio
-from datetime import datetime
-import pytz
+import random
+import time
 import logging
-from database import Database
+from typing import List, Dict, Any, Tuple, Set
+from database import AsyncDatabase, TransactionAborted
 from api import PayphoriaAPI
-from config import RESPONSE_TEMPLATES, SLA_DAY_SECONDS, SLA_NIGHT_SECONDS, DAY_START, DAY_END, CONSTANTS
+from config import RESPONSE_TEMPLATES, DB_COMPACT_INTERVAL_SECONDS
+from config import WEBHOOK_ENABLED, WEBHOOK_RECONCILE_SECONDS, RECONCILE_CONCURRENCY, RECONCILE_RETRY_BASE_SECONDS, \
+    RECONCILE_RETRY_MAX_SECONDS, RECONCILE_ALERT_FAILURES
+from config import CHECK_DEALS_INTERVAL_SECONDS, CHECK_DEALS_JITTER_SECONDS, CHECK_DEALS_MAX_RUNTIME_SECONDS
+from metrics import LatencyStats
+from scheduler import Scheduler
 from handlers.utils import send_message_with_media, set_reaction_on_chain, log_errors
-from config import HELP_TEXT, ADMIN_COMMANDS, ADMIN_IDS, RESPONSE_TEMPLATES, CONSTANTS
 
 router = Router()
 logger = logging.getLogger(__name__)
 
-def is_day_time() -> bool:
-    """Проверить, дневное ли время (MSK)."""
-    now = datetime.now(pytz.timezone("Europe/Moscow"))
-    day_start = datetime.strptime(DAY_START, "%H:%M").time()
-    day_end = datetime.strptime(DAY_END, "%H:%M").time()
-    return day_start <= now.time() <= day_end
+# Статус сделки в API -> локальный статус, в который переходит сделка, ожидающая интегратора.
+REMOTE_TRANSITIONS = {"success": "completed"}
 
-async def get_sla_timeout(sent_time: float) -> float:
-    """Получить SLA-таймаут."""
-    timeout = SLA_DAY_SECONDS if is_day_time() else SLA_NIGHT_SECONDS
-    return sent_time + timeout
+# Сделки, переход которых сейчас применяется (опрос и вебхук могут прийти одновременно)
+_transitions_in_progress: Set[str] = set()
+# Момент последнего опроса статусов (при включённом вебхуке опрос только сверяет пропущенное)
+_last_sync = 0.0
+# Сделка -> (ошибок подряд, момент time.monotonic(), раньше которого её не повторять)
+_retry_state: Dict[str, Tuple[int, float]] = {}
+# Длительность циклов сверки ("cycle") и обработки отдельных сделок ("deal")
+reconcile_latency = LatencyStats()
 
-async def check_deals(bot: Bot, db: Database, api: PayphoriaAPI) -> None:
-    """Периодическая проверка сделок."""
+
+async def sync_statuses(db: AsyncDatabase, api: PayphoriaAPI) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Пакетно снять статусы сделок у интеграторов и вернуть только те, что сменили статус."""
+    deals = await db.get_deals(status="awaiting_integrator")
+    # Забываем ошибки по сделкам, которые уже не ждут интегратора, и пропускаем отложенные
+    pending = {deal["deal_id"] for deal in deals}
+    for deal_id in [deal_id for deal_id in _retry_state if deal_id not in pending]:
+        del _retry_state[deal_id]
+    now = time.monotonic()
+    deals = [deal for deal in deals if _retry_state.get(deal["deal_id"], (0, 0.0))[1] <= now]
+    if not deals:
+        return []
+    orders = await api.get_orders([deal["deal_id"] for deal in deals])
+    transitions = []
+    for deal in deals:
+        deal_data = orders.get(deal["deal_id"])
+        logger.debug(deal_data)
+        if deal_data and REMOTE_TRANSITIONS.get(deal_data.get("status"), deal["status"]) != deal["status"]:
+            transitions.append((deal, deal_data))
+    return transitions
+
+
+async def complete_deal(bot: Bot, db: AsyncDatabase, deal: Dict[str, Any], deal_data: Dict[str, Any]) -> None:
+    """Перевести сделку в завершённые: статистика, затем сообщение мерчанту и реакция."""
+    async with db.transaction() as tx:
+        tx.update_deal_status(deal["deal_id"], "completed")
+        tx.add_stat(deal["handler_id"], "completed", deal_data["merchant_name"])
+    # Мерчанту сообщаем только о сделке, завершение которой записано; иначе сверка повторит её позже
+    if any(result is False for result in tx.results):
+        raise TransactionAborted(f"Сделка {deal['deal_id']} не переведена в завершённые")
+
+    messages = await db.get_messages(deal_id=deal["deal_id"])
+
+    if messages:
+
+        chat_id = deal["merchant_chat_id"]
+        chat = Chat(id=chat_id, type="group")
+
+        msg = Message(
+            message_id=deal['message_id'],
+            chat=chat,
+            bot=bot,
+            date=deal['sent_time']
+
+        )
+
+        await send_message_with_media(
+            bot,
+            deal["merchant_chat_id"],
+            RESPONSE_TEMPLATES["deal_completed"].format(deal_id=deal["deal_id"]),
+            []
+        )
+        await set_reaction_on_chain(bot, msg, ["👍"], db)
+
+
+async def apply_transition(bot: Bot, db: AsyncDatabase, deal_id: str, deal_data: Dict[str, Any]) -> bool:
+    """Применить статус сделки из API (опрос или вебхук). Повторный вызов для той же сделки ничего не делает."""
+    if REMOTE_TRANSITIONS.get(deal_data.get("status")) != "completed" or deal_id in _transitions_in_progress:
+        return False
+    _transitions_in_progress.add(deal_id)
+    try:
+        # Перечитываем сделку: её могли завершить, пока шёл запрос к API
+        deal = await db.get_deal(deal_id)
+        if not deal or deal["status"] != "awaiting_integrator":
+            return False
+        await complete_deal(bot, db, deal, deal_data)
+        return True
+    finally:
+        _transitions_in_progress.discard(deal_id)
+
+
+def _record_failure(deal_id: str, error: Exception) -> int:
+    """Отложить повтор сделки с экспоненциальной паузой; вернуть число ошибок подряд."""
+    failures = _retry_state.get(deal_id, (0, 0.0))[0] + 1
+    delay = min(RECONCILE_RETRY_BASE_SECONDS * 2 ** (failures - 1), RECONCILE_RETRY_MAX_SECONDS)
+    # Разброс, чтобы сделки, упавшие вместе, не повторялись одной пачкой
+    _retry_state[deal_id] = (failures, time.monotonic() + delay * random.uniform(0.8, 1.2))
+    logger.error(f"Ошибка сверки сделки {deal_id} ({failures} подряд), повтор через ~{delay} с: {error!r}")
+    return failures
+
+
+async def reconcile_deal(bot: Bot, db: AsyncDatabase, deal: Dict[str, Any], deal_data: Dict[str, Any]) -> None:
+    """Применить статус одной сделки; ошибка не мешает остальным, а только откладывает эту сделку."""
+    deal_id = deal["deal_id"]
+    started = time.perf_counter()
+    try:
+        await apply_transition(bot, db, deal_id, deal_data)
+    except Exception as e:
+        reconcile_latency.record("deal", time.perf_counter() - started, ok=False)
+        if _record_failure(deal_id, e) == RECONCILE_ALERT_FAILURES:
+            await log_errors(Exception(f"Сделка {deal_id} не сверяется {RECONCILE_ALERT_FAILURES} раз подряд: {e}"), bot)
+    else:
+        reconcile_latency.record("deal", time.perf_counter() - started)
+        _retry_state.pop(deal_id, None)
+
+
+async def reconcile_deals(bot: Bot, db: AsyncDatabase, api: PayphoriaAPI) -> int:
+    """Цикл сверки: пакетно снять статусы и применить переходы пулом из RECONCILE_CONCURRENCY обработчиков."""
+    with reconcile_latency.measure("cycle"):
+        transitions = await sync_statuses(db, api)
+        queue: asyncio.Queue = asyncio.Queue()
+        for transition in transitions:
+            queue.put_nowait(transition)
+
+        async def worker():
+            while not queue.empty():
+                await reconcile_deal(bot, db, *queue.get_nowait())
+
+        await asyncio.gather(*(worker() for _ in range(min(RECONCILE_CONCURRENCY, len(transitions)))))
+    return len(transitions)
+
+
+def reconcile_stats() -> Dict[str, Any]:
+    """Задержки сверки и число сделок, отложенных после ошибок."""
+    return {**reconcile_latency.summary(), "backoff": {"deals": len(_retry_state)}}
+
+
+async def check_deals(bot: Bot, db: AsyncDatabase, api: PayphoriaAPI) -> None:
+    """Периодическая сверка статусов сделок у интеграторов (сроки SLA отслеживает sla.SlaEngine)."""
     try:
-        for deal in db.get_deals():
-            if deal["status"] == "awaiting":
-                timeout = await get_sla_timeout(deal["sent_time"])
-                if datetime.now(pytz.timezone("Europe/Moscow")).timestamp() > timeout:
-                    merchant = db.get_merchant(chat_id=deal["merchant_chat_id"])
-                    if merchant:
-                        await send_message_with_media(
-                            bot,
-                            deal["handler_id"],
-                            RESPONSE_TEMPLATES["sla_expired"].format(
-                                deal_id=deal["deal_id"],
-                                merchant_name=merchant["display_name"]
-                            ),
-                            []
-                        )
-                        db.add_sla_notification(deal["deal_id"], 0, True)
-
-
-            elif deal["status"] == "awaiting_integrator":
-                deal_data = await api.get_order(deal["deal_id"], ADMIN_IDS[0])
-
-                logger.debug(deal_data)
-
-                if deal_data and deal_data.get("status") == "success":
-                    messages = db.get_messages(deal_id=deal["deal_id"])
-
-                    if messages:
-
-                        chat_id = deal["merchant_chat_id"]
-                        chat = Chat(id=chat_id, type="group")
-
-                        msg = Message(
-                            message_id=deal['message_id'],
-                            chat=chat,
-                            bot=bot,
-                            date=deal['sent_time']
-
-                        )
-
-                        await send_message_with_media(
-                            bot,
-                            deal["merchant_chat_id"],
-                            RESPONSE_TEMPLATES["deal_completed"].format(deal_id=deal["deal_id"]),
-                            []
-                        )
-                        await set_reaction_on_chain(bot, msg, ["👍"])
-                    db.update_deal_status(deal["deal_id"], "completed")
-                    db.add_stat(deal["handler_id"], "completed", deal_data["merchant_name"])
+        global _last_sync
+        if WEBHOOK_ENABLED and time.monotonic() - _last_sync < WEBHOOK_RECONCILE_SECONDS:
+            return
+        # Пока API недоступен, опрос статусов пропускается
+        if not api.available():
+            logger.warning("API недоступен, опрос сделок у интеграторов пропущен")
+            return
+        _last_sync = time.monotonic()
+        await reconcile_deals(bot, db, api)
     except Exception as e:
         await log_errors(e, bot)
 
-async def start_tasks(bot: Bot, db: Database, api: PayphoriaAPI) -> None:
-    """Запуск периодических задач."""
-    async def run_check_deals():
-        while True:
-            await check_deals(bot, db, api)
-            await asyncio.sleep(20)
-    asyncio.create_task(run_check_deals())
\ No newline at end of file
+def register_tasks(scheduler: Scheduler, bot: Bot, db: AsyncDatabase, api: PayphoriaAPI) -> None:
+    """Регистрация периодических задач."""
+    scheduler.add(
+        "check_deals", lambda: check_deals(bot, db, api),
+        interval=CHECK_DEALS_INTERVAL_SECONDS, jitter=CHECK_DEALS_JITTER_SECONDS,
+        max_runtime=CHECK_DEALS_MAX_RUNTIME_SECONDS, run_at_start=True
+    )
+    scheduler.add("compaction", db.compact_if_needed, interval=DB_COMPACT_INTERVAL_SECONDS)
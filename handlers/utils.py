@@ -1,15 +1,17 @@
 import re
 import logging
 import asyncio
+import weakref
 from datetime import datetime
 import pytz
 from typing import List, Dict, Any, Optional, Callable, Tuple
 from aiogram import Bot
 from aiogram.types import Message, ReactionTypeEmoji, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo, InputMediaDocument
-from Levenshtein import distance
-from config import CONSTANTS, RESPONSE_TEMPLATES, KEYBOARDS, ADMIN_IDS, ALLOWED_USERS
-from database import Database
+from config import CONSTANTS, RESPONSE_TEMPLATES, KEYBOARDS, ADMIN_IDS, ALLOWED_USERS, DEAL_ID_LOOKUP_CONCURRENCY, INTEGRATOR_MATCH_DISTANCE
+from database import AsyncDatabase
 from api import PayphoriaAPI
+from integrators import IntegratorResolver
+from outbox import outbound_priority, send_in_background, PRIORITY_ADMIN
 
 logger = logging.getLogger(__name__)
 
@@ -19,12 +21,16 @@ MONTHS = {
     "09": "сентября", "10": "октября", "11": "ноября", "12": "декабря"
 }
 
+DEAL_ID_RE = re.compile(CONSTANTS["DEAL_ID_PATTERN"])
 
+# Индекс интеграторов на каждую базу (в боте она одна)
+_integrator_resolvers: "weakref.WeakKeyDictionary[AsyncDatabase, IntegratorResolver]" = weakref.WeakKeyDictionary()
 
-async def set_reaction_on_chain(bot: Bot, message: Message, reactions: List[str]) -> None:
+
+
+async def set_reaction_on_chain(bot: Bot, message: Message, reactions: List[str], db: AsyncDatabase) -> None:
     """Установить реакцию только в чате мерчанта."""
-    db = Database()
-    if message.chat.id in [m["chat_id"] for m in db.get_merchants()]:
+    if await db.get_merchant(chat_id=message.chat.id):
         try:
             logger.debug('reaction set from list')
             await bot.set_message_reaction(chat_id=message.chat.id, message_id=message.message_id, reaction=[ReactionTypeEmoji(emoji=reactions[0])])
@@ -32,40 +38,74 @@ async def set_reaction_on_chain(bot: Bot, message: Message, reactions: List[str]
             logger.debug('reaction set eyes')
             await bot.set_message_reaction(chat_id=message.chat.id, message_id=message.message_id, reaction=[ReactionTypeEmoji(emoji="👀")])
 
+def find_deal_id_candidates(text: str) -> List[str]:
+    """Все похожие на deal_id строки текста в порядке появления, без повторов."""
+    return list(dict.fromkeys(DEAL_ID_RE.findall(text)))
+
 async def find_deal_id_in_chain(message: Message) -> Optional[str]:
     """Найти deal_id в сообщении или цепочке ответов."""
     text = message.text or message.caption or ""
-    deal_ids = re.findall(CONSTANTS["DEAL_ID_PATTERN"], text)
-    if deal_ids:
-        return deal_ids[0]
+    match = DEAL_ID_RE.search(text)
+    if match:
+        return match.group(0)
     if message.reply_to_message:
         return await find_deal_id_in_chain(message.reply_to_message)
     return None
 
-async def get_deal_ids(message: Message, api: PayphoriaAPI) -> Optional[str]:
-    """Получить первый валидный deal_id."""
-    text = message.text or message.caption or ""
-    deal_ids = re.findall(CONSTANTS["DEAL_ID_PATTERN"], text)
-
-    for deal_id in deal_ids:
-        order = await api.get_order(deal_id, message.from_user.id)
+async def is_known_deal(deal_id: str, api: PayphoriaAPI, db: Optional[AsyncDatabase]) -> bool:
+    """Сделка уже проверена: есть в кэше API или в базе (туда попадают только валидные)."""
+    if api.order_cache.get(deal_id) is not None:
+        return True
+    return bool(db and await db.get_deal(deal_id))
+
+async def first_valid_deal_id(deal_ids: List[str], api: PayphoriaAPI, user_id: int,
+                              limit: int = DEAL_ID_LOOKUP_CONCURRENCY) -> Optional[str]:
+    """Проверить deal_id в API параллельно (не более limit сразу) и вернуть первый валидный по порядку."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def check(deal_id: str) -> bool:
+        async with semaphore:
+            return await api.get_order(deal_id, user_id) is not None
+
+    checks = [asyncio.ensure_future(check(deal_id)) for deal_id in deal_ids]
+    try:
+        for deal_id, task in zip(deal_ids, checks):
+            if await task:
+                return deal_id
+        return None
+    finally:
+        # Оставшиеся проверки больше не нужны
+        for task in checks:
+            task.cancel()
 
-        if order:  # Проверяем, вернул ли метод валидные данные
-            logger.debug(f'deal id найден {deal_id}')
-            return deal_id
-        else:
-            logger.debug('данные не возвращены')
+async def get_deal_ids(message: Message, api: PayphoriaAPI, db: Optional[AsyncDatabase] = None) -> Optional[str]:
+    """Получить первый валидный deal_id."""
+    known = None
+    unknown = []
+    for deal_id in find_deal_id_candidates(message.text or message.caption or ""):
+        if await is_known_deal(deal_id, api, db):
+            known = deal_id
+            break
+        unknown.append(deal_id)
+
+    # Неизвестные кандидаты перед известным проверяются в API: первый по порядку валидный важнее
+    deal_id = (await first_valid_deal_id(unknown, api, message.from_user.id) if unknown else None) or known
+    if deal_id:
+        logger.debug(f'deal id найден {deal_id}')
+        return deal_id
+    logger.debug('данные не возвращены')
     return await find_deal_id_in_chain(message)
 
-async def get_media(message: Message) -> List[Dict[str, Any]]:
-    """Получить медиа из сообщения."""
+async def get_media(message: Message, album: Optional[List[Message]] = None) -> List[Dict[str, Any]]:
+    """Получить медиа из сообщения или всего альбома."""
     media = []
-    if message.photo:
-        media.append({"type": "photo", "file_id": message.photo[-1].file_id, "caption": message.caption})
-    if message.video:
-        media.append({"type": "video", "file_id": message.video.file_id, "caption": message.caption})
-    if message.document:
-        media.append({"type": "document", "file_id": message.document.file_id, "caption": message.caption})
+    for part in album or [message]:
+        if part.photo:
+            media.append({"type": "photo", "file_id": part.photo[-1].file_id, "caption": part.caption})
+        if part.video:
+            media.append({"type": "video", "file_id": part.video.file_id, "caption": part.caption})
+        if part.document:
+            media.append({"type": "document", "file_id": part.document.file_id, "caption": part.caption})
     return media[:10]
 
 async def create_media_group(media: List[Dict[str, Any]]) -> List[Any]:
@@ -85,9 +125,13 @@ async def send_message_with_media(
     chat_id: str,
     text: str,
     media: List[Dict[str, Any]],
-    reply_markup: Optional[InlineKeyboardMarkup] = None
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    priority: Optional[int] = None
 ) -> Message:
-    """Отправить сообщение с медиа."""
+    """Отправить сообщение с медиа (priority — очередь исходящих, см. outbox)."""
+    if priority is not None:
+        with outbound_priority(priority):
+            return await send_message_with_media(bot, chat_id, text, media, reply_markup)
 
     if media:
         media_group = await create_media_group(media)
@@ -118,28 +162,30 @@ def create_keyboard(keyboard_type: str, msg_data: Optional[dict] = None) -> Inli
 
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-async def find_integrator_chat(deal_id: str, api: PayphoriaAPI, db: Database) -> Optional[Dict[str, Any]]:
-    """Найти чат интегратора."""
-    deal_data = await api.get_order(deal_id, list(ADMIN_IDS)[0])
+def integrator_resolver(db: AsyncDatabase) -> IntegratorResolver:
+    """Индекс интеграторов для базы."""
+    resolver = _integrator_resolvers.get(db)
+    if resolver is None:
+        resolver = _integrator_resolvers[db] = IntegratorResolver(db, INTEGRATOR_MATCH_DISTANCE)
+    return resolver
+
+async def find_integrator_chat(deal_id: str, api: PayphoriaAPI, db: AsyncDatabase,
+                               deal_data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Найти чат интегратора (deal_data — уже полученные данные сделки, чтобы не запрашивать их снова)."""
+    if deal_data is None:
+        deal_data = await api.get_order(deal_id, list(ADMIN_IDS)[0])
     if not deal_data:
         return None
-    integrator_name = deal_data["integrator_name"]
-    cascades = db.get_cascades()
-    for cascade in cascades:
-        if distance(integrator_name.lower(), cascade["name"].lower()) <= 2:
-            return cascade
-    return None
+    return await integrator_resolver(db).resolve(deal_data["integrator_name"])
 
 
 
 async def log_errors(error: Exception, bot: Bot) -> None:
     """Логировать ошибки и уведомлять админов."""
     logger.error(f"Ошибка: {error}")
+    # Уведомления админам не должны задерживать обработку: уходят последними в очереди
     for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, f"⚠️ Ошибка: {str(error)}")
-        except:
-            logger.error(f"Не удалось уведомить админа {admin_id}")
+        send_in_background(bot.send_message(admin_id, f"⚠️ Ошибка: {str(error)}"), PRIORITY_ADMIN)
 
 def require_auth(func: Callable) -> Callable:
     """Проверка авторизации."""
@@ -0,0 +1,116 @@
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from Levenshtein import distance
+
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name: str) -> str:
+    """Имя интегратора для сравнения: без регистра и крайних пробелов."""
+    return name.strip().lower()
+
+
+class BKTree:
+    """BK-дерево по расстоянию Левенштейна: поиск слов в пределах расстояния без перебора всех."""
+
+    def __init__(self):
+        # Узел: [слово, {расстояние до родителя: дочерний узел}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, word: str) -> None:
+        """Добавить слово (повтор игнорируется)."""
+        if self._root is None:
+            self._root = [word, {}]
+            self.size = 1
+            return
+        node = self._root
+        while True:
+            d = distance(word, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [word, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Слова на расстоянии не больше max_distance: пары (расстояние, слово)."""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            d = distance(word, node[0])
+            if d <= max_distance:
+                found.append((d, node[0]))
+            # По неравенству треугольника подходят только ветви с расстоянием в [d - max, d + max]
+            for edge, child in node[1].items():
+                if d - max_distance <= edge <= d + max_distance:
+                    stack.append(child)
+        return found
+
+
+class IntegratorResolver:
+    """Поиск чата интегратора по имени из сделки с учётом опечаток.
+
+    Индекс имён интеграторов и результаты поиска хранятся в памяти и сбрасываются,
+    когда меняется таблица cascades (Database.cascades_version).
+    """
+
+    def __init__(self, db: AsyncDatabase, max_distance: int):
+        """Инициализация пустого индекса."""
+        self.db = db
+        self.max_distance = max_distance
+        self._version: Optional[int] = None
+        self._tree = BKTree()
+        # Нормализованное имя -> интеграторы с таким именем в порядке хранения
+        self._by_name: Dict[str, List[Dict[str, Any]]] = {}
+        self._position: Dict[str, int] = {}
+        self._memo: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    async def _refresh(self) -> None:
+        """Перестроить индекс, если интеграторы изменились."""
+        version = self.db.db.cascades_version
+        if version == self._version:
+            return
+        # Версия читается до загрузки: изменение во время чтения вызовет ещё одну перестройку
+        cascades = await self.db.get_cascades()
+        tree = BKTree()
+        by_name: Dict[str, List[Dict[str, Any]]] = {}
+        for cascade in cascades:
+            name = normalize_name(cascade["name"])
+            by_name.setdefault(name, []).append(cascade)
+            tree.add(name)
+        self._tree, self._by_name, self._memo = tree, by_name, {}
+        self._position = {name: i for i, name in enumerate(by_name)}
+        self._version = version
+        self.rebuilds += 1
+        logger.debug(f"Индекс интеграторов перестроен: {tree.size} имён")
+
+    async def resolve(self, integrator_name: str) -> Optional[Dict[str, Any]]:
+        """Интегратор с ближайшим именем (расстояние не больше max_distance) или None."""
+        await self._refresh()
+        name = normalize_name(integrator_name)
+        if name in self._memo:
+            self.hits += 1
+            cascade = self._memo[name]
+            return dict(cascade) if cascade else None
+        self.misses += 1
+        matches = self._tree.search(name, self.max_distance)
+        # Ближайшее имя, при равенстве — интегратор, добавленный раньше
+        best = min(matches, key=lambda match: (match[0], self._position[match[1]]), default=None)
+        cascade = self._by_name[best[1]][0] if best else None
+        self._memo[name] = cascade
+        return dict(cascade) if cascade else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики индекса."""
+        return {"names": self._tree.size, "memo": len(self._memo), "hits": self.hits, "misses": self.misses, "rebuilds": self.rebuilds}
@@ -0,0 +1,62 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Deque, Iterator, List
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль по отсортированным значениям (ближайший ранг)."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LatencyStats:
+    """Задержки операций по ключам: счётчики и перцентили по последним замерам."""
+
+    def __init__(self, window: int = 1000):
+        """Инициализация; window — сколько последних замеров хранить на ключ."""
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, float]] = {}
+
+    def record(self, key: str, seconds: float, ok: bool = True) -> None:
+        """Учесть один замер."""
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+            self._counts[key] = {"count": 0, "errors": 0, "max": 0.0}
+        samples.append(seconds)
+        counts = self._counts[key]
+        counts["count"] += 1
+        counts["max"] = max(counts["max"], seconds)
+        if not ok:
+            counts["errors"] += 1
+
+    @contextmanager
+    def measure(self, key: str) -> Iterator[None]:
+        """Замерить блок кода; исключение считается ошибкой."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(key, time.perf_counter() - started, ok=False)
+            raise
+        self.record(key, time.perf_counter() - started)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Сводка по ключам: число вызовов, ошибки и задержки в миллисекундах."""
+        result = {}
+        for key, samples in self._samples.items():
+            values = sorted(samples)
+            counts = self._counts[key]
+            result[key] = {
+                "count": int(counts["count"]),
+                "errors": int(counts["errors"]),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(counts["max"] * 1000, 1),
+            }
+        return result
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class OrderCache:
+    """LRU-кэш сделок Payphoria со сроком жизни по статусу и объединением одновременных запросов."""
+
+    def __init__(self, max_size: int, ttls: Dict[str, float], default_ttl: float):
+        """Инициализация кэша и счётчиков."""
+        self.max_size = max_size
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        # order_id -> (момент устаревания, данные сделки)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Запросы к API, которые уже выполняются: остальные вызывающие ждут их результат
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Сколько вызывающих ждёт каждый запрос: когда уходит последний, запрос отменяется
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.cancelled = 0
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """Свежие данные сделки из кэша или None."""
+        entry = self._entries.get(order_id)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at <= time.monotonic():
+            del self._entries[order_id]
+            return None
+        self._entries.move_to_end(order_id)
+        return dict(data)
+
+    def put(self, order_id: str, data: Dict[str, Any]) -> None:
+        """Сохранить данные сделки со сроком жизни по её статусу."""
+        ttl = self.ttls.get(data.get("status"), self.default_ttl)
+        if ttl <= 0:
+            return
+        self._entries[order_id] = (time.monotonic() + ttl, dict(data))
+        self._entries.move_to_end(order_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, order_id: Optional[str] = None) -> None:
+        """Сбросить сделку (или весь кэш)."""
+        if order_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(order_id, None)
+
+    async def fetch(self, order_id: str, loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+                    fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """Данные сделки из кэша, из уже идущего запроса или новым запросом через loader."""
+        cached = None if fresh else self.get(order_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        task = self._inflight.get(order_id)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(order_id, loader))
+            # Ошибка забирается, даже если все вызывающие уже отменены
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[order_id] = task
+        # Отмена одного вызывающего не должна обрывать общий запрос, пока его ждут другие
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            data = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                self.cancelled += 1
+                if self._inflight.get(order_id) is task:
+                    del self._inflight[order_id]
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+        return dict(data) if data is not None else None
+
+    async def _load(self, order_id: str, loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """Выполнить запрос и положить результат в кэш."""
+        try:
+            data = await loader()
+            if data is not None:
+                self.put(order_id, data)
+            return data
+        finally:
+            if self._inflight.get(order_id) is asyncio.current_task():
+                del self._inflight[order_id]
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики кэша."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "cancelled": self.cancelled,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
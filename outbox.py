@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Awaitable, Deque, Iterator, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMediaGroup, TelegramMethod
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Очереди исходящих сообщений по убыванию приоритета.
+PRIORITY_CARDS = 0  # Карточки сделок обработчикам и интеграторам
+PRIORITY_DEFAULT = 1  # Ответы на команды и прочие сообщения
+PRIORITY_SLA = 2  # Напоминания о просроченных сделках
+PRIORITY_ADMIN = 3  # Уведомления админам об ошибках и отклонениях
+LANES = ("cards", "default", "sla", "admin")
+
+# Запросы, на которые действуют лимиты Telegram на отправку в чат; остальные идут мимо очереди.
+THROTTLED_PREFIXES = ("Send", "Edit", "Forward", "Copy")
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_DEFAULT)
+# Фоновые отправки: ссылки держатся до завершения, иначе задачу может собрать сборщик мусора
+_background: Set[asyncio.Task] = set()
+
+
+@contextmanager
+def outbound_priority(priority: int) -> Iterator[None]:
+    """Отправки внутри блока идут в очередь с заданным приоритетом."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _log_background(task: asyncio.Task) -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Не удалось отправить сообщение: {task.exception()!r}")
+
+
+def send_in_background(send: Awaitable[Any], priority: int) -> asyncio.Task:
+    """Поставить отправку в очередь, не дожидаясь её; ошибка только логируется."""
+    with outbound_priority(priority):
+        # Задача копирует контекст при создании, так что приоритет достаётся ей
+        task = asyncio.ensure_future(send)
+    _background.add(task)
+    task.add_done_callback(_log_background)
+    return task
+
+
+def chat_key(chat_id: Any) -> Any:
+    """chat_id запроса как число (в обработчиках встречаются и строки)."""
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Через сколько секунд можно потратить cost маркеров (дороже запаса — когда запас полон)."""
+        self._refill(now)
+        wait = max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+        return max(wait, self.paused_until - now)
+
+    def take(self, cost: float, now: float) -> None:
+        """Потратить маркеры (запас может уйти в минус, это учтётся в следующем ожидании)."""
+        self._refill(now)
+        self.tokens -= cost
+
+    def pause(self, seconds: float, now: float) -> None:
+        """Не выдавать маркеры seconds секунд (ответ Telegram retry_after)."""
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        """Корзина полна и не на паузе: её можно забыть без потери лимита."""
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+class _Outgoing:
+    """Запрос к Telegram в очереди."""
+
+    __slots__ = ("make_request", "bot", "method", "chat", "cost", "priority", "future", "enqueued", "attempts")
+
+    def __init__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod, priority: int):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.chat = chat_key(getattr(method, "chat_id", None))
+        self.cost = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class Outbox:
+    """Очередь исходящих запросов к Telegram с лимитами: общим, на чат и на группу.
+
+    Запросы разложены по очередям приоритетов; из очереди уходит первый запрос,
+    чей чат не упирается в лимит, так что один «горячий» чат не держит остальных.
+    На ответ retry_after чат ставится на паузу, а запрос возвращается в начало очереди.
+    """
+
+    def __init__(self, global_per_second: float, chat_per_second: float, group_per_minute: float,
+                 chat_burst: int, concurrency: int, max_attempts: int, drain_seconds: float):
+        """Инициализация очередей и лимитов."""
+        self.chat_per_second = chat_per_second
+        self.group_per_second = group_per_minute / 60
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.drain_seconds = drain_seconds
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.chats: Dict[Any, TokenBucket] = {}
+        self.lanes: List[Deque[_Outgoing]] = [deque() for _ in LANES]
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self.latency = LatencyStats()
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None
+
+    def start(self) -> None:
+        """Запустить разбор очереди."""
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Дослать очередь (не дольше drain_seconds) и остановиться; недосланное отменяется."""
+        if self._runner is None:
+            return
+        deadline = time.monotonic() + self.drain_seconds
+        while (self.depth() or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._runner.cancel()
+        await asyncio.gather(self._runner, return_exceptions=True)
+        self._runner = None
+        dropped = 0
+        for lane in self.lanes:
+            while lane:
+                lane.popleft().future.cancel()
+                dropped += 1
+        if dropped:
+            logger.warning(f"Очередь Telegram остановлена, не отправлено {dropped} сообщений")
+
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    def submit(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod, priority: int) -> asyncio.Future:
+        """Поставить запрос в очередь; результат придёт в future."""
+        item = _Outgoing(make_request, bot, method, min(max(priority, 0), len(LANES) - 1))
+        self.lanes[item.priority].append(item)
+        self._wakeup.set()
+        return item.future
+
+    def _bucket(self, chat: Any) -> TokenBucket:
+        bucket = self.chats.get(chat)
+        if bucket is None:
+            # Отрицательные id у групп и каналов: для них лимит строже
+            is_group = not isinstance(chat, int) or chat < 0
+            rate = self.group_per_second if is_group else self.chat_per_second
+            bucket = self.chats[chat] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _next(self) -> Tuple[Optional[_Outgoing], Optional[float]]:
+        """Следующий запрос, который можно отправить сейчас, или сколько ждать до него."""
+        now = time.monotonic()
+        if not self.depth():
+            return None, None
+        global_wait = self.global_bucket.wait_time(1, now)
+        if global_wait > 0:
+            return None, global_wait
+        wait = None
+        for lane in self.lanes:
+            for i, item in enumerate(lane):
+                if item.future.done():
+                    # Ожидающий отменён: отправлять уже некому
+                    del lane[i]
+                    return self._next()
+                bucket = self._bucket(item.chat)
+                chat_wait = bucket.wait_time(item.cost, now)
+                if chat_wait <= 0:
+                    del lane[i]
+                    bucket.take(item.cost, now)
+                    self.global_bucket.take(item.cost, now)
+                    return item, None
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait
+
+    async def _run(self) -> None:
+        """Разбирать очередь, соблюдая лимиты."""
+        while True:
+            item, wait = self._next()
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            if len(self.chats) > 10000:
+                self._forget_idle_chats()
+
+    async def _send(self, item: _Outgoing) -> None:
+        """Выполнить запрос и передать результат ожидающему."""
+        lane = LANES[item.priority]
+        if not item.attempts:
+            self.latency.record(f"wait:{lane}", time.monotonic() - item.enqueued)
+        try:
+            item.attempts += 1
+            result = await item.make_request(item.bot, item.method)
+        except TelegramRetryAfter as e:
+            self.retry_after += 1
+            self._bucket(item.chat).pause(e.retry_after, time.monotonic())
+            if item.attempts < self.max_attempts and not item.future.done():
+                logger.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой в чат {item.chat}")
+                self.lanes[item.priority].appendleft(item)
+                self._wakeup.set()
+                return
+            self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.sent += 1
+            self.latency.record(f"total:{lane}", time.monotonic() - item.enqueued)
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _fail(self, item: _Outgoing, error: Exception) -> None:
+        self.failed += 1
+        self.latency.record(f"total:{LANES[item.priority]}", time.monotonic() - item.enqueued, ok=False)
+        if not item.future.done():
+            item.future.set_exception(error)
+
+    def _forget_idle_chats(self) -> None:
+        """Забыть корзины чатов, которые давно ничего не отправляли."""
+        now = time.monotonic()
+        queued = {item.chat for lane in self.lanes for item in lane}
+        for chat in [chat for chat, bucket in self.chats.items() if chat not in queued and bucket.idle(now)]:
+            del self.chats[chat]
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очередей, счётчики и задержки (ожидание в очереди и полное время отправки)."""
+        return {
+            "queue": {name: len(lane) for name, lane in zip(LANES, self.lanes)},
+            "counters": {"in_flight": len(self._in_flight), "sent": self.sent, "failed": self.failed,
+                         "retry_after": self.retry_after, "chats": len(self.chats)},
+            "latency": self.latency.summary(),
+        }
+
+
+class OutboxMiddleware(BaseRequestMiddleware):
+    """Промежуточный слой сессии бота: отправки в чаты идут через Outbox."""
+
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        if self.outbox.running and type(method).__name__.startswith(THROTTLED_PREFIXES):
+            return await self.outbox.submit(make_request, bot, method, _priority.get())
+        # Прочие запросы (ответы на кнопки, удаление, реакции) повторяются после паузы на месте
+        for attempt in range(1, self.outbox.max_attempts + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.outbox.retry_after += 1
+                if attempt == self.outbox.max_attempts:
+                    raise
+                await asyncio.sleep(e.retry_after)
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, Any, Optional
+
+import aiohttp
+from tenacity import RetryCallState
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых запрос имеет смысл повторить.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryableStatus(Exception):
+    """Ответ API со статусом, после которого запрос можно повторить."""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """API считается недоступным: запрос отклонён без обращения к серверу."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Секунды из заголовка Retry-After (форма с датой не поддерживается)."""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Можно ли повторить запрос после такой ошибки."""
+    return isinstance(error, (RetryableStatus, aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+class BackoffWait:
+    """Ожидание для tenacity: экспоненциальный рост с полным джиттером, Retry-After имеет приоритет."""
+
+    def __init__(self, initial: float, maximum: float):
+        self.initial = initial
+        self.maximum = maximum
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        if isinstance(error, RetryableStatus) and error.retry_after is not None:
+            return min(error.retry_after, self.maximum)
+        ceiling = min(self.maximum, self.initial * 2 ** (retry_state.attempt_number - 1))
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    """Автомат-предохранитель: после серии отказов запросы отклоняются сразу, пока не пройдёт пауза."""
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float):
+        """Инициализация; failure_threshold отказов подряд размыкают цепь на recovery_timeout секунд."""
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe = False
+        self.opens = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self) -> bool:
+        """Цепь разомкнута и пауза ещё не прошла."""
+        return self.state == "open" and time.monotonic() - self.opened_at < self.recovery_timeout
+
+    def check(self) -> None:
+        """Пропустить запрос или отклонить его CircuitOpenError."""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.rejected += 1
+                raise CircuitOpenError("API недоступен")
+            self.state = "half_open"
+        if self.state == "half_open":
+            # Пробный запрос один, остальные ждут его исхода
+            if self._probe:
+                self.rejected += 1
+                raise CircuitOpenError("API проверяется пробным запросом")
+            self._probe = True
+
+    def success(self) -> None:
+        """Успешный ответ: замкнуть цепь."""
+        if self.state != "closed":
+            logger.info("API снова доступен, предохранитель замкнут")
+        self.state = "closed"
+        self.failures = 0
+        self._probe = False
+
+    def release(self) -> None:
+        """Запрос завершился без вердикта о доступности API (отмена, ошибка разбора)."""
+        self._probe = False
+
+    def failure(self) -> None:
+        """Отказ: после порога (или неудачной пробы) разомкнуть цепь."""
+        self.failures += 1
+        self._probe = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                logger.warning(f"API недоступен после {self.failures} отказов, запросы приостановлены на {self.recovery_timeout} с")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние и счётчики предохранителя."""
+        return {
+            "state": "open" if self.is_open else ("half_open" if self.state == "open" else self.state),
+            "failures": self.failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
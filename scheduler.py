@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Awaitable, Callable, Optional, Set
+
+import pytz
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+MSK = pytz.timezone("Europe/Moscow")
+
+JobFunc = Callable[[], Awaitable[Any]]
+
+
+class Interval:
+    """Запуск каждые seconds секунд."""
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("Интервал задачи должен быть больше нуля")
+        self.seconds = seconds
+
+    def next_after(self, timestamp: float) -> float:
+        """Следующий запуск после timestamp."""
+        return timestamp + self.seconds
+
+
+class Cron:
+    """Расписание в формате cron «минута час день месяц день_недели» по Москве.
+
+    Поля: *, числа, списки через запятую, диапазоны a-b и шаг /n; воскресенье — 0 или 7.
+    Как в cron, если заданы и день месяца, и день недели, подходит любой из них.
+    """
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, spec: str):
+        parts = spec.split()
+        if len(parts) != 5:
+            raise ValueError(f"Расписание cron должно состоять из 5 полей: {spec!r}")
+        self.spec = spec
+        minutes, hours, days, months, weekdays = (self._parse(part, low, high) for part, (low, high) in zip(parts, self.FIELDS))
+        self.minutes, self.hours, self.days, self.months = sorted(minutes), sorted(hours), days, months
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = parts[2] == "*"
+        self.any_weekday = parts[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for item in field.split(","):
+            item, _, step = item.partition("/")
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start, end = (int(value) for value in item.split("-", 1))
+            else:
+                start = end = int(item)
+                if step:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError(f"Поле cron {field!r} вне диапазона {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        by_day = day.day in self.days
+        by_weekday = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return by_day and by_weekday
+        return by_day or by_weekday
+
+    def next_after(self, timestamp: float) -> float:
+        """Первая подходящая минута строго после timestamp."""
+        now = datetime.fromtimestamp(timestamp, MSK).replace(tzinfo=None)
+        day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        # Перебор по дням, внутри дня — только подходящие часы и минуты; за 5 лет подходящая дата найдётся
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        moment = day.replace(hour=hour, minute=minute)
+                        if moment > now:
+                            return MSK.localize(moment).timestamp()
+            day += timedelta(days=1)
+        raise ValueError(f"Расписание cron {self.spec!r} не срабатывает")
+
+
+class Job:
+    """Периодическая задача и её счётчики."""
+
+    def __init__(self, name: str, func: JobFunc, schedule, jitter: float, max_runtime: Optional[float],
+                 overrun: str, run_at_start: bool):
+        if overrun not in ("skip", "coalesce"):
+            raise ValueError(f"Неизвестный режим наложения запусков {overrun!r}")
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter = jitter
+        self.max_runtime = max_runtime
+        self.overrun = overrun
+        self.run_at_start = run_at_start
+        self.runner: Optional[asyncio.Task] = None
+        self.task: Optional[asyncio.Task] = None
+        # Запуск, пришедшийся на выполнение (overrun="coalesce"): выполнится сразу после текущего
+        self.pending = False
+        self.next_run: Optional[float] = None
+        self.last_run: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.restarts = 0
+
+
+class Scheduler:
+    """Периодические задачи бота: интервал или cron, разброс, ограничение времени и наложение запусков.
+
+    Запуск, пришедшийся на ещё идущее выполнение, пропускается (overrun="skip") или
+    объединяется в один повтор сразу после него (overrun="coalesce"). Ошибка задачи
+    только логируется; упавший цикл расписания перезапускается через restart_delay.
+    При остановке идущие выполнения дожидаются не дольше drain_seconds.
+    """
+
+    def __init__(self, drain_seconds: float, restart_delay: float):
+        """Инициализация без задач."""
+        self.drain_seconds = drain_seconds
+        self.restart_delay = restart_delay
+        self.jobs: Dict[str, Job] = {}
+        self.latency = LatencyStats()
+        self._started = False
+        self._stopping = False
+
+    def add(self, name: str, func: JobFunc, interval: Optional[float] = None, cron: Optional[str] = None,
+            jitter: float = 0.0, max_runtime: Optional[float] = None, overrun: str = "skip",
+            run_at_start: bool = False) -> Job:
+        """Зарегистрировать задачу: ровно одно из interval (секунды) или cron; jitter — случайная задержка до jitter секунд."""
+        if (interval is None) == (cron is None):
+            raise ValueError(f"Для задачи {name} нужен либо interval, либо cron")
+        if name in self.jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        job = Job(name, func, Interval(interval) if interval is not None else Cron(cron), jitter, max_runtime, overrun, run_at_start)
+        self.jobs[name] = job
+        if self._started:
+            self._spawn(job)
+        return job
+
+    def start(self) -> None:
+        """Запустить расписания всех задач."""
+        self._started = True
+        for job in self.jobs.values():
+            self._spawn(job)
+
+    async def stop(self) -> None:
+        """Прекратить запуски и дождаться идущих выполнений (не дольше drain_seconds), остальные отменить."""
+        self._stopping = True
+        runners = [job.runner for job in self.jobs.values() if job.runner]
+        for runner in runners:
+            runner.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+        running = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        if running:
+            _, unfinished = await asyncio.wait(running, timeout=self.drain_seconds)
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                logger.warning(f"Задачи не завершились за {self.drain_seconds} с и отменены: {len(unfinished)}")
+            await asyncio.gather(*running, return_exceptions=True)
+
+    def _spawn(self, job: Job) -> None:
+        if self._stopping:
+            return
+        job.runner = asyncio.create_task(self._loop(job))
+        job.runner.add_done_callback(lambda runner: self._on_runner_exit(job, runner))
+
+    def _on_runner_exit(self, job: Job, runner: asyncio.Task) -> None:
+        """Перезапустить упавший цикл расписания."""
+        if runner.cancelled() or self._stopping:
+            return
+        job.restarts += 1
+        logger.error(f"Цикл задачи {job.name} упал ({runner.exception()!r}), перезапуск через {self.restart_delay} с")
+        asyncio.get_running_loop().call_later(self.restart_delay, self._spawn, job)
+
+    async def _loop(self, job: Job) -> None:
+        """Запускать задачу по расписанию."""
+        now = time.time()
+        job.next_run = now if job.run_at_start and job.restarts == 0 else job.schedule.next_after(now)
+        while True:
+            await asyncio.sleep(max(0.0, job.next_run - time.time()) + random.uniform(0, job.jitter))
+            if job.task and not job.task.done():
+                if job.overrun == "skip":
+                    job.skipped += 1
+                    logger.warning(f"Задача {job.name} ещё выполняется, запуск пропущен")
+                else:
+                    job.coalesced += 1
+                    job.pending = True
+            else:
+                job.task = asyncio.create_task(self._execute(job))
+            # Пропущенные за время простоя запуски не догоняются
+            next_run = job.schedule.next_after(job.next_run)
+            if next_run <= time.time():
+                next_run = job.schedule.next_after(time.time())
+            job.next_run = next_run
+
+    async def _execute(self, job: Job) -> None:
+        """Выполнить задачу (и объединённый повтор, если он накопился)."""
+        while True:
+            job.pending = False
+            job.last_run = time.time()
+            started = time.perf_counter()
+            ok = False
+            try:
+                await asyncio.wait_for(job.func(), job.max_runtime)
+                ok = True
+                job.last_error = None
+            except asyncio.TimeoutError:
+                job.timeouts += 1
+                job.last_error = f"дольше {job.max_runtime} с"
+                logger.error(f"Задача {job.name} прервана: выполнялась дольше {job.max_runtime} с")
+            except Exception as e:
+                job.failures += 1
+                job.last_error = repr(e)
+                logger.error(f"Ошибка задачи {job.name}: {e!r}")
+            job.runs += 1
+            job.last_duration = time.perf_counter() - started
+            self.latency.record(job.name, job.last_duration, ok=ok)
+            if not job.pending or self._stopping:
+                return
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние задач: последний запуск, длительность, счётчики и время до следующего запуска."""
+        latency = self.latency.summary()
+        result = {}
+        for name, job in self.jobs.items():
+            result[name] = {
+                "running": bool(job.task and not job.task.done()),
+                "last_run": datetime.fromtimestamp(job.last_run, MSK).strftime("%H:%M:%S") if job.last_run else None,
+                "last_duration_ms": round(job.last_duration * 1000, 1) if job.last_duration is not None else None,
+                "next_in_seconds": int(job.next_run - time.time()) if job.next_run else None,
+                "runs": job.runs,
+                "failures": job.failures,
+                "timeouts": job.timeouts,
+                "skipped": job.skipped,
+                "coalesced": job.coalesced,
+                "restarts": job.restarts,
+                "p95_ms": latency.get(name, {}).get("p95_ms"),
+                "last_error": job.last_error,
+            }
+        return result
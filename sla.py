@@ -0,0 +1,211 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+import pytz
+from aiogram import Bot
+
+from config import RESPONSE_TEMPLATES
+from database import AsyncDatabase
+from handlers.utils import send_message_with_media
+from outbox import send_in_background, PRIORITY_SLA
+
+logger = logging.getLogger(__name__)
+
+MSK = pytz.timezone("Europe/Moscow")
+
+
+class SlaCalendar:
+    """Дневные и ночные часы по Москве; границы дня вычисляются один раз на дату."""
+
+    def __init__(self, day_start: str, day_end: str, day_seconds: float, night_seconds: float):
+        self.day_start = datetime.strptime(day_start, "%H:%M").time()
+        self.day_end = datetime.strptime(day_end, "%H:%M").time()
+        self.day_seconds = day_seconds
+        self.night_seconds = night_seconds
+        self._bounds: Dict[date, Tuple[float, float]] = {}
+
+    def bounds(self, day: date) -> Tuple[float, float]:
+        """Начало и конец дневных часов даты (timestamp)."""
+        bounds = self._bounds.get(day)
+        if bounds is None:
+            if len(self._bounds) > 366:
+                self._bounds.clear()
+            bounds = self._bounds[day] = (
+                MSK.localize(datetime.combine(day, self.day_start)).timestamp(),
+                MSK.localize(datetime.combine(day, self.day_end)).timestamp(),
+            )
+        return bounds
+
+    def is_day(self, timestamp: float) -> bool:
+        """Дневное ли время (MSK) в момент timestamp."""
+        start, end = self.bounds(datetime.fromtimestamp(timestamp, MSK).date())
+        return start <= timestamp <= end
+
+    def next_day_moment(self, timestamp: float) -> float:
+        """Первый дневной момент не раньше timestamp."""
+        day = datetime.fromtimestamp(timestamp, MSK).date()
+        start, end = self.bounds(day)
+        if timestamp < start:
+            return start
+        if timestamp <= end:
+            return timestamp
+        return self.bounds(day + timedelta(days=1))[0]
+
+    def next_night_moment(self, timestamp: float) -> float:
+        """Первый ночной момент не раньше timestamp."""
+        start, end = self.bounds(datetime.fromtimestamp(timestamp, MSK).date())
+        return end if start <= timestamp <= end else timestamp
+
+    def deadline(self, sent_time: float) -> float:
+        """Момент просрочки: днём SLA_DAY_SECONDS от отправки, ночью SLA_NIGHT_SECONDS.
+
+        Лимит зависит от времени проверки, поэтому срок — первый момент, когда
+        прошло больше лимита, действующего в этот момент.
+        """
+        return min(self.next_day_moment(sent_time + self.day_seconds), self.next_night_moment(sent_time + self.night_seconds))
+
+
+class SlaEngine:
+    """Напоминания о просроченных сделках по куче сроков вместо перебора всех сделок.
+
+    Срок сделки в статусе awaiting вычисляется один раз; сделки добавляются и убираются
+    по изменениям базы (add_deal, update_deal_status, перенос в архив). Этапы: обработчику
+    в момент просрочки, затем админам. Отправленные этапы помнятся в памяти, а после
+    перезапуска восстанавливаются по таблице sla_notifications.
+    """
+
+    def __init__(self, bot: Bot, db: AsyncDatabase, calendar: SlaCalendar, admin_escalation: float, admin_ids: List[int]):
+        """Инициализация; admin_escalation — через сколько после просрочки напомнить админам (0 — не напоминать)."""
+        self.bot = bot
+        self.db = db
+        self.calendar = calendar
+        self.admin_ids = admin_ids
+        # Смещения этапов от момента просрочки
+        self.stages = [0.0] + ([float(admin_escalation)] if admin_escalation > 0 else [])
+        # deal_id -> {"deal", "deadline", "stage" (следующий этап), "seq"}
+        self._deals: Dict[str, Dict[str, Any]] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._refreshes: Set[asyncio.Task] = set()
+        self.notified = [0] * len(self.stages)
+
+    async def start(self) -> None:
+        """Загрузить ожидающие сделки и начать отслеживать сроки."""
+        self.db.add_listener(self._on_change)
+        for deal in await self.db.get_deals(status="awaiting"):
+            sent = len(await self.db.get_sla_notifications(deal["deal_id"]))
+            self._track(deal, min(sent, len(self.stages)))
+        logger.info(f"SLA: отслеживается сделок {len(self._deals)}")
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить отслеживание."""
+        for task in [self._runner, *self._refreshes]:
+            if task:
+                task.cancel()
+        await asyncio.gather(*(task for task in [self._runner, *self._refreshes] if task), return_exceptions=True)
+        self._runner = None
+
+    def _track(self, deal: Dict[str, Any], stage: int) -> None:
+        """Запомнить сделку и поставить её следующий этап в кучу."""
+        entry = {"deal": dict(deal), "deadline": self.calendar.deadline(deal["sent_time"]), "stage": stage, "seq": next(self._seq)}
+        self._deals[deal["deal_id"]] = entry
+        self._schedule(deal["deal_id"], entry)
+
+    def _schedule(self, deal_id: str, entry: Dict[str, Any]) -> None:
+        if entry["stage"] < len(self.stages):
+            heapq.heappush(self._heap, (entry["deadline"] + self.stages[entry["stage"]], entry["seq"], deal_id))
+            self._wakeup.set()
+
+    def _on_change(self, name: str, args: tuple, kwargs: dict) -> None:
+        """Изменение базы: перечитать затронутые сделки."""
+        if name in ("add_deal", "update_deal_status"):
+            deal_ids = [kwargs["deal_id"] if "deal_id" in kwargs else args[0]]
+        elif name == "archive_deals_except":
+            deal_ids = list(self._deals)
+        else:
+            return
+        task = asyncio.create_task(self._refresh(deal_ids))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    async def _refresh(self, deal_ids: List[str]) -> None:
+        """Начать или прекратить отслеживание сделок по их текущему статусу."""
+        for deal_id in deal_ids:
+            deal = await self.db.get_deal(deal_id)
+            if not deal or deal["status"] != "awaiting":
+                self._deals.pop(deal_id, None)
+            elif deal_id not in self._deals:
+                self._track(deal, 0)
+            else:
+                self._deals[deal_id]["deal"] = dict(deal)
+
+    async def _run(self) -> None:
+        """Ждать ближайшего срока и отправлять напоминания."""
+        while True:
+            while self._heap and self._stale(self._heap[0]):
+                heapq.heappop(self._heap)
+            timeout = None
+            if self._heap:
+                timeout = self._heap[0][0] - time.time()
+                if timeout <= 0:
+                    _, _, deal_id = heapq.heappop(self._heap)
+                    try:
+                        await self._notify(deal_id, self._deals[deal_id])
+                    except Exception as e:
+                        logger.error(f"Ошибка SLA-напоминания по сделке {deal_id}: {e}")
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _stale(self, item: Tuple[float, int, str]) -> bool:
+        entry = self._deals.get(item[2])
+        return entry is None or entry["seq"] != item[1]
+
+    async def _notify(self, deal_id: str, entry: Dict[str, Any]) -> None:
+        """Отправить напоминание текущего этапа и запланировать следующий."""
+        stage = entry["stage"]
+        deal = entry["deal"]
+        merchant = await self.db.get_merchant(chat_id=deal["merchant_chat_id"])
+        if merchant:
+            if stage == 0:
+                send_in_background(send_message_with_media(
+                    self.bot,
+                    deal["handler_id"],
+                    RESPONSE_TEMPLATES["sla_expired"].format(deal_id=deal_id, merchant_name=merchant["display_name"]),
+                    []
+                ), PRIORITY_SLA)
+            else:
+                text = RESPONSE_TEMPLATES["sla_escalated"].format(
+                    deal_id=deal_id, merchant_name=merchant["display_name"],
+                    minutes=int((time.time() - entry["deadline"]) // 60)
+                )
+                for admin_id in self.admin_ids:
+                    send_in_background(self.bot.send_message(admin_id, text), PRIORITY_SLA)
+            self.notified[stage] += 1
+            await self.db.add_sla_notification(deal_id, 0, True)
+        # Пока шла запись, сделку могли закрыть или перечитать
+        if self._deals.get(deal_id) is entry:
+            entry["stage"] = stage + 1
+            entry["seq"] = next(self._seq)
+            self._schedule(deal_id, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """Число отслеживаемых сделок, ближайший срок и отправленные напоминания по этапам."""
+        pending = [item for item in self._heap if not self._stale(item)]
+        return {
+            "tracked": len(self._deals),
+            "scheduled": len(pending),
+            "next_in_seconds": int(min(pending)[0] - time.time()) if pending else None,
+            "notified": {("handler" if stage == 0 else "admins"): count for stage, count in enumerate(self.notified)},
+        }
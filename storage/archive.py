@@ -0,0 +1,103 @@
+import gzip
+import os
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+import pytz
+from storage.base import TABLE_KEYS, row_key
+from storage.codec import loads, dumps
+from storage.records import to_record
+
+logger = logging.getLogger(__name__)
+
+# Архивируемые таблицы: поле с временем строки, по которому выбирается дневной сегмент.
+ARCHIVE_TABLES: Dict[str, str] = {
+    "deals": "sent_time",
+    "messages": "sent_time",
+    "proof_messages": "created_at",
+    "sla_notifications": "sent_time",
+}
+
+
+def row_day(table: str, row: Dict[str, Any]) -> str:
+    """День строки по московскому времени (YYYY-MM-DD)."""
+    timestamp = row.get(ARCHIVE_TABLES[table])
+    tz = pytz.timezone("Europe/Moscow")
+    moment = datetime.fromtimestamp(timestamp, tz) if timestamp else datetime.now(tz)
+    return moment.strftime("%Y-%m-%d")
+
+
+class Archive:
+    """Холодный архив по дням: сжатые сегменты <table>/<YYYY-MM-DD>.jsonl.gz."""
+
+    def __init__(self, archive_dir: Path, cache_segments: int = 8):
+        """Инициализация директории архива и кэша открытых сегментов."""
+        self.archive_dir = Path(archive_dir)
+        self.cache_segments = cache_segments
+        # Прочитанные сегменты (таблица, день) -> строки, вытесняются по LRU
+        self._cache: "OrderedDict[Tuple[str, str], List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _path(self, table: str, day: str) -> Path:
+        """Путь к сегменту таблицы за день."""
+        return self.archive_dir / table / f"{day}.jsonl.gz"
+
+    def days(self, table: str) -> List[str]:
+        """Дни, за которые в архиве есть сегменты таблицы."""
+        table_dir = self.archive_dir / table
+        if not table_dir.exists():
+            return []
+        return sorted(p.name[:-len(".jsonl.gz")] for p in table_dir.glob("*.jsonl.gz"))
+
+    def write(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Дописать строки в дневные сегменты (новым gzip-блоком в конец файла)."""
+        by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_day.setdefault(row_day(table, row), []).append(row)
+        with self._lock:
+            for day, day_rows in by_day.items():
+                path = self._path(table, day)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                data = "".join(dumps(row) + "\n" for row in day_rows).encode("utf-8")
+                with path.open("ab") as f:
+                    f.write(gzip.compress(data))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._cache.pop((table, day), None)
+        logger.info(f"В архив {table} перенесено {len(rows)} строк за {len(by_day)} дн.")
+
+    def _segment(self, table: str, day: str) -> List[Dict[str, Any]]:
+        """Прочитать сегмент (лениво, с кэшем последних открытых)."""
+        key = (table, day)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            rows: Dict[Any, Dict[str, Any]] = {}
+            try:
+                with gzip.open(self._path(table, day), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        row = to_record(table, loads(line))
+                        # Повторный перенос после сбоя не должен давать дублей
+                        rows[row_key(table, row) if table in TABLE_KEYS else line.strip()] = row
+            except (OSError, EOFError, ValueError) as e:
+                logger.error(f"Ошибка чтения архива {table} за {day}: {e}")
+            segment = list(rows.values())
+            self._cache[key] = segment
+            if len(self._cache) > self.cache_segments:
+                self._cache.popitem(last=False)
+            return segment
+
+    def read(self, table: str, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Строки архива за дни из диапазона [start, end]."""
+        rows = []
+        for day in self.days(table):
+            if (start and day < start) or (end and day > end):
+                continue
+            rows.extend(self._segment(table, day))
+        return rows
@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple, Iterable, Iterator
+
+# Таблицы базы данных бота.
+TABLES: List[str] = [
+    "users", "merchants", "cascades", "deals", "messages",
+    "sla_notifications", "stats", "shifts", "appeals", "proof_messages", "deferred_jobs"
+]
+
+# Ключи строк для таблиц, которые обновляются на месте. Остальные таблицы только дописываются.
+TABLE_KEYS: Dict[str, Tuple[str, ...]] = {
+    "users": ("user_id",),
+    "merchants": ("name",),
+    "cascades": ("name",),
+    "deals": ("deal_id",),
+    "stats": ("user_id", "date"),
+    "appeals": ("deal_id",),
+    "deferred_jobs": ("job_key",),
+}
+
+# Индексы таблиц: имя индекса -> поля.
+TABLE_INDEXES: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "users": {"user_id": ("user_id",)},
+    "merchants": {"chat_id": ("chat_id",), "name": ("name",)},
+    "cascades": {"chat_id": ("chat_id",), "name": ("name",)},
+    "deals": {"deal_id": ("deal_id",), "status": ("status",)},
+    "messages": {"chat_message": ("chat_id", "message_id"), "deal_id": ("deal_id",)},
+    "stats": {"user_date": ("user_id", "date")},
+    "appeals": {"deal_id": ("deal_id",)},
+    "sla_notifications": {"deal_id": ("deal_id",)},
+    "shifts": {"user_id": ("user_id",)},
+    "proof_messages": {"deal_id": ("deal_id",)},
+    "deferred_jobs": {"job_key": ("job_key",)},
+}
+
+
+def row_key(table: str, row: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Ключ строки таблицы."""
+    return tuple(row.get(field) for field in TABLE_KEYS[table])
+
+
+class Storage:
+    """Базовый класс хранилища таблиц."""
+
+    # Изменения копятся в буфере и становятся долговечными только после flush()
+    group_commit: bool = False
+
+    def all(self, table: str) -> List[Dict[str, Any]]:
+        """Все строки таблицы в порядке вставки."""
+        raise NotImplementedError
+
+    def select(self, table: str, index: str, *values: Any) -> List[Dict[str, Any]]:
+        """Строки таблицы с заданными значениями полей индекса."""
+        raise NotImplementedError
+
+    def insert(self, table: str, row: Dict[str, Any]) -> None:
+        """Вставить строку."""
+        raise NotImplementedError
+
+    def patch(self, table: str, key: Dict[str, Any], fields: Dict[str, Any]) -> None:
+        """Обновить поля строки по ключу."""
+        raise NotImplementedError
+
+    def delete(self, table: str, key: Dict[str, Any]) -> None:
+        """Удалить строку по ключу."""
+        raise NotImplementedError
+
+    def replace(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Заменить содержимое таблицы целиком."""
+        raise NotImplementedError
+
+    @contextmanager
+    def batch(self, tables: Iterable[str]) -> Iterator[None]:
+        """Применить несколько изменений как одно целое: читатели не видят промежуточного состояния."""
+        yield
+
+    def flush(self) -> None:
+        """Сбросить накопленные изменения на диск."""
+
+    def compact_if_needed(self) -> None:
+        """Фоновое обслуживание хранилища."""
+
+    def close(self) -> None:
+        """Закрыть хранилище."""
@@ -0,0 +1,28 @@
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него работает стандартный json
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """Сериализация записей таблиц."""
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    raise TypeError(f"Тип {type(obj).__name__} не сериализуется в JSON")
+
+
+def loads(line: str) -> Any:
+    """Разобрать строку JSON."""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def dumps(obj: Any) -> str:
+    """Сериализовать объект в строку JSON без перевода строки."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, default=_default)
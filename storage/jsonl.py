@@ -0,0 +1,458 @@
+import os
+import itertools
+import logging
+import threading
+from contextlib import contextmanager, ExitStack
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Tuple, Iterable, Iterator
+from config import DB_COMPACT_MAX_BYTES, DB_COMPACT_GARBAGE_RATIO
+from storage.base import Storage, TABLES, TABLE_KEYS, TABLE_INDEXES, row_key
+from storage.codec import loads, dumps
+from storage.offsets import OffsetIndex
+from storage.records import to_record
+
+logger = logging.getLogger(__name__)
+
+# Поле, которого не было в строке до патча
+_MISSING = object()
+
+
+class JsonlStorage(Storage):
+    """Хранилище на файлах JSON Lines с журналом изменений и индексами в памяти."""
+
+    def __init__(self, data_dir: Path, append_only: bool = True, in_memory: bool = True, group_commit: bool = False,
+                 offset_tables: Iterable[str] = ()):
+        """Инициализация директории и файлов таблиц."""
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(exist_ok=True)
+        self.append_only = append_only
+        self.in_memory = in_memory
+        self.group_commit = group_commit and append_only
+        self.files = {table: self.data_dir / f"{table}.jsonl" for table in TABLES}
+        # Счётчики журнала: всего записей в файле и живых строк после свёртки
+        self.log_stats: Dict[str, Dict[str, int]] = {}
+        # Строки в памяти (id строки -> строка) и индексы (значения полей -> {id строки: строка})
+        self._rows: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        self._indexes: Dict[str, Dict[str, Dict[Tuple[Any, ...], Dict[Any, Dict[str, Any]]]]] = {}
+        self._row_ids = itertools.count()
+        # Блокировки таблиц: методы могут вызываться из пула потоков
+        self._locks = {table: threading.RLock() for table in TABLES}
+        # Строки журнала, ожидающие группового сброса на диск
+        self._pending: Dict[str, List[str]] = {table: [] for table in TABLES}
+        # Точки отката таблиц внутри batch(): таблицу держит блокировка, так что точка одна на таблицу
+        self._savepoints: Dict[str, Dict[str, Any]] = {}
+        for file in self.files.values():
+            if not file.exists():
+                file.touch()
+            self._repair_tail(file)
+        # Растущие таблицы без ключа не держим в памяти: поиск по индексу смещений на диске
+        offset_tables = [t for t in offset_tables if t not in TABLE_KEYS] if append_only else []
+        self.offsets = {table: OffsetIndex(self.files[table], TABLE_INDEXES[table]) for table in offset_tables}
+        self._memory = {table for table in TABLES if table not in self.offsets} if in_memory else set()
+        for table in self._memory:
+            self._build(table, self._load(table))
+
+    def _read_jsonl(self, file_path: Path, pending: List[str] = ()) -> List[Dict[str, Any]]:
+        """Чтение JSON Lines файла и ещё не сброшенных строк."""
+        records = []
+        try:
+            with file_path.open("r", encoding="utf-8") as f:
+                for line in itertools.chain(f, pending):
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(loads(line))
+                    except ValueError:
+                        # Оборванная строка после падения посреди дозаписи
+                        logger.warning(f"Пропущена повреждённая строка в {file_path}")
+        except Exception as e:
+            logger.error(f"Ошибка чтения {file_path}: {e}")
+        return records
+
+    def _write_jsonl(self, file_path: Path, data: List[Dict[str, Any]]) -> None:
+        """Атомарная запись JSON Lines файла: временный файл, fsync и замена."""
+        tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+        try:
+            with tmp_path.open("w", encoding="utf-8") as f:
+                for item in data:
+                    f.write(dumps(item) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+            self._fsync_dir()
+        except Exception as e:
+            logger.error(f"Ошибка записи {file_path}: {e}")
+            raise
+
+    def _write_bytes(self, file_path: Path, data: bytes) -> None:
+        """Атомарно заменить содержимое файла."""
+        tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+        with tmp_path.open("wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        self._fsync_dir()
+
+    def _fsync_dir(self) -> None:
+        """Зафиксировать переименование файла в директории."""
+        if os.name != "posix":
+            return
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _repair_tail(self, file_path: Path) -> None:
+        """Отрезать оборванную последнюю строку, оставшуюся после падения посреди дозаписи."""
+        with file_path.open("r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            keep = 0
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    keep = start + newline + 1
+                    break
+                end = start
+            if keep < size:
+                f.truncate(keep)
+                f.flush()
+                os.fsync(f.fileno())
+                logger.warning(f"Отрезана оборванная строка в конце {file_path} ({size - keep} байт)")
+
+    def _append_lines(self, table: str, lines: List[str], sync: bool) -> None:
+        """Дописать строки в конец JSON Lines файла одной записью."""
+        file_path = self.files[table]
+        encoded = [line.encode("utf-8") for line in lines]
+        try:
+            with file_path.open("a+b") as f:
+                offset = f.seek(0, os.SEEK_END)
+                if offset:
+                    f.seek(offset - 1)
+                    if f.read(1) != b"\n":
+                        # Хвост оборван (файл повреждён после открытия): новая запись начинается с новой строки
+                        f.write(b"\n")
+                        offset += 1
+                f.write(b"".join(encoded))
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except Exception as e:
+            logger.error(f"Ошибка дозаписи {file_path}: {e}")
+            raise
+        if table in self.offsets:
+            self.offsets[table].append(offset, encoded)
+
+    def _append_jsonl(self, table: str, item: Dict[str, Any]) -> None:
+        """Дописать запись в журнал таблицы (или в буфер групповой фиксации)."""
+        line = dumps(item) + "\n"
+        if self.group_commit:
+            self._pending[table].append(line)
+        else:
+            self._append_lines(table, [line], sync=False)
+
+    def _fold(self, table: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Свернуть журнал (вставки, патчи, удаления) в актуальные строки."""
+        if table not in TABLE_KEYS:
+            return [r for r in records if "_op" not in r]
+        rows: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        for record in records:
+            op = record.pop("_op", None)
+            if op is None:
+                rows[row_key(table, record)] = record
+                continue
+            key = row_key(table, record.pop("_key"))
+            if op == "patch" and key in rows:
+                rows[key].update(record)
+            elif op == "delete":
+                rows.pop(key, None)
+        return list(rows.values())
+
+    def _load(self, table: str) -> List[Dict[str, Any]]:
+        """Прочитать таблицу с диска с учётом журнала изменений."""
+        records = self._read_jsonl(self.files[table], self._pending[table])
+        total = len(records)
+        rows = [to_record(table, row) for row in self._fold(table, records)]
+        self.log_stats[table] = {"records": total, "live": len(rows)}
+        return rows
+
+    def _build(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Загрузить строки таблицы в память и построить индексы."""
+        self._rows[table] = {}
+        self._indexes[table] = {name: {} for name in TABLE_INDEXES[table]}
+        for row in rows:
+            self._mem_insert(table, row)
+
+    def _index(self, table: str, row_id: Any, row: Dict[str, Any], add: bool) -> None:
+        """Добавить строку в индексы таблицы или убрать её оттуда."""
+        for name, fields in TABLE_INDEXES[table].items():
+            values = tuple(row.get(field) for field in fields)
+            bucket = self._indexes[table][name]
+            if add:
+                bucket.setdefault(values, {})[row_id] = row
+            elif values in bucket:
+                bucket[values].pop(row_id, None)
+                if not bucket[values]:
+                    del bucket[values]
+
+    def _mem_insert(self, table: str, row: Dict[str, Any]) -> Any:
+        """Вставить строку в память и вернуть её id."""
+        if table in TABLE_KEYS:
+            row_id = row_key(table, row)
+            if row_id in self._rows[table]:
+                self._mem_delete(table, row)
+        else:
+            row_id = next(self._row_ids)
+        self._rows[table][row_id] = row
+        self._index(table, row_id, row, add=True)
+        return row_id
+
+    def _mem_remove(self, table: str, row_id: Any) -> None:
+        """Удалить строку из памяти по id."""
+        row = self._rows[table].pop(row_id, None)
+        if row is not None:
+            self._index(table, row_id, row, add=False)
+
+    def _mem_restore(self, table: str, row_id: Any, old: Dict[str, Any]) -> None:
+        """Вернуть полям строки прежние значения (отмена патча)."""
+        row = self._rows[table].get(row_id)
+        if row is None:
+            return
+        self._index(table, row_id, row, add=False)
+        for field, value in old.items():
+            if value is _MISSING:
+                row.pop(field, None)
+            else:
+                row[field] = value
+        self._index(table, row_id, row, add=True)
+
+    def _on_undo(self, table: str, undo: Callable[[], None]) -> None:
+        """Запомнить отмену изменения в памяти, если таблица внутри batch()."""
+        savepoint = self._savepoints.get(table)
+        if savepoint is not None:
+            savepoint["undo"].append(undo)
+
+    def _mem_patch(self, table: str, key: Dict[str, Any], fields: Dict[str, Any]) -> None:
+        """Обновить строку в памяти."""
+        row_id = row_key(table, key)
+        row = self._rows[table].get(row_id)
+        if row is None:
+            return
+        self._index(table, row_id, row, add=False)
+        row.update(fields)
+        self._index(table, row_id, row, add=True)
+
+    def _mem_delete(self, table: str, key: Dict[str, Any]) -> None:
+        """Удалить строку из памяти."""
+        self._mem_remove(table, row_key(table, key))
+
+    def _persist(self, table: str, record: Dict[str, Any]) -> None:
+        """Сохранить изменение на диск: дозаписью в журнал или перезаписью файла."""
+        if self.append_only:
+            self._append_jsonl(table, record)
+            stats = self.log_stats.get(table)
+            if stats is not None:
+                stats["records"] += 1
+                stats["live"] += {"patch": 0, "delete": -1}.get(record.get("_op"), 1)
+        elif table in self._memory:
+            self.replace(table, self.all(table))
+        else:
+            records = self._read_jsonl(self.files[table], self._pending[table])
+            records.append(record)
+            self.replace(table, self._fold(table, records))
+
+    def all(self, table: str) -> List[Dict[str, Any]]:
+        """Все строки таблицы (копии: правка результата не меняет строки в памяти и индексы)."""
+        with self._locks[table]:
+            if table in self._memory:
+                return [row.copy() for row in self._rows[table].values()]
+            return self._load(table)
+
+    def select(self, table: str, index: str, *values: Any) -> List[Dict[str, Any]]:
+        """Строки таблицы с заданными значениями полей индекса."""
+        with self._locks[table]:
+            if table in self._memory:
+                return [row.copy() for row in self._indexes[table][index].get(values, {}).values()]
+            fields = TABLE_INDEXES[table][index]
+            if table in self.offsets:
+                rows = self.offsets[table].lookup(index, values)
+                # Строки из буфера групповой фиксации ещё не попали в файл и индекс
+                for line in self._pending[table]:
+                    row = loads(line)
+                    if tuple(row.get(field) for field in fields) == values:
+                        rows.append(row)
+                return [to_record(table, row) for row in rows]
+            return [r for r in self._load(table) if tuple(r.get(field) for field in fields) == values]
+
+    def insert(self, table: str, row: Dict[str, Any]) -> None:
+        """Вставить строку."""
+        row = to_record(table, row)
+        with self._locks[table]:
+            if table in self._memory:
+                previous = self._rows[table].get(row_key(table, row)) if table in TABLE_KEYS else None
+                row_id = self._mem_insert(table, row)
+                if previous is not None:
+                    self._on_undo(table, lambda: self._mem_insert(table, previous))
+                else:
+                    self._on_undo(table, lambda: self._mem_remove(table, row_id))
+            self._persist(table, row)
+
+    def patch(self, table: str, key: Dict[str, Any], fields: Dict[str, Any]) -> None:
+        """Обновить поля строки по ключу."""
+        with self._locks[table]:
+            if table in self._memory:
+                row_id = row_key(table, key)
+                row = self._rows[table].get(row_id)
+                if row is not None:
+                    old = {field: row.get(field, _MISSING) for field in fields}
+                    self._on_undo(table, lambda: self._mem_restore(table, row_id, old))
+                self._mem_patch(table, key, fields)
+            self._persist(table, {"_op": "patch", "_key": key, **fields})
+
+    def delete(self, table: str, key: Dict[str, Any]) -> None:
+        """Удалить строку по ключу."""
+        with self._locks[table]:
+            if table in self._memory:
+                row = self._rows[table].get(row_key(table, key))
+                if row is not None:
+                    self._on_undo(table, lambda: self._mem_insert(table, row))
+                self._mem_delete(table, key)
+            self._persist(table, {"_op": "delete", "_key": key})
+
+    def replace(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Перезаписать таблицу целиком новым снимком."""
+        with self._locks[table]:
+            savepoint = self._savepoints.get(table)
+            if savepoint is not None:
+                # Файл перезаписывается целиком: при откате его придётся восстановить, а не усечь
+                savepoint["rewritten"] = True
+                if table not in self._memory and savepoint["file"] is None:
+                    savepoint["file"] = self.files[table].read_bytes()
+                    savepoint["pending_lines"] = list(self._pending[table])
+            if table in self._memory:
+                old_rows = list(self._rows[table].values())
+                self._on_undo(table, lambda: self._build(table, old_rows))
+                self._build(table, rows)
+            # Снимок уже отражает все изменения из буфера
+            self._pending[table].clear()
+            if table in self.offsets:
+                # Отображение файла нужно закрыть до замены файла (Windows)
+                self.offsets[table].close()
+            self._write_jsonl(self.files[table], rows)
+            if table in self.offsets:
+                self.offsets[table].rebuild()
+            self.log_stats[table] = {"records": len(rows), "live": len(rows)}
+
+    def needs_compaction(self, table: str) -> bool:
+        """Проверить, пора ли сворачивать журнал таблицы."""
+        if table not in TABLE_KEYS:
+            return False
+        if table not in self.log_stats:
+            self.all(table)
+        stats = self.log_stats[table]
+        garbage = stats["records"] - stats["live"]
+        if garbage <= 0:
+            return False
+        if garbage / stats["records"] >= DB_COMPACT_GARBAGE_RATIO:
+            return True
+        return self.files[table].stat().st_size >= DB_COMPACT_MAX_BYTES
+
+    def compact(self, table: str) -> None:
+        """Свернуть журнал таблицы в свежий снимок."""
+        with self._locks[table]:
+            rows = self.all(table)
+            garbage = self.log_stats[table]["records"] - len(rows)
+            self.replace(table, rows)
+        logger.info(f"Сжат журнал {table}: удалено {garbage} записей")
+
+    def compact_if_needed(self) -> None:
+        """Сжать журналы таблиц, превысивших порог размера или доли мусора."""
+        for table in TABLE_KEYS:
+            try:
+                if self.needs_compaction(table):
+                    self.compact(table)
+            except Exception as e:
+                logger.error(f"Ошибка сжатия {table}: {e}")
+
+    @contextmanager
+    def batch(self, tables: Iterable[str]) -> Iterator[None]:
+        """Держать блокировки всех затронутых таблиц, пока применяются изменения.
+
+        Если блок завершился исключением, изменения таблиц откатываются в памяти и на диске.
+        Вложенный batch по уже захваченным таблицам откатывается вместе с внешним.
+        """
+        with ExitStack() as stack:
+            tables = sorted(set(tables))
+            for table in tables:
+                stack.enter_context(self._locks[table])
+            opened = [table for table in tables if table not in self._savepoints]
+            for table in opened:
+                self._savepoints[table] = {
+                    "undo": [],
+                    "pending": len(self._pending[table]),
+                    "size": self.files[table].stat().st_size,
+                    "log_stats": dict(self.log_stats[table]) if table in self.log_stats else None,
+                    "rewritten": False,
+                    "file": None,
+                    "pending_lines": None,
+                }
+            try:
+                yield
+            except BaseException:
+                for table in opened:
+                    self._rollback(table, self._savepoints.pop(table))
+                raise
+            finally:
+                for table in opened:
+                    self._savepoints.pop(table, None)
+
+    def _rollback(self, table: str, savepoint: Dict[str, Any]) -> None:
+        """Вернуть таблицу к состоянию на начало batch()."""
+        for undo in reversed(savepoint["undo"]):
+            undo()
+        if savepoint["rewritten"] or not self.append_only:
+            if table in self._memory:
+                # Память уже восстановлена: записываем её снимком
+                self.replace(table, list(self._rows[table].values()))
+                return
+            if savepoint["file"] is not None:
+                if table in self.offsets:
+                    self.offsets[table].close()
+                self._write_bytes(self.files[table], savepoint["file"])
+                self._pending[table][:] = savepoint["pending_lines"]
+                if table in self.offsets:
+                    self.offsets[table].rebuild()
+        else:
+            del self._pending[table][savepoint["pending"]:]
+            if self.files[table].stat().st_size > savepoint["size"]:
+                # Дозапись без групповой фиксации уже на диске: отрезаем её
+                if table in self.offsets:
+                    self.offsets[table].close()
+                with self.files[table].open("r+b") as f:
+                    f.truncate(savepoint["size"])
+                if table in self.offsets:
+                    self.offsets[table].rebuild()
+        if savepoint["log_stats"] is not None:
+            self.log_stats[table] = savepoint["log_stats"]
+        else:
+            self.log_stats.pop(table, None)
+
+    def flush(self) -> None:
+        """Сбросить буфер: одна запись и один fsync на таблицу."""
+        for table in TABLES:
+            with self._locks[table]:
+                lines = self._pending[table]
+                if not lines:
+                    continue
+                self._append_lines(table, lines, sync=True)
+                lines.clear()
+
+    def close(self) -> None:
+        """Сбросить буфер и закрыть индексы смещений."""
+        self.flush()
+        for index in self.offsets.values():
+            index.close()
@@ -0,0 +1,162 @@
+import mmap
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Iterator
+from storage.codec import loads, dumps
+
+logger = logging.getLogger(__name__)
+
+
+class OffsetIndex:
+    """Индекс смещений строк JSON Lines файла на диске (файл-спутник .idx)."""
+
+    def __init__(self, path: Path, indexes: Dict[str, Tuple[str, ...]]):
+        """Загрузить индекс из файла-спутника или построить его по данным."""
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self.indexes = indexes
+        # Значения полей индекса -> список (смещение, длина) строк
+        self.offsets: Dict[str, Dict[Tuple[Any, ...], List[Tuple[int, int]]]] = {}
+        # Сколько байт файла данных покрыто индексом
+        self.size = 0
+        self._file = None
+        self._mmap = None
+        self._load()
+
+    def _reset(self) -> None:
+        """Очистить индекс в памяти."""
+        self.close()
+        self.offsets = {name: {} for name in self.indexes}
+        self.size = 0
+
+    def _keys(self, row: Dict[str, Any]) -> List[List[Any]]:
+        """Значения полей всех индексов строки."""
+        return [[row.get(field) for field in fields] for fields in self.indexes.values()]
+
+    def _add(self, offset: int, length: int, keys: List[List[Any]]) -> None:
+        """Добавить строку в индекс в памяти."""
+        for name, values in zip(self.indexes, keys):
+            self.offsets[name].setdefault(tuple(values), []).append((offset, length))
+        self.size = max(self.size, offset + length)
+
+    def _scan(self, start: int) -> Iterator[Tuple[int, int, List[List[Any]]]]:
+        """Пройти по строкам файла данных начиная со смещения start."""
+        with self.path.open("rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Оборванная последняя строка не покрыта индексом: её дополнит или отрежет следующая запись
+                    break
+                length = len(line)
+                if line.strip():
+                    try:
+                        row = loads(line)
+                    except ValueError:
+                        row = None
+                    # Записи журнала и повреждённые строки в индекс не попадают
+                    if isinstance(row, dict) and "_op" not in row:
+                        yield offset, length, self._keys(row)
+                offset += length
+        self.size = max(self.size, offset)
+
+    def _write_entries(self, entries: List[Tuple[int, int, List[List[Any]]]], mode: str) -> None:
+        """Записать элементы индекса в файл-спутник."""
+        try:
+            with self.index_path.open(mode, encoding="utf-8") as f:
+                f.write("".join(dumps([offset, length, keys]) + "\n" for offset, length, keys in entries))
+        except Exception as e:
+            # Индекс восстанавливается по данным, потеря файла-спутника не критична
+            logger.error(f"Ошибка записи индекса {self.index_path}: {e}")
+
+    def _load(self) -> None:
+        """Прочитать файл-спутник и догнать индекс до конца файла данных."""
+        self._reset()
+        data_size = self.path.stat().st_size if self.path.exists() else 0
+        if not self.index_path.exists():
+            self.rebuild()
+            return
+        try:
+            with self.index_path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        offset, length, keys = loads(line)
+                    except ValueError:
+                        continue
+                    self._add(offset, length, keys)
+        except Exception as e:
+            logger.error(f"Ошибка чтения индекса {self.index_path}: {e}")
+            self.rebuild()
+            return
+        if self.size > data_size:
+            # Файл данных перезаписан (снимок), индекс устарел
+            self.rebuild()
+        elif self.size < data_size:
+            # Строки, дописанные без индекса (например, падение между записями)
+            self._index_tail()
+
+    def _index_tail(self) -> None:
+        """Проиндексировать строки файла данных после покрытой части."""
+        entries = list(self._scan(self.size))
+        for entry in entries:
+            self._add(*entry)
+        if entries:
+            self._write_entries(entries, "a")
+            logger.info(f"Индекс {self.index_path.name} дополнен на {len(entries)} строк")
+
+    def rebuild(self) -> None:
+        """Построить индекс заново по файлу данных."""
+        self._reset()
+        entries = list(self._scan(0)) if self.path.exists() else []
+        for entry in entries:
+            self._add(*entry)
+        self._write_entries(entries, "w")
+        logger.info(f"Индекс {self.index_path.name} построен: {len(entries)} строк")
+
+    def append(self, offset: int, lines: List[bytes]) -> None:
+        """Учесть строки, дописанные в файл данных начиная со смещения offset."""
+        if offset != self.size:
+            # Файл менялся в обход индекса — догоняем по данным
+            self._index_tail()
+            return
+        entries = []
+        for line in lines:
+            row = loads(line)
+            if "_op" not in row:
+                entries.append((offset, len(line), self._keys(row)))
+            offset += len(line)
+        for entry in entries:
+            self._add(*entry)
+        self.size = offset
+        self._write_entries(entries, "a")
+
+    def _view(self, end: int) -> mmap.mmap:
+        """Отображение файла данных в память, покрывающее первые end байт."""
+        if self._mmap is None or len(self._mmap) < end:
+            self.close()
+            self._file = self.path.open("rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def lookup(self, name: str, values: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+        """Прочитать строки с заданными значениями полей индекса."""
+        positions = self.offsets[name].get(tuple(values))
+        if not positions:
+            return []
+        view = self._view(max(offset + length for offset, length in positions))
+        rows = []
+        for offset, length in positions:
+            try:
+                rows.append(loads(view[offset:offset + length]))
+            except ValueError:
+                logger.warning(f"Пропущена повреждённая строка {self.path} по смещению {offset}")
+        return rows
+
+    def close(self) -> None:
+        """Закрыть отображение файла."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,180 @@
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Tuple, Type
+
+
+class Record(MutableMapping):
+    """Запись таблицы с полями в __slots__.
+
+    Ведёт себя как словарь (r["status"], r.get(...), dict(r)), поэтому
+    обработчики работают с ней так же, как раньше с dict. Незаданные поля
+    считаются отсутствующими ключами, поля вне схемы хранятся в _extra.
+    """
+
+    __slots__ = ("_extra",)
+    _fields: Tuple[str, ...] = ()
+    _field_set: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(cls.__dict__.get("__slots__", ()))
+        cls._field_set = frozenset(cls._fields)
+        cls.from_dict = classmethod(_make_from_dict(cls._fields))
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, **fields: Any):
+        self._extra: Optional[Dict[str, Any]] = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Record":
+        """Создать запись из словаря (у подклассов заменяется сгенерированной функцией)."""
+        return cls(data)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self._field_set:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for field in self._fields:
+            if hasattr(self, field):
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._field_set:
+            return getattr(self, key, default)
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def copy(self) -> "Record":
+        """Неглубокая копия записи, как dict.copy()."""
+        record = object.__new__(type(self))
+        for field in self._fields:
+            if hasattr(self, field):
+                setattr(record, field, getattr(self, field))
+        record._extra = dict(self._extra) if self._extra else None
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Обычный словарь для сериализации."""
+        return {key: self[key] for key in self}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def _make_from_dict(fields: Tuple[str, ...]):
+    """Сгенерировать быстрый конструктор записи из словаря.
+
+    Развёрнутые присваивания по полям заметно быстрее цикла с setattr, а
+    разбор таблиц — горячий путь при загрузке базы.
+    """
+    lines = [
+        "def from_dict(cls, data):",
+        "    record = new(cls)",
+        "    record._extra = None",
+    ]
+    for field in fields:
+        lines.append(f"    if {field!r} in data: record.{field} = data[{field!r}]")
+    lines += [
+        "    if not data.keys() <= field_set:",
+        "        record._extra = {k: v for k, v in data.items() if k not in field_set}",
+        "    return record",
+    ]
+    namespace = {"new": object.__new__, "field_set": frozenset(fields)}
+    exec("\n".join(lines), namespace)
+    return namespace["from_dict"]
+
+
+class Merchant(Record):
+    __slots__ = ("name", "display_name", "chat_id", "merchant_id", "handler_id")
+
+
+class Cascade(Record):
+    __slots__ = ("name", "display_name", "chat_id", "needs_external_id")
+
+
+class Deal(Record):
+    __slots__ = ("deal_id", "merchant_chat_id", "message_id", "status", "sent_time", "merchant_id", "handler_id")
+
+
+class Message(Record):
+    __slots__ = ("deal_id", "chat_id", "message_id", "user_id", "sent_time")
+
+
+class Stat(Record):
+    __slots__ = (
+        "user_id", "date", "merchants", "taken", "approved", "completed",
+        "rejected", "viewed", "errors", "merchant_messages"
+    )
+
+
+class Appeal(Record):
+    __slots__ = ("deal_id", "user_id", "is_manual", "created_at")
+
+
+class SLANotification(Record):
+    __slots__ = ("deal_id", "message_id", "sent", "sent_time")
+
+
+class Shift(Record):
+    __slots__ = ("user_id", "start_time", "end_time")
+
+
+class ProofMessage(Record):
+    __slots__ = ("deal_id", "message_id", "created_at")
+
+
+# Класс записи для таблицы. Таблицы без класса хранят обычные словари.
+RECORD_TYPES: Dict[str, Type[Record]] = {
+    "merchants": Merchant,
+    "cascades": Cascade,
+    "deals": Deal,
+    "messages": Message,
+    "stats": Stat,
+    "appeals": Appeal,
+    "sla_notifications": SLANotification,
+    "shifts": Shift,
+    "proof_messages": ProofMessage,
+}
+
+
+def to_record(table: str, data: Dict[str, Any]) -> Any:
+    """Преобразовать словарь в запись таблицы."""
+    record_type = RECORD_TYPES.get(table)
+    if record_type is None or isinstance(data, record_type):
+        return data
+    return record_type.from_dict(data)
@@ -0,0 +1,220 @@
+import sqlite3
+import sys
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Iterable, Iterator
+from storage.base import Storage, TABLES, TABLE_KEYS, TABLE_INDEXES, row_key
+from storage.jsonl import JsonlStorage
+from storage.codec import loads, dumps
+from storage.records import to_record
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(table: str) -> List[str]:
+    """Поля таблицы, вынесенные в отдельные колонки (ключ и индексы)."""
+    columns = list(TABLE_KEYS.get(table, ()))
+    for fields in TABLE_INDEXES[table].values():
+        columns += [field for field in fields if field not in columns]
+    return columns
+
+
+class SqliteStorage(Storage):
+    """Хранилище на SQLite в режиме WAL.
+
+    Строка целиком лежит в колонке data (JSON), ключевые и индексируемые поля
+    продублированы в отдельных колонках с индексами. Запись идёт через одно
+    соединение под блокировкой, чтение — через соединения своих потоков,
+    а при незафиксированной транзакции записи — через соединение записи.
+    """
+
+    def __init__(self, path: Path, group_commit: bool = False):
+        """Открыть базу и создать схему."""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.group_commit = group_commit
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # При групповой фиксации fsync делается один раз на пачку, его можно не экономить
+        self.conn.execute(f"PRAGMA synchronous={'FULL' if group_commit else 'NORMAL'}")
+        self.lock = threading.RLock()
+        self._batching = 0
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self.columns = {table: _columns(table) for table in TABLES}
+        with self.conn:
+            for table in TABLES:
+                self._create(table)
+
+    def _create(self, table: str) -> None:
+        """Создать таблицу и её индексы."""
+        columns = "".join(f", {column}" for column in self.columns[table])
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT{columns}, data TEXT NOT NULL)")
+        if table in TABLE_KEYS:
+            self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_pkey ON {table} ({', '.join(TABLE_KEYS[table])})")
+        for name, fields in TABLE_INDEXES[table].items():
+            if fields == TABLE_KEYS.get(table):
+                continue
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_{name} ON {table} ({', '.join(fields)})")
+
+    def _reader(self) -> sqlite3.Connection:
+        """Соединение для чтения из текущего потока."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._local.conn = conn
+            with self.lock:
+                self._readers.append(conn)
+        return conn
+
+    def _query(self, sql: str, params: Iterable[Any] = ()) -> List[Tuple[Any, ...]]:
+        """Выполнить чтение.
+
+        Пока открыта транзакция записи (групповая фиксация или batch), её изменения видны
+        только соединению записи, поэтому чтение идёт через него под блокировкой.
+        """
+        if self.conn.in_transaction:
+            with self.lock:
+                if self.conn.in_transaction:
+                    return self.conn.execute(sql, tuple(params)).fetchall()
+        return self._reader().execute(sql, tuple(params)).fetchall()
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        """Изменение под блокировкой в точке сохранения общей транзакции.
+
+        Транзакция фиксируется сразу, если нет групповой фиксации и внешнего batch().
+        """
+        with self.lock:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN")
+            self.conn.execute("SAVEPOINT op")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK TO op")
+                raise
+            finally:
+                self.conn.execute("RELEASE op")
+                # После отката в транзакции остаются только уже применённые изменения
+                if not self.group_commit and not self._batching:
+                    self.conn.commit()
+
+    @contextmanager
+    def batch(self, tables: Iterable[str]) -> Iterator[None]:
+        """Применить несколько изменений в одной транзакции; исключение в блоке откатывает их все.
+
+        Чтения внутри блока идут через соединение записи и видят уже применённые изменения.
+        """
+        with self.lock:
+            self._batching += 1
+            try:
+                with self._write():
+                    yield
+            finally:
+                self._batching -= 1
+                if not self.group_commit and not self._batching:
+                    self.conn.commit()
+
+    def _where(self, fields: Tuple[str, ...]) -> str:
+        """Условие равенства по полям."""
+        return " AND ".join(f"{field} = ?" for field in fields)
+
+    def _values(self, table: str, row: Dict[str, Any]) -> List[Any]:
+        """Значения колонок строки."""
+        return [row.get(column) for column in self.columns[table]]
+
+    def _insert_row(self, table: str, row: Dict[str, Any]) -> None:
+        """Вставить строку (для таблиц с ключом — с заменой)."""
+        columns = self.columns[table] + ["data"]
+        verb = "INSERT OR REPLACE" if table in TABLE_KEYS else "INSERT"
+        self.conn.execute(
+            f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            self._values(table, row) + [dumps(row)]
+        )
+
+    def all(self, table: str) -> List[Dict[str, Any]]:
+        """Все строки таблицы."""
+        rows = self._query(f"SELECT data FROM {table} ORDER BY id")
+        return [to_record(table, loads(data)) for (data,) in rows]
+
+    def select(self, table: str, index: str, *values: Any) -> List[Dict[str, Any]]:
+        """Строки таблицы с заданными значениями полей индекса."""
+        fields = TABLE_INDEXES[table][index]
+        rows = self._query(f"SELECT data FROM {table} WHERE {self._where(fields)} ORDER BY id", values)
+        return [to_record(table, loads(data)) for (data,) in rows]
+
+    def insert(self, table: str, row: Dict[str, Any]) -> None:
+        """Вставить строку."""
+        with self._write():
+            self._insert_row(table, row)
+
+    def patch(self, table: str, key: Dict[str, Any], fields: Dict[str, Any]) -> None:
+        """Обновить поля строки по ключу."""
+        where = self._where(TABLE_KEYS[table])
+        with self._write():
+            found = self.conn.execute(f"SELECT id, data FROM {table} WHERE {where}", row_key(table, key)).fetchone()
+            if found is None:
+                return
+            row_id, data = found
+            row = loads(data)
+            row.update(fields)
+            assignments = ", ".join(f"{column} = ?" for column in self.columns[table] + ["data"])
+            self.conn.execute(
+                f"UPDATE {table} SET {assignments} WHERE id = ?",
+                self._values(table, row) + [dumps(row), row_id]
+            )
+
+    def delete(self, table: str, key: Dict[str, Any]) -> None:
+        """Удалить строку по ключу."""
+        with self._write():
+            self.conn.execute(f"DELETE FROM {table} WHERE {self._where(TABLE_KEYS[table])}", row_key(table, key))
+
+    def replace(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Заменить содержимое таблицы целиком."""
+        with self._write():
+            self.conn.execute(f"DELETE FROM {table}")
+            for row in rows:
+                self._insert_row(table, row)
+
+    def flush(self) -> None:
+        """Зафиксировать накопленную транзакцию."""
+        with self.lock:
+            if self.conn.in_transaction:
+                self.conn.commit()
+
+    def close(self) -> None:
+        """Закрыть соединения."""
+        self.flush()
+        with self.lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+            self.conn.close()
+
+
+def import_jsonl(data_dir: Path, db_path: Path) -> Dict[str, int]:
+    """Разовый перенос данных из файлов JSON Lines в SQLite."""
+    source = JsonlStorage(data_dir, in_memory=False)
+    target = SqliteStorage(db_path)
+    counts = {}
+    try:
+        for table in TABLES:
+            rows = source.all(table)
+            target.replace(table, rows)
+            counts[table] = len(rows)
+            logger.info(f"Перенесено {len(rows)} строк в {table}")
+    finally:
+        target.close()
+    return counts
+
+
+if __name__ == "__main__":
+    # python -m storage.sqlite [data_dir] [db_path]
+    logging.basicConfig(level=logging.INFO)
+    data_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("data")
+    db_path = Path(sys.argv[2]) if len(sys.argv) > 2 else data_dir / "pspw.db"
+    for table, count in import_jsonl(data_dir, db_path).items():
+        print(f"{table}: {count}")
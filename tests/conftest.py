@@ -0,0 +1,40 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FakeClock:
+    """Замена модуля time в проверяемом модуле: часы стоят, пока их не сдвинут advance().
+
+    Подменяется атрибут time модуля (monkeypatch.setattr(module, "time", clock)),
+    а не сам модуль time, поэтому часы цикла событий asyncio идут как обычно.
+    """
+
+    def __init__(self, now: float = 1_750_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+    def __getattr__(self, name):
+        # strftime, localtime и прочее — из настоящего модуля
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
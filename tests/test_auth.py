@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import json
+import time
+
+import pytest
+
+import auth
+from auth import TokenManager, jwt_expiry
+
+
+def make_jwt(payload) -> str:
+    """JWT с заданной полезной нагрузкой (подпись не проверяется)."""
+    encode = lambda data: base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{encode({'alg': 'HS256'})}.{encode(payload)}.sig"
+
+
+class FakeLogin:
+    """Вход в API: считает вызовы и одновременные входы, выдаёт токены через make_token."""
+
+    def __init__(self, make_token):
+        self.make_token = make_token
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            return self.make_token(self.calls)
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def fake_time(clock, monkeypatch):
+    monkeypatch.setattr(auth, "time", clock)
+    return clock
+
+
+def test_jwt_expiry():
+    assert jwt_expiry(make_jwt({"exp": 1750000100})) == 1750000100
+    assert jwt_expiry(make_jwt({"sub": "bot"})) is None
+    assert jwt_expiry("not-a-jwt") is None
+
+
+def test_expired_token_relogs_once_for_concurrent_callers(fake_time):
+    login = FakeLogin(lambda n: make_jwt({"exp": fake_time.now + 3600, "n": n}))
+    manager = TokenManager(login, refresh_margin=300, default_lifetime=600)
+
+    async def main():
+        first = await asyncio.gather(*(manager.get() for _ in range(20)))
+        fake_time.advance(3600)
+        assert not manager.valid()
+        second = await asyncio.gather(*(manager.get() for _ in range(20)))
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert login.calls == 2
+    assert login.max_active == 1
+    assert len(set(first)) == 1 and len(set(second)) == 1 and first[0] != second[0]
+    assert manager.expires_at == fake_time.now + 3600
+
+
+def test_rejected_token_relogs_once_for_concurrent_callers(fake_time):
+    login = FakeLogin(lambda n: make_jwt({"exp": fake_time.now + 3600, "n": n}))
+    manager = TokenManager(login, refresh_margin=300, default_lifetime=600)
+
+    async def main():
+        token = await manager.get()
+        # Сервер отверг ещё не истёкший токен: вся пачка запросов получила 401 с ним
+        return token, await asyncio.gather(*(manager.unauthorized(token) for _ in range(20)))
+
+    token, renewed = asyncio.run(main())
+    assert login.calls == 2
+    assert set(renewed) == {manager.token} and manager.token != token
+    assert manager.rejected == 20
+
+
+@pytest.mark.parametrize("token", ["opaque-token", make_jwt({"sub": "bot"})])
+def test_token_without_exp_uses_default_lifetime(fake_time, token):
+    login = FakeLogin(lambda n: token)
+    manager = TokenManager(login, refresh_margin=300, default_lifetime=600)
+
+    async def main():
+        await manager.get()
+        assert manager.expires_at == fake_time.now + 600
+        fake_time.advance(599)
+        await manager.get()
+        assert login.calls == 1
+        fake_time.advance(1)
+        await asyncio.gather(*(manager.get() for _ in range(10)))
+
+    asyncio.run(main())
+    assert login.calls == 2
+
+
+def test_background_refresh_renews_before_expiry():
+    # Настоящие часы: токены живут 0.3 с, обновление за половину срока до истечения
+    login = FakeLogin(lambda n: make_jwt({"exp": time.time() + 0.3, "n": n}))
+    manager = TokenManager(login, refresh_margin=300, default_lifetime=600)
+
+    async def main():
+        manager.start()
+        tokens = []
+        deadline = time.time() + 0.5
+        while time.time() < deadline:
+            tokens += await asyncio.gather(*(manager.get() for _ in range(5)))
+            await asyncio.sleep(0.01)
+        await manager.stop()
+        return tokens
+
+    tokens = asyncio.run(main())
+    assert None not in tokens
+    assert login.max_active == 1
+    # Первый вход и обновления примерно каждые 0.15 с, без входов по запросам вызывающих
+    assert 2 <= login.calls <= 5
+    assert len(set(tokens)) <= login.calls
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from database import Database, AsyncDatabase
+from storage.archive import Archive
+from storage.jsonl import JsonlStorage
+from storage.sqlite import SqliteStorage
+
+
+def make_storage(backend, path, group_commit):
+    if backend == "sqlite":
+        return SqliteStorage(path / "test.db", group_commit=group_commit)
+    return JsonlStorage(path / "data", group_commit=group_commit, offset_tables=["messages"])
+
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def backend(request):
+    return request.param
+
+
+def run_async_db(backend, tmp_path, scenario):
+    """Выполнить сценарий над AsyncDatabase с групповой фиксацией и закрыть базу."""
+    async def main():
+        db = AsyncDatabase(Database(make_storage(backend, tmp_path, True), Archive(tmp_path / "archive")), commit_window_ms=5)
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+    return asyncio.run(main())
+
+
+def test_concurrent_read_modify_write(backend, tmp_path):
+    async def scenario(db):
+        await asyncio.gather(*(db.add_stat(1, "taken", "m") for _ in range(10)))
+        added = await asyncio.gather(*(db.add_deal("D1", -1, 1, "awaiting", 0.0, "m", 7) for _ in range(2)))
+        return added, db.db.storage.all("stats")
+
+    added, stats = run_async_db(backend, tmp_path, scenario)
+    assert sorted(added) == [False, True]
+    assert stats[0]["taken"] == 10
+
+
+@pytest.mark.parametrize("group_commit", [False, True])
+def test_transaction_is_all_or_nothing(backend, group_commit, tmp_path):
+    async def scenario(db):
+        async with db.transaction() as tx:
+            tx.add_deal("D1", -1, 1, "awaiting", 0.0, "m", 7)
+            tx.update_deal_status("D1", "awaiting_integrator")
+        applied = tx.results
+        async with db.transaction() as tx:
+            tx.add_deal("D2", -1, 2, "awaiting", 0.0, "m", 7)
+            tx.add_stat(7, "taken", "m")
+            tx.add_message("D2", -1, 2, 7, 0.0)
+            tx.update_deal_status("missing", "completed")
+        assert not await db.get_deal("D2")
+        assert not await db.get_messages(deal_id="D2")
+        return applied, tx.results
+
+    async def main():
+        db = AsyncDatabase(Database(make_storage(backend, tmp_path, group_commit), Archive(tmp_path / "archive")))
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+
+    applied, aborted = asyncio.run(main())
+    assert applied == [True, True]
+    assert aborted == [False, False, False, False]
+    # Проверяем то, что дошло до диска
+    db = Database(make_storage(backend, tmp_path, False), Archive(tmp_path / "archive"))
+    try:
+        assert db.get_deal("D1")["status"] == "awaiting_integrator"
+        assert not db.get_deal("D2")
+        assert db.storage.all("stats") == []
+        assert db.storage.all("messages") == []
+    finally:
+        db.storage.close()
+
+
+def tear_tail(path, table):
+    """Обрезать последнюю строку файла таблицы посередине, как при падении во время дозаписи."""
+    file = path / "data" / f"{table}.jsonl"
+    data = file.read_bytes()
+    last = data.rstrip(b"\n").rfind(b"\n") + 1
+    file.write_bytes(data[:last + (len(data) - last) // 2])
+
+
+@pytest.mark.parametrize("reopen", [False, True])
+def test_torn_tail_is_not_merged_with_next_append(reopen, tmp_path):
+    db = Database(make_storage("jsonl", tmp_path, False), Archive(tmp_path / "archive"))
+    for deal_id in ("a", "b"):
+        db.add_deal(deal_id, -1, 1, "awaiting", 0.0, "m", 7)
+        db.add_message(deal_id, -1, 1, 7, 0.0)
+    for table in ("deals", "messages"):
+        tear_tail(tmp_path, table)
+    if reopen:
+        db.storage.close()
+        db = Database(make_storage("jsonl", tmp_path, False), Archive(tmp_path / "archive"))
+    db.add_deal("c", -1, 1, "awaiting", 0.0, "m", 7)
+    db.add_message("c", -1, 1, 7, 0.0)
+    db.storage.close()
+
+    db = Database(make_storage("jsonl", tmp_path, False), Archive(tmp_path / "archive"))
+    try:
+        assert db.get_deal("a") and db.get_deal("c")
+        assert [m["deal_id"] for m in db.get_messages(chat_id=-1)] == ["a", "c"]
+    finally:
+        db.storage.close()
+
+
+def test_group_commit_keeps_acknowledged_rows_after_torn_flush(tmp_path):
+    db = Database(make_storage("jsonl", tmp_path, True), Archive(tmp_path / "archive"))
+    for deal_id in ("a", "b"):
+        db.add_deal(deal_id, -1, 1, "awaiting", 0.0, "m", 7)
+        db.add_message(deal_id, -1, 1, 7, 0.0)
+    db.flush()
+    # Падение посреди следующего сброса: на диск попала половина строки неподтверждённой записи
+    for table in ("deals", "messages"):
+        file = tmp_path / "data" / f"{table}.jsonl"
+        line = file.read_bytes().splitlines(keepends=True)[-1]
+        with file.open("ab") as f:
+            f.write(line[:len(line) // 2])
+    db = Database(make_storage("jsonl", tmp_path, True), Archive(tmp_path / "archive"))
+    db.add_deal("c", -1, 1, "awaiting", 0.0, "m", 7)
+    db.add_message("c", -1, 1, 7, 0.0)
+    db.flush()
+    db.storage.close()
+
+    db = Database(make_storage("jsonl", tmp_path, False), Archive(tmp_path / "archive"))
+    try:
+        assert [d["deal_id"] for d in db.get_deals()] == ["a", "b", "c"]
+        assert [m["deal_id"] for m in db.get_messages(chat_id=-1)] == ["a", "b", "c"]
+    finally:
+        db.storage.close()
+
+
+def test_rows_are_returned_as_copies(backend, tmp_path):
+    db = Database(make_storage(backend, tmp_path, False), Archive(tmp_path / "archive"))
+    try:
+        db.add_deal("D1", -1, 1, "awaiting", 0.0, "m", 7)
+        db.get_deal("D1")["status"] = "completed"
+        db.get_deals()[0]["status"] = "completed"
+        db.storage.all("deals")[0]["extra"] = 1
+        assert db.get_deal("D1")["status"] == "awaiting"
+        assert [d["deal_id"] for d in db.get_deals(status="awaiting")] == ["D1"]
+        assert "extra" not in db.storage.all("deals")[0]
+    finally:
+        db.storage.close()
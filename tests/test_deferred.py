@@ -0,0 +1,70 @@
+import asyncio
+
+from database import Database, AsyncDatabase
+from deferred import DeferredJobs
+from storage.archive import Archive
+from storage.jsonl import JsonlStorage
+
+
+def run_jobs(tmp_path, scenario):
+    """Выполнить сценарий над очередью отложенных задач с базой в tmp_path."""
+    async def main():
+        db = AsyncDatabase(Database(JsonlStorage(tmp_path / "data"), Archive(tmp_path / "archive")))
+        jobs = DeferredJobs(db)
+        try:
+            return await scenario(jobs)
+        finally:
+            await jobs.stop()
+            await db.close()
+    return asyncio.run(main())
+
+
+def test_same_key_never_runs_concurrently(tmp_path):
+    async def scenario(jobs):
+        running, overlaps, calls = set(), [], []
+        release = asyncio.Event()
+
+        async def handler(payload):
+            overlaps.append(bool(running))
+            running.add(payload["n"])
+            calls.append(payload["n"])
+            if payload["n"] == 1:
+                await release.wait()
+            running.discard(payload["n"])
+
+        jobs.register("job", handler)
+        await jobs.start()
+        await jobs.schedule("k", "job", {"n": 1}, 0)
+        await asyncio.sleep(0.05)
+        # Срок новой задачи наступает, пока первая ещё выполняется
+        await jobs.schedule("k", "job", {"n": 2}, 0)
+        await asyncio.sleep(0.05)
+        assert calls == [1]
+        release.set()
+        await asyncio.sleep(0.05)
+        return overlaps, calls
+
+    overlaps, calls = run_jobs(tmp_path, scenario)
+    assert calls == [1, 2]
+    assert overlaps == [False, False]
+
+
+def test_cancel_waits_for_running_job(tmp_path):
+    async def scenario(jobs):
+        finished = []
+
+        async def handler(payload):
+            await asyncio.sleep(0.05)
+            finished.append(payload["n"])
+
+        jobs.register("job", handler)
+        await jobs.start()
+        await jobs.schedule("k", "job", {"n": 1}, 0)
+        await asyncio.sleep(0.01)
+        cancelled = await jobs.cancel("k")
+        return cancelled, list(finished), jobs.stats()
+
+    cancelled, finished, stats = run_jobs(tmp_path, scenario)
+    assert not cancelled
+    assert finished == [1]
+    assert stats["running"] == 0
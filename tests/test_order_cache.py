@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+import order_cache
+from order_cache import OrderCache
+
+
+@pytest.fixture
+def cache(clock, monkeypatch):
+    monkeypatch.setattr(order_cache, "time", clock)
+    return OrderCache(max_size=3, ttls={"success": 60, "awaiting": 5, "rejected": 0}, default_ttl=10)
+
+
+def test_entries_expire_by_status_ttl(cache, clock):
+    cache.put("done", {"status": "success"})
+    cache.put("waiting", {"status": "awaiting"})
+    cache.put("other", {"status": "unknown"})
+    cache.put("rejected", {"status": "rejected"})
+    assert cache.get("rejected") is None
+    clock.advance(4.9)
+    assert cache.get("waiting") == {"status": "awaiting"}
+    clock.advance(0.1)
+    assert cache.get("waiting") is None
+    assert cache.get("other") == {"status": "unknown"}
+    clock.advance(5)
+    assert cache.get("other") is None
+    assert cache.get("done") == {"status": "success"}
+    clock.advance(50)
+    assert cache.get("done") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for order_id in ("a", "b", "c"):
+        cache.put(order_id, {"status": "success"})
+    cache.get("a")
+    cache.put("d", {"status": "success"})
+    assert cache.get("b") is None
+    cache.put("e", {"status": "success"})
+    assert cache.get("c") is None
+    assert [order_id for order_id in "ade" if cache.get(order_id)] == ["a", "d", "e"]
+    assert cache.evictions == 2
+
+
+def test_returned_data_is_a_copy(cache):
+    cache.put("a", {"status": "success"})
+    cache.get("a")["status"] = "rejected"
+    assert cache.get("a") == {"status": "success"}
+
+
+def run_fetches(cache, loader, count=5):
+    """Одновременные fetch одной сделки; результаты и ошибки в порядке вызовов."""
+    async def main():
+        return await asyncio.gather(*(cache.fetch("a", loader) for _ in range(count)), return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_concurrent_fetches_share_one_request(cache):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"status": "success"}
+
+    results = run_fetches(cache, loader)
+    assert len(calls) == 1
+    assert results == [{"status": "success"}] * 5
+    assert len({id(result) for result in results}) == 5
+    assert (cache.misses, cache.coalesced) == (1, 4)
+    # Результат закэширован
+    assert run_fetches(cache, loader) == [{"status": "success"}] * 5
+    assert len(calls) == 1
+
+
+def test_failed_fetch_is_shared_and_not_cached(cache):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("API недоступен")
+
+    results = run_fetches(cache, loader)
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # Ошибка не остаётся в кэше и в идущих запросах: следующий вызов снова идёт в API
+    assert not cache._inflight
+    run_fetches(cache, loader, count=1)
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_fetch(cache):
+    async def loader():
+        await asyncio.sleep(0.02)
+        return {"status": "success"}
+
+    async def main():
+        first = asyncio.ensure_future(cache.fetch("a", loader))
+        second = asyncio.ensure_future(cache.fetch("a", loader))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == ({"status": "success"}, True)
+    assert cache.cancelled == 0
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import outbox
+from outbox import Outbox, PRIORITY_ADMIN, PRIORITY_CARDS, PRIORITY_DEFAULT
+
+
+START = 1000.0
+
+
+@pytest.fixture
+def make_outbox(clock, monkeypatch):
+    clock.now = START
+    monkeypatch.setattr(outbox, "time", clock)
+
+    def make(global_per_second=30, chat_per_second=1, group_per_minute=20, chat_burst=1):
+        return Outbox(global_per_second, chat_per_second, group_per_minute, chat_burst,
+                      concurrency=4, max_attempts=3, drain_seconds=1)
+    return make
+
+
+def submit(box, chat_id, priority, text=""):
+    return box.submit(None, None, SendMessage(chat_id=chat_id, text=text or str(chat_id)), priority)
+
+
+def dispatch(box, clock):
+    """Разобрать очередь по поддельным часам: (момент, чат, текст) каждого отправленного запроса."""
+    sent = []
+    while box.depth():
+        item, wait = box._next()
+        if item is None:
+            # Настоящие часы всегда идут: ожидание меньше точности float не должно зацикливать разбор
+            clock.advance(max(wait, 1e-6))
+            continue
+        sent.append((round(clock.now - START, 3), item.chat, item.method.text))
+    return sent
+
+
+def run(scenario):
+    async def main():
+        return scenario()
+    return asyncio.run(main())
+
+
+def test_high_priority_goes_before_queued_low_priority(make_outbox, clock):
+    def scenario():
+        box = make_outbox()
+        for chat_id in (1, 2, 3):
+            submit(box, chat_id, PRIORITY_ADMIN)
+        submit(box, 4, PRIORITY_DEFAULT)
+        submit(box, 5, PRIORITY_CARDS)
+        return dispatch(box, clock)
+
+    assert [chat for _, chat, _ in run(scenario)] == [5, 4, 1, 2, 3]
+
+
+def test_busy_chat_does_not_block_other_chats(make_outbox, clock):
+    def scenario():
+        box = make_outbox()
+        for n in range(3):
+            submit(box, 1, PRIORITY_CARDS, f"1-{n}")
+        submit(box, 2, PRIORITY_ADMIN, "2-0")
+        return dispatch(box, clock)
+
+    # Запрос низкого приоритета в свободный чат не ждёт, пока исчерпавший лимит чат 1 освободится
+    assert run(scenario) == [(0, 1, "1-0"), (0, 2, "2-0"), (1, 1, "1-1"), (2, 1, "1-2")]
+
+
+def test_per_chat_and_group_rates(make_outbox, clock):
+    def scenario():
+        box = make_outbox(chat_per_second=1, group_per_minute=20, chat_burst=1)
+        for n in range(4):
+            submit(box, 7, PRIORITY_DEFAULT, f"user-{n}")
+            submit(box, -100, PRIORITY_DEFAULT, f"group-{n}")
+        return dispatch(box, clock)
+
+    sent = run(scenario)
+    user = [moment for moment, chat, _ in sent if chat == 7]
+    group = [moment for moment, chat, _ in sent if chat == -100]
+    assert user == [0, 1, 2, 3]
+    assert group == [0, 3, 6, 9]
+
+
+def test_global_rate(make_outbox, clock):
+    def scenario():
+        box = make_outbox(global_per_second=5, chat_burst=1)
+        for chat_id in range(1, 21):
+            submit(box, chat_id, PRIORITY_DEFAULT)
+        return dispatch(box, clock)
+
+    moments = [moment for moment, _, _ in run(scenario)]
+    assert len(moments) == 20
+    # Запас global_per_second уходит сразу, дальше запрос раз в 1/5 секунды
+    assert moments[:5] == [0] * 5
+    assert all(later - earlier >= 0.2 - 1e-3 for earlier, later in zip(moments[4:], moments[5:]))
+    assert moments[-1] == pytest.approx(3)
+
+
+def test_retry_after_pauses_chat_and_requeues_first(make_outbox, clock):
+    async def main():
+        box = make_outbox()
+        submit(box, 1, PRIORITY_DEFAULT, "first")
+        submit(box, 1, PRIORITY_DEFAULT, "second")
+        item, _ = box._next()
+
+        async def make_request(bot, method):
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=10)
+
+        item.make_request = make_request
+        await box._slots.acquire()
+        await box._send(item)
+        return box, dispatch(box, clock)
+
+    box, sent = asyncio.run(main())
+    assert sent == [(10, 1, "first"), (11, 1, "second")]
+    assert box.retry_after == 1
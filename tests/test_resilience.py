@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from resilience import BackoffWait, CircuitBreaker, CircuitOpenError, RetryableStatus
+
+
+@pytest.fixture
+def breaker(clock, monkeypatch):
+    monkeypatch.setattr(resilience, "time", clock)
+    return CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+
+
+def test_breaker_opens_after_threshold(breaker):
+    for _ in range(2):
+        breaker.check()
+        breaker.failure()
+    assert breaker.state == "closed"
+    breaker.check()
+    breaker.failure()
+    assert breaker.state == "open" and breaker.opens == 1
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    assert breaker.stats()["state"] == "open" and breaker.rejected == 1
+
+
+def test_success_resets_failure_count(breaker):
+    for _ in range(2):
+        breaker.failure()
+    breaker.success()
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_closes_breaker(breaker, clock):
+    for _ in range(3):
+        breaker.failure()
+    clock.advance(29.9)
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    clock.advance(0.1)
+    assert breaker.stats()["state"] == "half_open"
+    breaker.check()
+    assert breaker.state == "half_open"
+    # Пока идёт пробный запрос, остальные отклоняются
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.failures == 0
+    breaker.check()
+
+
+def test_failed_probe_reopens_breaker(breaker, clock):
+    for _ in range(3):
+        breaker.failure()
+    clock.advance(30)
+    breaker.check()
+    breaker.failure()
+    assert breaker.state == "open" and breaker.opens == 2
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    clock.advance(1)
+    breaker.check()
+    assert breaker.state == "half_open"
+
+
+def test_released_probe_lets_next_probe_through(breaker, clock):
+    for _ in range(3):
+        breaker.failure()
+    clock.advance(30)
+    breaker.check()
+    breaker.release()
+    breaker.check()
+    assert breaker.state == "half_open"
+
+
+def retry_state(attempt: int, error: Exception = None):
+    """Состояние повтора tenacity: номер попытки и исход с ошибкой."""
+    outcome = SimpleNamespace(exception=lambda: error) if error else None
+    return SimpleNamespace(attempt_number=attempt, outcome=outcome)
+
+
+def test_backoff_jitter_stays_within_ceiling():
+    wait = BackoffWait(initial=1, maximum=10)
+    for attempt, ceiling in ((1, 1), (2, 2), (3, 4), (4, 8), (5, 10), (10, 10)):
+        delays = [wait(retry_state(attempt, RetryableStatus(503))) for _ in range(500)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        # Полный джиттер: задержки разбросаны по всему интервалу, а не жмутся к потолку
+        assert min(delays) < ceiling * 0.1 and max(delays) > ceiling * 0.9
+
+
+def test_backoff_ceiling_is_passed_to_jitter(monkeypatch):
+    bounds = []
+    monkeypatch.setattr(resilience.random, "uniform", lambda low, high: bounds.append((low, high)) or high)
+    wait = BackoffWait(initial=0.5, maximum=3)
+    assert [wait(retry_state(attempt)) for attempt in range(1, 6)] == [0.5, 1, 2, 3, 3]
+    assert bounds == [(0, 0.5), (0, 1), (0, 2), (0, 3), (0, 3)]
+
+
+def test_retry_after_takes_priority_over_jitter():
+    wait = BackoffWait(initial=1, maximum=10)
+    assert wait(retry_state(1, RetryableStatus(429, retry_after=7))) == 7
+    assert wait(retry_state(1, RetryableStatus(429, retry_after=60))) == 10
+    assert wait(retry_state(1, RetryableStatus(429, retry_after=0))) == 0
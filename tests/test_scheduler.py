@@ -0,0 +1,284 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime
+
+import pytest
+
+import scheduler
+from scheduler import Cron, Interval, Scheduler, MSK
+
+real_sleep = asyncio.sleep
+
+
+def msk(*args) -> float:
+    return MSK.localize(datetime(*args)).timestamp()
+
+
+def as_msk(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, MSK).replace(tzinfo=None)
+
+
+@pytest.mark.parametrize("spec, now, expected", [
+    # Через полночь и через конец месяца
+    ("30 2 * * *", (2026, 1, 31, 23, 0), (2026, 2, 1, 2, 30)),
+    ("0 0 1 * *", (2026, 1, 31, 12, 0), (2026, 2, 1, 0, 0)),
+    # 31-е число: апрель и июнь пропускаются
+    ("0 9 31 * *", (2026, 4, 1, 0, 0), (2026, 5, 31, 9, 0)),
+    ("0 9 31 * *", (2026, 5, 31, 9, 0), (2026, 7, 31, 9, 0)),
+    # 29 февраля — только в високосный год, и через конец года
+    ("0 0 29 2 *", (2026, 3, 1, 0, 0), (2028, 2, 29, 0, 0)),
+    ("0 0 1 1 *", (2026, 6, 1, 0, 0), (2027, 1, 1, 0, 0)),
+    # Строго после: текущая минута не подходит
+    ("*/15 * * * *", (2026, 10, 17, 10, 45), (2026, 10, 17, 11, 0)),
+    ("*/15 * * * *", (2026, 10, 17, 23, 59), (2026, 10, 18, 0, 0)),
+    ("0 9-18/3 * * *", (2026, 10, 17, 18, 1), (2026, 10, 18, 9, 0)),
+    # Дни недели: 2026-10-17 — суббота, воскресенье — 0 или 7
+    ("0 10 * * 1-5", (2026, 10, 17, 8, 0), (2026, 10, 19, 10, 0)),
+    ("0 10 * * 7", (2026, 10, 17, 8, 0), (2026, 10, 18, 10, 0)),
+    # Заданы и день месяца, и день недели: подходит любой
+    ("0 0 20 * 0", (2026, 10, 17, 8, 0), (2026, 10, 18, 0, 0)),
+    ("0 0 19 * 0", (2026, 10, 18, 1, 0), (2026, 10, 19, 0, 0)),
+])
+def test_cron_next_fire(spec, now, expected):
+    assert as_msk(Cron(spec).next_after(msk(*now))) == datetime(*expected)
+
+
+def test_cron_next_fire_is_strictly_after_seconds():
+    assert as_msk(Cron("* * * * *").next_after(msk(2026, 10, 17, 10, 0, 30))) == datetime(2026, 10, 17, 10, 1)
+
+
+@pytest.mark.parametrize("spec", ["* * * *", "60 * * * *", "0 24 * * *", "0 0 0 * *", "0 0 * 13 *", "0 0 * * 8", "5-1 * * * *"])
+def test_cron_rejects_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        Cron(spec)
+
+
+def test_cron_that_never_fires():
+    with pytest.raises(ValueError):
+        Cron("0 0 31 2 *").next_after(msk(2026, 1, 1, 0, 0))
+
+
+def test_interval_validation():
+    assert Interval(10).next_after(100) == 110
+    with pytest.raises(ValueError):
+        Interval(0)
+    with pytest.raises(ValueError):
+        Scheduler(1, 1).add("job", lambda: real_sleep(0))
+    with pytest.raises(ValueError):
+        Scheduler(1, 1).add("job", lambda: real_sleep(0), interval=1, cron="* * * * *")
+    with pytest.raises(ValueError):
+        Scheduler(1, 1).add("job", lambda: real_sleep(0), interval=1, overrun="stack")
+
+
+class VirtualTime:
+    """Поддельные часы планировщика и asyncio.sleep: время идёт только в advance()."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.start = clock.now
+        self._sleepers = []
+        self._seq = itertools.count()
+
+    async def sleep(self, delay: float, result=None):
+        if delay <= 0:
+            await real_sleep(0)
+            return result
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self.clock.now + delay, next(self._seq), future))
+        await future
+        return result
+
+    async def _settle(self) -> None:
+        # Дать готовым задачам дойти до следующего ожидания
+        for _ in range(20):
+            await real_sleep(0)
+
+    async def advance(self, seconds: float) -> None:
+        """Сдвинуть часы на seconds секунд, по пути будя спящих в порядке сроков."""
+        until = self.clock.now + seconds
+        while True:
+            await self._settle()
+            if not self._sleepers or self._sleepers[0][0] > until:
+                break
+            wake, _, future = heapq.heappop(self._sleepers)
+            self.clock.now = max(self.clock.now, wake)
+            if not future.done():
+                future.set_result(None)
+        self.clock.now = until
+        await self._settle()
+
+    def elapsed(self) -> float:
+        return round(self.clock.now - self.start, 6)
+
+
+@pytest.fixture
+def vt(clock, monkeypatch):
+    virtual = VirtualTime(clock)
+    monkeypatch.setattr(scheduler, "time", clock)
+    monkeypatch.setattr(asyncio, "sleep", virtual.sleep)
+    return virtual
+
+
+def job_recording(vt, duration: float = 0.0):
+    """Задача, которая запоминает моменты запуска и выполняется duration секунд."""
+    starts = []
+
+    async def job():
+        starts.append(vt.elapsed())
+        await asyncio.sleep(duration)
+    return job, starts
+
+
+def run(scenario):
+    async def main():
+        sched = Scheduler(drain_seconds=0.05, restart_delay=0)
+        try:
+            return await scenario(sched)
+        finally:
+            await sched.stop()
+    return asyncio.run(main())
+
+
+def test_interval_job_runs_on_schedule(vt):
+    job, starts = job_recording(vt, duration=2)
+
+    async def scenario(sched):
+        sched.add("job", job, interval=10, run_at_start=True)
+        sched.start()
+        await vt.advance(35)
+        return sched.stats()["job"]
+
+    stats = run(scenario)
+    assert starts == [0, 10, 20, 30]
+    assert stats["runs"] == 4 and not stats["running"]
+    assert stats["next_in_seconds"] == 5
+
+
+def test_overrunning_job_is_skipped_not_stacked(vt):
+    job, starts = job_recording(vt, duration=25)
+
+    async def scenario(sched):
+        sched.add("job", job, interval=10)
+        sched.start()
+        await vt.advance(59)
+        return sched.jobs["job"]
+
+    job_state = run(scenario)
+    # 10: запуск до 35; 20 и 30 пропущены; 40: запуск до 65; 50 пропущен
+    assert starts == [10, 40]
+    assert job_state.skipped == 3
+    assert job_state.runs == 1
+
+
+def test_overrunning_job_is_coalesced(vt):
+    job, starts = job_recording(vt, duration=25)
+
+    async def scenario(sched):
+        sched.add("job", job, interval=10, overrun="coalesce")
+        sched.start()
+        await vt.advance(59)
+        return sched.jobs["job"]
+
+    job_state = run(scenario)
+    # Запуски в 20 и 30 сливаются в один повтор сразу после окончания первого выполнения
+    assert starts == [10, 35]
+    assert job_state.coalesced == 4
+    assert job_state.pending
+
+
+def test_jitter_delays_runs_without_drift(vt, monkeypatch):
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: high)
+    job, starts = job_recording(vt)
+
+    async def scenario(sched):
+        sched.add("job", job, interval=10, jitter=3)
+        sched.start()
+        await vt.advance(40)
+
+    run(scenario)
+    assert starts == [13, 23, 33]
+
+
+def test_cron_job_runs_at_matching_minutes(vt, clock):
+    clock.now = vt.start = msk(2026, 10, 17, 23, 58, 30)
+    job, starts = job_recording(vt)
+
+    async def scenario(sched):
+        sched.add("job", job, cron="0 0 * * *")
+        sched.start()
+        await vt.advance(24 * 3600 + 120)
+
+    run(scenario)
+    assert starts == [90, 24 * 3600 + 90]
+
+
+def test_failing_job_keeps_schedule(vt):
+    async def job():
+        raise RuntimeError("сбой")
+
+    async def scenario(sched):
+        sched.add("job", job, interval=10)
+        sched.start()
+        await vt.advance(30)
+        return sched.stats()["job"]
+
+    stats = run(scenario)
+    assert stats["runs"] == 3 and stats["failures"] == 3
+    assert stats["last_error"] == "RuntimeError('сбой')"
+
+
+def test_crashed_loop_is_restarted(vt):
+    job, starts = job_recording(vt)
+
+    class Flaky(Interval):
+        crashes = 1
+
+        def next_after(self, timestamp):
+            if self.crashes and vt.elapsed() >= 10:
+                self.crashes -= 1
+                raise RuntimeError("сбой расписания")
+            return super().next_after(timestamp)
+
+    async def scenario(sched):
+        sched.add("job", job, interval=10).schedule = Flaky(10)
+        sched.start()
+        await vt.advance(10)
+        # Перезапуск через restart_delay по часам цикла событий
+        await real_sleep(0.01)
+        await vt.advance(15)
+        return sched.jobs["job"]
+
+    job_state = run(scenario)
+    assert job_state.restarts == 1
+    assert starts == [10, 20]
+
+
+def test_stop_drains_then_cancels(vt):
+    finished, cancelled = [], []
+
+    async def short():
+        await real_sleep(0.01)
+        finished.append("short")
+
+    async def long():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append("long")
+            raise
+
+    async def main():
+        sched = Scheduler(drain_seconds=0.2, restart_delay=0)
+        sched.add("short", short, interval=10)
+        sched.add("long", long, interval=10)
+        sched.start()
+        await vt.advance(10)
+        await sched.stop()
+        # После остановки новые запуски не начинаются
+        await vt.advance(30)
+        return sched.stats()
+
+    stats = asyncio.run(main())
+    assert finished == ["short"] and cancelled == ["long"]
+    assert stats["short"]["runs"] == 1 and stats["long"]["runs"] == 0
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from config import WEBHOOK_PATH
+from database import Database, AsyncDatabase
+from storage.archive import Archive
+from storage.jsonl import JsonlStorage
+from webhook import WebhookReceiver, sign, SIGNATURE_HEADER, TIMESTAMP_HEADER
+
+SECRET = "secret"
+
+
+class FakeCache:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, order_id):
+        self.invalidated.append(order_id)
+
+
+class FakeApi:
+    """API без сети: вебхук только сбрасывает кэш, уведомления в тестах полные."""
+
+    def __init__(self):
+        self.order_cache = FakeCache()
+
+    async def get_order(self, order_id, user_id, fresh=False):
+        return None
+
+
+def post(tmp_path, body: bytes, secret: str = SECRET):
+    """Отправить тело на вебхук; вернуть статус, ответ, счётчики и сделку D1 после обработки."""
+    async def main():
+        db = AsyncDatabase(Database(JsonlStorage(tmp_path / "data"), Archive(tmp_path / "archive")))
+        await db.add_deal("D1", -1, 1, "awaiting_integrator", 0.0, "m", 7)
+        receiver = WebhookReceiver(None, db, FakeApi(), secret=SECRET)
+        timestamp = str(time.time())
+        headers = {TIMESTAMP_HEADER: timestamp, SIGNATURE_HEADER: sign(secret, timestamp, body)}
+        try:
+            async with TestClient(TestServer(receiver.app)) as client:
+                response = await client.post(WEBHOOK_PATH, data=body, headers=headers)
+                return response.status, await response.json(), receiver.stats(), await db.get_deal("D1")
+        finally:
+            await db.close()
+    return asyncio.run(main())
+
+
+def test_bad_signature_is_rejected(tmp_path):
+    body = json.dumps({"order": {"id": "D1", "status": "success", "merchant_name": "m"}}).encode()
+    status, response, stats, deal = post(tmp_path, body, secret="other")
+    assert status == 401
+    assert stats["rejected"] == 1
+    assert deal["status"] == "awaiting_integrator"
+
+
+def test_malformed_body_is_rejected(tmp_path):
+    for body in (b"not json", b"[]", json.dumps({"order": {"id": "D1"}}).encode(),
+                 json.dumps({"order": {"id": "D1", "status": "success", "integrator": "x"}}).encode()):
+        status, response, stats, deal = post(tmp_path, body)
+        assert status == 400, body
+        assert response == {"ok": False, "error": "bad payload"}
+        assert deal["status"] == "awaiting_integrator"
+
+
+def test_valid_body_applies_transition(tmp_path):
+    body = json.dumps({"order": {"id": "D1", "status": "success", "merchant_name": "m"}}).encode()
+    status, response, stats, deal = post(tmp_path, body)
+    assert status == 200
+    assert response == {"ok": True}
+    assert stats["applied"] == 1
+    assert deal["status"] == "completed"
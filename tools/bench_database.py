@@ -0,0 +1,290 @@
+"""Нагрузочный бенчмарк Database на синтетических данных.
+
+Заполняет хранилище мерчантами, каскадами, сделками, сообщениями, статистикой и апелляциями,
+затем замеряет задержки (p50/p95/p99) и пропускную способность публичных методов Database
+для каждого движка и размера данных. Telegram и Payphoria API не нужны.
+
+Запуск из корня репозитория:
+    python -m tools.bench_database --sizes 1000,10000,100000 --engines jsonl,sqlite --output bench.json
+Сравнение с прошлым отчётом (код выхода 1 при регрессии p95):
+    python -m tools.bench_database --baseline bench.json --threshold 1.5
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from config import DB_OFFSET_TABLES
+from database import Database
+from storage import codec
+from storage.archive import Archive
+from storage.base import Storage
+
+STATUSES = ["completed"] * 12 + ["rejected"] * 4 + ["awaiting"] * 2 + ["awaiting_integrator"] * 2
+STAT_TYPES = ["taken", "approved", "completed", "rejected", "viewed", "errors", "merchant_messages"]
+DAYS = 30
+
+
+def create_engine(engine: str, path: Path) -> Storage:
+    """Хранилище указанного движка во временной директории."""
+    if engine == "jsonl":
+        from storage.jsonl import JsonlStorage
+        return JsonlStorage(path, offset_tables=DB_OFFSET_TABLES)
+    if engine == "jsonl-disk":
+        from storage.jsonl import JsonlStorage
+        return JsonlStorage(path, in_memory=False, offset_tables=DB_OFFSET_TABLES)
+    if engine == "sqlite":
+        from storage.sqlite import SqliteStorage
+        return SqliteStorage(path / "bench.db")
+    raise ValueError(f"Неизвестный движок {engine}")
+
+
+class Dataset:
+    """Синтетические данные, пропорциональные числу сделок."""
+
+    def __init__(self, size: int, seed: int):
+        """Сгенерировать строки всех таблиц."""
+        rnd = random.Random(seed)
+        self.rnd = rnd
+        now = time.time()
+        today = datetime.now()
+        self.days = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(DAYS)]
+        self.user_ids = [6_000_000_000 + i for i in range(max(10, size // 1000))]
+        merchants_count = min(5000, max(10, size // 100))
+        self.merchants = [{
+            "name": f"merchant_{i}",
+            "display_name": f"Merchant {i}",
+            "chat_id": -4_000_000_000 - i,
+            "merchant_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "handler_id": rnd.choice(self.user_ids)
+        } for i in range(merchants_count)]
+        self.cascades = [{
+            "name": f"cascade_{i}",
+            "display_name": f"Cascade {i}",
+            "chat_id": -5_000_000_000 - i,
+            "needs_external_id": i % 3 == 0
+        } for i in range(min(5000, max(10, size // 200)))]
+        self.deals = []
+        self.messages = []
+        for i in range(size):
+            merchant = rnd.choice(self.merchants)
+            deal_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+            sent_time = now - rnd.random() * 3600
+            self.deals.append({
+                "deal_id": deal_id,
+                "merchant_chat_id": merchant["chat_id"],
+                "message_id": i,
+                "status": rnd.choice(STATUSES),
+                "sent_time": sent_time,
+                "merchant_id": merchant["merchant_id"],
+                "handler_id": merchant["handler_id"]
+            })
+            self.messages.append({
+                "deal_id": deal_id,
+                "chat_id": merchant["chat_id"],
+                "message_id": i,
+                "user_id": merchant["handler_id"],
+                "sent_time": sent_time
+            })
+        self.stats = [{
+            "user_id": user_id, "date": day, "merchants": [],
+            **{stat_type: rnd.randint(0, 100) for stat_type in STAT_TYPES}
+        } for user_id in self.user_ids for day in self.days]
+        self.appeals = [{
+            "deal_id": deal["deal_id"], "user_id": deal["handler_id"], "is_manual": False, "created_at": deal["sent_time"]
+        } for deal in self.deals[::20]]
+        self.proof_messages = [{
+            "deal_id": deal["deal_id"], "message_id": deal["message_id"], "created_at": deal["sent_time"]
+        } for deal in self.deals[::10]]
+        self.users = [{"user_id": user_id, "token": uuid.uuid4().hex} for user_id in self.user_ids]
+
+    def seed(self, storage: Storage) -> None:
+        """Записать данные в хранилище снимками таблиц."""
+        for table in ("merchants", "cascades", "deals", "messages", "stats", "appeals", "proof_messages", "users"):
+            storage.replace(table, getattr(self, table))
+
+    def deal(self) -> Dict[str, Any]:
+        """Случайная сделка."""
+        return self.rnd.choice(self.deals)
+
+
+def operations(data: Dataset) -> Dict[str, Callable[[Database], Any]]:
+    """Замеряемые вызовы Database со случайными аргументами."""
+    rnd = data.rnd
+    counter = iter(range(10 ** 12))
+
+    def new_deal(db: Database) -> Any:
+        merchant = rnd.choice(data.merchants)
+        n = next(counter)
+        return db.add_deal(f"bench-{n}", merchant["chat_id"], 10 ** 9 + n, "awaiting", time.time(),
+                           merchant["merchant_id"], merchant["handler_id"])
+
+    def message_lookup(db: Database) -> Any:
+        message = rnd.choice(data.messages)
+        return db.get_messages(chat_id=message["chat_id"], message_id=message["message_id"])
+
+    return {
+        "add_merchant": lambda db: db.add_merchant(f"bench_{next(counter)}", "Bench", rnd.randint(-10 ** 12, -10 ** 10)),
+        "get_merchant(chat_id)": lambda db: db.get_merchant(chat_id=rnd.choice(data.merchants)["chat_id"]),
+        "get_merchant(name)": lambda db: db.get_merchant(name=rnd.choice(data.merchants)["name"]),
+        "update_merchant_handler": lambda db: db.update_merchant_handler(rnd.choice(data.merchants)["name"], rnd.choice(data.user_ids)),
+        "merge_cascade": lambda db: db.merge_cascade(rnd.choice(data.cascades)["name"], "Cascade", needs_external_id=True),
+        "get_cascade": lambda db: db.get_cascade(rnd.choice(data.cascades)["chat_id"]),
+        "get_cascades": lambda db: db.get_cascades(),
+        "add_deal": new_deal,
+        "get_deal": lambda db: db.get_deal(data.deal()["deal_id"]),
+        "get_deals(status=awaiting)": lambda db: db.get_deals(status="awaiting"),
+        "update_deal_status": lambda db: db.update_deal_status(data.deal()["deal_id"], rnd.choice(STATUSES)),
+        "add_message": lambda db: db.add_message(data.deal()["deal_id"], rnd.choice(data.merchants)["chat_id"],
+                                                 10 ** 9 + next(counter), rnd.choice(data.user_ids), time.time()),
+        "get_messages(chat_id, message_id)": message_lookup,
+        "get_messages(deal_id)": lambda db: db.get_messages(deal_id=data.deal()["deal_id"]),
+        "add_stat": lambda db: db.add_stat(rnd.choice(data.user_ids), rnd.choice(STAT_TYPES), rnd.choice(data.merchants)["name"]),
+        "get_stats": lambda db: db.get_stats(rnd.choice(data.user_ids), rnd.choice(data.days)),
+        "save_user_token": lambda db: db.save_user_token(rnd.choice(data.user_ids), uuid.uuid4().hex),
+        "get_user": lambda db: db.get_user(rnd.choice(data.user_ids)),
+        "add_appeal": lambda db: db.add_appeal(data.deal()["deal_id"], rnd.choice(data.user_ids), True),
+        "get_appeals(deal_id)": lambda db: db.get_appeals(data.deal()["deal_id"]),
+        "add_sla_notification": lambda db: db.add_sla_notification(data.deal()["deal_id"], next(counter), True),
+        "get_sla_notifications(deal_id)": lambda db: db.get_sla_notifications(data.deal()["deal_id"]),
+        "add_shift": lambda db: db.add_shift(rnd.choice(data.user_ids), time.time()),
+        "get_shifts": lambda db: db.get_shifts(rnd.choice(data.user_ids)),
+        "add_proof_message": lambda db: db.add_proof_message(data.deal()["deal_id"], next(counter)),
+        "get_proof_messages(deal_id)": lambda db: db.get_proof_messages(deal_id=data.deal()["deal_id"]),
+    }
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль по отсортированным значениям (ближайший ранг)."""
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(db: Database, call: Callable[[Database], Any], ops: int, max_seconds: float) -> Dict[str, float]:
+    """Вызывать метод ops раз (или пока не истечёт max_seconds) и собрать задержки."""
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < ops and time.perf_counter() - started < max_seconds:
+        t0 = time.perf_counter()
+        call(db)
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "calls": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "ops_per_s": len(latencies) / total if total else 0.0,
+    }
+
+
+def run_case(engine: str, size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Прогнать все методы на одном движке и размере данных."""
+    data = Dataset(size, args.seed)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f"bench_{engine}_"))
+    try:
+        started = time.perf_counter()
+        storage = create_engine(engine, tmp_dir)
+        data.seed(storage)
+        storage.close()
+        seed_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        storage = create_engine(engine, tmp_dir)
+        open_seconds = time.perf_counter() - started
+        db = Database(storage, archive=Archive(tmp_dir / "archive"))
+        methods = {}
+        for name, call in operations(data).items():
+            if args.methods and not any(m in name for m in args.methods):
+                continue
+            methods[name] = measure(db, call, args.ops, args.max_seconds)
+            print(f"  {engine:10} {size:>9} {name:36} p50 {methods[name]['p50_ms']:8.3f} мс  "
+                  f"p95 {methods[name]['p95_ms']:8.3f} мс  {methods[name]['ops_per_s']:10.0f} оп/с", file=sys.stderr)
+        storage.close()
+        disk_bytes = sum(p.stat().st_size for p in tmp_dir.rglob("*") if p.is_file())
+        return {
+            "engine": engine,
+            "size": size,
+            "seed_seconds": seed_seconds,
+            "open_seconds": open_seconds,
+            "disk_bytes": disk_bytes,
+            "methods": methods,
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Методы, у которых p95 вырос больше чем в threshold раз относительно базового отчёта."""
+    base = {(r["engine"], r["size"]): r["methods"] for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old_methods = base.get((result["engine"], result["size"]), {})
+        for name, stats in result["methods"].items():
+            old = old_methods.get(name)
+            if old and old["p95_ms"] > 0 and stats["p95_ms"] / old["p95_ms"] > threshold:
+                regressions.append(
+                    f"{result['engine']} {result['size']} {name}: p95 {old['p95_ms']:.3f} -> {stats['p95_ms']:.3f} мс"
+                )
+    return regressions
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк Database на синтетических данных")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Числа сделок через запятую")
+    parser.add_argument("--engines", default="jsonl,sqlite", help="jsonl, jsonl-disk, sqlite через запятую")
+    parser.add_argument("--ops", type=int, default=1000, help="Вызовов на метод")
+    parser.add_argument("--max-seconds", type=float, default=5.0, help="Предел времени на метод")
+    parser.add_argument("--methods", default="", help="Подстроки имён методов через запятую")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию stdout)")
+    parser.add_argument("--baseline", help="JSON-отчёт для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.5, help="Допустимый рост p95 относительно baseline")
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    args.engines = [e for e in args.engines.split(",") if e]
+    args.methods = [m for m in args.methods.split(",") if m]
+    return args
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    # Логи Database на каждый вызов искажают замеры
+    logging.disable(logging.WARNING)
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "orjson": codec.orjson is not None,
+            "ops": args.ops,
+            "max_seconds": args.max_seconds,
+            "seed": args.seed,
+        },
+        "results": [run_case(engine, size, args) for size in args.sizes for engine in args.engines],
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.threshold)
+        for line in regressions:
+            print(f"Регрессия: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,76 @@
+"""Сравнение разбора таблицы сделок: json + dict против codec + записей со __slots__.
+
+Запуск из корня репозитория: python -m tools.bench_records [количество_сделок]
+
+Выигрыш записей — память; время разбора у обоих вариантов близко и сильно зависит
+от сборщика мусора, поэтому печатается лучшее и медиана из ATTEMPTS попыток.
+"""
+import gc
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+import random
+from typing import Any, Callable, Dict, List
+
+from storage import codec
+from storage.records import to_record
+
+STATUSES = ["awaiting", "awaiting_integrator", "completed", "rejected"]
+ATTEMPTS = 5
+
+
+def make_lines(count: int) -> List[str]:
+    """Синтетические строки deals.jsonl."""
+    lines = []
+    for i in range(count):
+        lines.append(json.dumps({
+            "deal_id": str(uuid.uuid4()),
+            "merchant_chat_id": -4974012900 - i % 50,
+            "message_id": i,
+            "status": random.choice(STATUSES),
+            "sent_time": 1749813464.0 + i,
+            "merchant_id": str(uuid.uuid4()),
+            "handler_id": 6787231702
+        }, ensure_ascii=False) + "\n")
+    return lines
+
+
+def parse_dicts(lines: List[str]) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in lines]
+
+
+def parse_records(lines: List[str]) -> List[Any]:
+    return [to_record("deals", codec.loads(line)) for line in lines]
+
+
+def measure(parse: Callable[[List[str]], List[Any]], lines: List[str]) -> Dict[str, float]:
+    """Лучшее и медианное время разбора из ATTEMPTS попыток и память под результат."""
+    timings = [_timed(parse, lines) for _ in range(ATTEMPTS)]
+    tracemalloc.start()
+    rows = parse(lines)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return {"best_ms": min(timings) * 1000, "median_ms": statistics.median(timings) * 1000,
+            "bytes_per_deal": memory / len(lines)}
+
+
+def _timed(parse: Callable[[List[str]], List[Any]], lines: List[str]) -> float:
+    # Мусор прошлой попытки не должен собираться за счёт этой
+    gc.collect()
+    start = time.perf_counter()
+    parse(lines)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lines = make_lines(count)
+    print(f"Сделок: {count}, orjson: {'да' if codec.orjson else 'нет'}")
+    for name, parse in (("json + dict", parse_dicts), ("codec + Deal", parse_records)):
+        result = measure(parse, lines)
+        print(f"{name:14} разбор: лучший {result['best_ms']:7.1f} мс, медиана {result['median_ms']:7.1f} мс; "
+              f"память {result['bytes_per_deal']:6.0f} байт/сделку")
@@ -0,0 +1,185 @@
+"""Локальный имитатор Payphoria API: users/login, orders и orders/{id}.
+
+Настраиваются задержка ответа, доля ошибок 5xx и 429, срок жизни токена и переход сделок
+в success через заданное время. Используется tools.load_test, можно запустить отдельно:
+    python -m tools.fake_payphoria --port 8900 --orders 100 --latency-ms 80 --error-rate 0.05
+и направить на него бота, поменяв API_BASE_URL/API_AUTH_URL в config.py.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import sys
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+from aiohttp import web
+
+
+class FakePayphoria:
+    """Имитатор Payphoria API с настраиваемыми задержками, ошибками и сменой статусов."""
+
+    def __init__(self, latency_ms: float = 50, jitter: float = 0.5, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, token_ttl: float = 3600, success_after: Optional[float] = 30,
+                 list_filter: bool = True, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.token_ttl = token_ttl
+        self.success_after = success_after
+        self.list_filter = list_filter
+        self.rnd = random.Random(seed)
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.statuses: Dict[int, int] = {}
+        self.app = web.Application()
+        self.app.router.add_post("/users/login", self.login)
+        self.app.router.add_get("/orders", self.list_orders)
+        self.app.router.add_get("/orders/{order_id}", self.get_order)
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_order(self, order_id: Optional[str] = None, merchant_name: str = "Merchant", integrator_name: str = "Integrator",
+                  status: str = "pending") -> str:
+        """Завести сделку; через success_after секунд она перейдёт в success."""
+        order_id = order_id or str(uuid.uuid4())
+        self.orders[order_id] = {
+            "id": order_id,
+            "merchant_name": merchant_name,
+            "integrator": {"name": integrator_name},
+            "recipient": "Иван И.",
+            "card": "2200 0000 0000 0000",
+            "bankName": "Банк",
+            "is_sbp": self.rnd.random() < 0.5,
+            "sum": round(self.rnd.uniform(500, 50000), 2),
+            "currency": "RUB",
+            "status": status,
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "_created": time.monotonic(),
+        }
+        return order_id
+
+    def _order(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """Сделка с учётом перехода в success по времени."""
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+        if (self.success_after is not None and order["status"] == "pending"
+                and time.monotonic() - order["_created"] >= self.success_after):
+            order["status"] = "success"
+        return {k: v for k, v in order.items() if not k.startswith("_")}
+
+    async def _respond(self, endpoint: str, request: web.Request, authorized: bool = True) -> Optional[web.Response]:
+        """Общая часть: счётчик, задержка, случайные отказы и проверка токена."""
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        delay = self.latency_ms * self.rnd.uniform(1 - self.jitter, 1 + self.jitter) / 1000
+        await asyncio.sleep(max(delay, 0))
+        roll = self.rnd.random()
+        if roll < self.error_rate:
+            return self._count(web.Response(status=503))
+        if roll < self.error_rate + self.rate_limit_rate:
+            return self._count(web.Response(status=429, headers={"Retry-After": "1"}))
+        if authorized:
+            token = request.headers.get("Authorization", "")[len("Bearer "):]
+            if self.tokens.get(token, 0) < time.time():
+                return self._count(web.Response(status=401))
+        return None
+
+    def _count(self, response: web.Response) -> web.Response:
+        self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        return response
+
+    async def login(self, request: web.Request) -> web.Response:
+        error = await self._respond("users/login", request, authorized=False)
+        if error:
+            return error
+        expires = time.time() + self.token_ttl
+        payload = base64.urlsafe_b64encode(json.dumps({"exp": int(expires)}).encode()).decode().rstrip("=")
+        token = f"eyJhbGciOiJub25lIn0.{payload}.{uuid.uuid4().hex}"
+        self.tokens[token] = expires
+        return self._count(web.json_response({"accessToken": token}))
+
+    async def get_order(self, request: web.Request) -> web.Response:
+        error = await self._respond("orders/{id}", request)
+        if error:
+            return error
+        order = self._order(request.match_info["order_id"])
+        if order is None:
+            return self._count(web.json_response({"message": "Not found"}, status=404))
+        return self._count(web.json_response(order))
+
+    async def list_orders(self, request: web.Request) -> web.Response:
+        error = await self._respond("orders", request)
+        if error:
+            return error
+        page = int(request.query.get("page", 1))
+        limit = int(request.query.get("limit", 20))
+        if self.list_filter and request.query.get("ids"):
+            ids = request.query["ids"].split(",")
+        else:
+            ids = list(self.orders)
+        items = [order for order in (self._order(order_id) for order_id in ids) if order]
+        pages = max(1, -(-len(items) // limit))
+        return self._count(web.json_response({"items": items[(page - 1) * limit:page * limit], "totalPages": pages}))
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8900) -> str:
+        """Запустить сервер; возвращает базовый URL API."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}/"
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": dict(self.calls), "statuses": dict(self.statuses), "total_calls": sum(self.calls.values())}
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры имитатора (общие с tools.load_test)."""
+    parser.add_argument("--latency-ms", type=float, default=50, help="Средняя задержка ответа API")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Разброс задержки, доля от средней")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--token-ttl", type=float, default=3600, help="Срок жизни токена, сек")
+    parser.add_argument("--success-after", type=float, default=30, help="Через сколько секунд сделка переходит в success")
+    parser.add_argument("--no-list-filter", action="store_true", help="Список orders игнорирует фильтр ids")
+
+
+def from_args(args: argparse.Namespace) -> FakePayphoria:
+    return FakePayphoria(
+        latency_ms=args.latency_ms, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, token_ttl=args.token_ttl,
+        success_after=args.success_after, list_filter=not args.no_list_filter
+    )
+
+
+async def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Имитатор Payphoria API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--orders", type=int, default=10, help="Сколько сделок завести заранее")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    fake = from_args(args)
+    for _ in range(args.orders):
+        print(fake.add_order())
+    print(f"Имитатор Payphoria: {await fake.start(args.host, args.port)} (Ctrl+C — выход)", file=sys.stderr)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,297 @@
+"""Сквозной нагрузочный тест обработчиков на имитаторе Payphoria API и заглушке Telegram.
+
+Поднимает tools.fake_payphoria в этом же процессе, направляет на него настоящий PayphoriaAPI,
+создаёт временную базу с мерчантами и каскадами и прогоняет через Dispatcher синтетические
+апдейты: сообщение мерчанта со сделкой, затем нажатие «approve» обработчиком, часть сделок —
+с запросом «кб внешний» и с несуществующим deal_id. Запросы бота к Telegram отвечает заглушка
+сессии (в сеть ничего не уходит); с --outbox они идут через очередь исходящих с лимитами
+из config.py. Отчёт: апдейтов в секунду, p50/p95/p99 задержки обработки,
+вызовов API на апдейт.
+
+Запуск из корня репозитория:
+    python -m tools.load_test --deals 500 --concurrency 50 --latency-ms 80 --error-rate 0.02
+    python -m tools.load_test --deals 200 --sync-interval 2 --success-after 3 --output load.json
+    python -m tools.load_test --deals 200 --outbox --telegram-flood-rate 0.01
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendMediaGroup, SendMessage, TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+import api as api_module
+from api import PayphoriaAPI
+from config import (
+    DB_OFFSET_TABLES, TG_GLOBAL_PER_SECOND, TG_CHAT_PER_SECOND, TG_GROUP_PER_MINUTE, TG_CHAT_BURST,
+    TG_SEND_CONCURRENCY, TG_SEND_MAX_ATTEMPTS, TG_OUTBOX_DRAIN_SECONDS
+)
+from database import AsyncDatabase, Database
+from handlers import callbacks, commands, edited_messages, messages, tasks
+from metrics import LatencyStats
+from outbox import Outbox, OutboxMiddleware
+from storage.archive import Archive
+from storage.jsonl import JsonlStorage
+from tools.fake_payphoria import FakePayphoria, add_arguments, from_args
+
+logger = logging.getLogger(__name__)
+
+MERCHANT_USER_ID = 500000001
+HANDLER_BASE_ID = 600000000
+
+
+class FakeTelegramSession(BaseSession):
+    """Сессия aiogram без сети: отвечает на запросы бота правдоподобными объектами и считает их."""
+
+    def __init__(self, latency_ms: float = 0.0, flood_rate: float = 0.0):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.flood_rate = flood_rate
+        self.rnd = random.Random(0)
+        self.calls: Dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+
+    def _message(self, chat_id: Any, text: Optional[str] = None) -> Message:
+        return Message(message_id=next(self._message_ids), date=datetime.now(),
+                       chat=Chat(id=int(chat_id), type="private"), text=text)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        if self.flood_rate and self.rnd.random() < self.flood_rate:
+            self.calls["RetryAfter"] = self.calls.get("RetryAfter", 0) + 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        if isinstance(method, SendMessage):
+            return self._message(method.chat_id, method.text)
+        if isinstance(method, SendMediaGroup):
+            return [self._message(method.chat_id) for _ in method.media]
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class Scenario:
+    """Синтетические мерчанты, интеграторы и апдейты Telegram."""
+
+    def __init__(self, fake: FakePayphoria, merchants: int, seed: int):
+        self.fake = fake
+        self.rnd = random.Random(seed)
+        self.merchants = [
+            {"name": f"merchant{i}", "chat_id": -1001000000000 - i, "handler_id": HANDLER_BASE_ID + i}
+            for i in range(merchants)
+        ]
+        self.integrators = [{"name": f"integrator{i}", "chat_id": -1002000000000 - i} for i in range(max(1, merchants // 2))]
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def seed(self, db: Database) -> None:
+        """Завести мерчантов и каскады интеграторов."""
+        for merchant in self.merchants:
+            db.add_merchant(merchant["name"], merchant["name"].title(), merchant["chat_id"], merchant["handler_id"])
+        for integrator in self.integrators:
+            db.merge_cascade(integrator["name"], integrator["name"].title(), integrator["chat_id"])
+
+    def new_deal(self) -> Dict[str, Any]:
+        """Сделка в имитаторе и мерчант, который её пришлёт."""
+        merchant = self.rnd.choice(self.merchants)
+        integrator = self.rnd.choice(self.integrators)
+        deal_id = self.fake.add_order(merchant_name=merchant["name"], integrator_name=integrator["name"])
+        return {"deal_id": deal_id, "merchant": merchant}
+
+    def message(self, merchant: Dict[str, Any], text: str) -> Update:
+        """Сообщение мерчанта в его группе."""
+        return Update(update_id=next(self._update_ids), message=Message(
+            message_id=next(self._message_ids), date=datetime.now(),
+            chat=Chat(id=merchant["chat_id"], type="supergroup"),
+            from_user=User(id=MERCHANT_USER_ID, is_bot=False, first_name="Merchant"),
+            text=text
+        ))
+
+    def approve(self, deal: Dict[str, Any]) -> Update:
+        """Нажатие «approve» обработчиком под карточкой сделки."""
+        merchant = deal["merchant"]
+        return Update(update_id=next(self._update_ids), callback_query=CallbackQuery(
+            id=str(uuid.uuid4()), chat_instance="load-test",
+            from_user=User(id=merchant["handler_id"], is_bot=False, first_name="Handler"),
+            data=f"approve:{deal['deal_id']}:{merchant['chat_id']}",
+            message=Message(message_id=next(self._message_ids), date=datetime.now(),
+                            chat=Chat(id=merchant["handler_id"], type="private"), text="deal info")
+        ))
+
+
+class LoadTest:
+    """Прогон сценариев сделок с замером задержки каждого апдейта."""
+
+    def __init__(self, args: argparse.Namespace, fake: FakePayphoria, scenario: Scenario,
+                 bot: Bot, dp: Dispatcher, db: AsyncDatabase, api: PayphoriaAPI, outbox: Optional[Outbox]):
+        self.args = args
+        self.fake = fake
+        self.scenario = scenario
+        self.bot = bot
+        self.dp = dp
+        self.db = db
+        self.api = api
+        self.outbox = outbox
+        self.latency = LatencyStats(window=10 ** 7)
+        self.updates = 0
+        self.failed = 0
+
+    async def feed(self, kind: str, update: Update) -> None:
+        """Передать апдейт диспетчеру и замерить обработку."""
+        self.updates += 1
+        started = time.perf_counter()
+        ok = True
+        try:
+            await self.dp.feed_update(self.bot, update, db=self.db, api=self.api, outbox=self.outbox)
+        except Exception as e:
+            ok = False
+            self.failed += 1
+            logger.error(f"Ошибка обработки {kind}: {e}")
+        elapsed = time.perf_counter() - started
+        self.latency.record(kind, elapsed, ok)
+        self.latency.record("all", elapsed, ok)
+
+    async def deal_flow(self) -> None:
+        """Одна сделка от сообщения мерчанта до передачи интегратору."""
+        rnd = self.scenario.rnd
+        if rnd.random() < self.args.invalid_ratio:
+            merchant = rnd.choice(self.scenario.merchants)
+            await self.feed("invalid_deal", self.scenario.message(merchant, f"Сделка {uuid.uuid4()}"))
+            return
+        deal = self.scenario.new_deal()
+        await self.feed("deal_message", self.scenario.message(deal["merchant"], f"Сделка {deal['deal_id']}"))
+        await self.feed("approve", self.scenario.approve(deal))
+        if rnd.random() < self.args.kb_ratio:
+            await self.feed("kb_request", self.scenario.message(deal["merchant"], f"{deal['deal_id']} кб внешний"))
+
+    async def sync_loop(self) -> None:
+        """Периодическая сверка статусов, как в handlers.tasks."""
+        while True:
+            await asyncio.sleep(self.args.sync_interval)
+            await tasks.check_deals(self.bot, self.db, self.api)
+
+    async def run(self) -> Dict[str, Any]:
+        """Прогнать все сделки с ограничением параллельности."""
+        limit = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited() -> None:
+            async with limit:
+                await self.deal_flow()
+
+        sync = asyncio.create_task(self.sync_loop()) if self.args.sync_interval else None
+        started = time.perf_counter()
+        await asyncio.gather(*(limited() for _ in range(self.args.deals)))
+        duration = time.perf_counter() - started
+        if sync:
+            sync.cancel()
+            await asyncio.gather(sync, return_exceptions=True)
+            await tasks.check_deals(self.bot, self.db, self.api)
+        return self.report(duration)
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        """Сводка прогона."""
+        fake_stats = self.fake.stats()
+        deals = self.db.db.get_deals()
+        statuses: Dict[str, int] = {}
+        for deal in deals:
+            statuses[deal["status"]] = statuses.get(deal["status"], 0) + 1
+        return {
+            "updates": self.updates,
+            "failed": self.failed,
+            "duration_s": round(duration, 3),
+            "updates_per_s": round(self.updates / duration, 1) if duration else 0.0,
+            "handler_latency": self.latency.summary(),
+            "api_calls_per_update": round(fake_stats["total_calls"] / self.updates, 3) if self.updates else 0.0,
+            "fake_api": fake_stats,
+            "client": self.api.stats(),
+            "telegram_calls": self.bot.session.calls,
+            "outbox": self.outbox.stats() if self.outbox else None,
+            "deal_statuses": statuses,
+        }
+
+
+async def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный тест на имитаторе Payphoria API")
+    parser.add_argument("--deals", type=int, default=200, help="Сколько сделок прогнать")
+    parser.add_argument("--concurrency", type=int, default=20, help="Сколько сделок обрабатывается одновременно")
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--kb-ratio", type=float, default=0.1, help="Доля сделок с запросом «кб внешний»")
+    parser.add_argument("--invalid-ratio", type=float, default=0.05, help="Доля сообщений с несуществующим deal_id")
+    parser.add_argument("--telegram-latency-ms", type=float, default=0.0, help="Задержка ответов заглушки Telegram")
+    parser.add_argument("--telegram-flood-rate", type=float, default=0.0, help="Доля ответов Telegram retry_after")
+    parser.add_argument("--outbox", action="store_true", help="Отправки через очередь исходящих с лимитами")
+    parser.add_argument("--sync-interval", type=float, default=0.0, help="Период check_deals во время прогона, 0 — без сверки")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Файл для JSON-отчёта")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    fake = from_args(args)
+    base_url = await fake.start(port=args.port)
+    api_module.API_BASE_URL = base_url
+    api_module.API_AUTH_URL = base_url + "users/login"
+
+    workdir = Path(tempfile.mkdtemp(prefix="pspw-load-"))
+    database = Database(JsonlStorage(workdir, group_commit=True, offset_tables=DB_OFFSET_TABLES), Archive(workdir / "archive"))
+    scenario = Scenario(fake, args.merchants, args.seed)
+    scenario.seed(database)
+    db = AsyncDatabase(database)
+
+    bot = Bot(token="123456:load-test", session=FakeTelegramSession(args.telegram_latency_ms, args.telegram_flood_rate))
+    outbox = None
+    if args.outbox:
+        outbox = Outbox(TG_GLOBAL_PER_SECOND, TG_CHAT_PER_SECOND, TG_GROUP_PER_MINUTE, TG_CHAT_BURST,
+                        TG_SEND_CONCURRENCY, TG_SEND_MAX_ATTEMPTS, TG_OUTBOX_DRAIN_SECONDS)
+        bot.session.middleware(OutboxMiddleware(outbox))
+        outbox.start()
+    dp = Dispatcher(storage=MemoryStorage())
+    for module in (commands, callbacks, messages, edited_messages, tasks):
+        dp.include_router(module.router)
+    api = PayphoriaAPI()
+    await api.start()
+    try:
+        # Отладочные print из обработчиков не должны смешиваться с отчётом в stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            report = await LoadTest(args, fake, scenario, bot, dp, db, api, outbox).run()
+    finally:
+        if outbox:
+            await outbox.stop()
+        await api.close()
+        await db.close()
+        await fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
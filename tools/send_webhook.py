@@ -0,0 +1,75 @@
+"""Отправка синтетических уведомлений Payphoria о статусе сделок на локальный вебхук бота.
+
+Заменяет Payphoria при проверке WebhookReceiver: подписывает тело тем же секретом (HMAC-SHA256)
+и шлёт POST на WEBHOOK_PATH.
+
+Запуск из корня репозитория:
+    python -m tools.send_webhook --order-id <deal_id> --status success
+    python -m tools.send_webhook --from-db                 # все сделки awaiting_integrator из data/
+    python -m tools.send_webhook --order-id <id> --bad-signature
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import List
+
+import aiohttp
+
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+from webhook import sign, SIGNATURE_HEADER, TIMESTAMP_HEADER
+
+
+def deals_from_db() -> List[str]:
+    """deal_id сделок, ожидающих интегратора, из локальной базы."""
+    from database import Database
+    db = Database()
+    try:
+        return [deal["deal_id"] for deal in db.get_deals(status="awaiting_integrator")]
+    finally:
+        db.storage.close()
+
+
+async def send(session: aiohttp.ClientSession, url: str, secret: str, order: dict, bad_signature: bool) -> None:
+    """Подписать и отправить одно уведомление."""
+    body = json.dumps({"order": order}).encode("utf-8")
+    timestamp = str(int(time.time()))
+    signature = sign(secret, timestamp, body)
+    if bad_signature:
+        signature = "0" * len(signature)
+    headers = {"Content-Type": "application/json", TIMESTAMP_HEADER: timestamp, SIGNATURE_HEADER: signature}
+    started = time.perf_counter()
+    async with session.post(url, data=body, headers=headers) as response:
+        text = await response.text()
+    print(f"{order['id']} {order['status']}: HTTP {response.status} {text} ({(time.perf_counter() - started) * 1000:.1f} мс)")
+
+
+async def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Синтетические уведомления о статусах сделок")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--order-id", action="append", default=[], help="Можно указать несколько раз")
+    parser.add_argument("--from-db", action="store_true", help="Взять сделки awaiting_integrator из data/")
+    parser.add_argument("--status", default="success")
+    parser.add_argument("--merchant-name", help="Без него бот дозапросит сделку у API ради статистики")
+    parser.add_argument("--interval", type=float, default=0.0, help="Пауза между уведомлениями, сек")
+    parser.add_argument("--bad-signature", action="store_true", help="Проверить отказ по подписи")
+    args = parser.parse_args(argv)
+    order_ids = args.order_id + (deals_from_db() if args.from_db else [])
+    if not order_ids:
+        parser.error("нужен --order-id или --from-db")
+    if not args.secret:
+        parser.error("WEBHOOK_SECRET не задан, укажите --secret")
+    async with aiohttp.ClientSession() as session:
+        for order_id in order_ids:
+            order = {"id": order_id, "status": args.status}
+            if args.merchant_name:
+                order["merchant_name"] = args.merchant_name
+            await send(session, args.url, args.secret, order, args.bad_signature)
+            await asyncio.sleep(args.interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,105 @@
+import hashlib
+import hmac
+import json
+import logging
+import time
+from typing import Dict, Any, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+from api import PayphoriaAPI, format_order
+from config import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_SKEW_SECONDS
+from database import AsyncDatabase
+from handlers.tasks import apply_transition
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Payphoria-Signature"
+TIMESTAMP_HEADER = "X-Payphoria-Timestamp"
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """Подпись вебхука: HMAC-SHA256 от "<timestamp>.<тело>" в hex."""
+    return hmac.new(secret.encode("utf-8"), timestamp.encode("utf-8") + b"." + body, hashlib.sha256).hexdigest()
+
+
+class WebhookReceiver:
+    """Приём уведомлений Payphoria о смене статуса сделок (HTTP POST с подписью общим секретом)."""
+
+    def __init__(self, bot: Bot, db: AsyncDatabase, api: PayphoriaAPI, secret: str = WEBHOOK_SECRET):
+        """Инициализация приложения aiohttp."""
+        self.bot = bot
+        self.db = db
+        self.api = api
+        self.secret = secret
+        self.app = web.Application()
+        self.app.router.add_post(WEBHOOK_PATH, self.handle)
+        self._runner: Optional[web.AppRunner] = None
+        self.received = 0
+        self.rejected = 0
+        self.applied = 0
+
+    async def start(self) -> None:
+        """Запустить HTTP-сервер."""
+        if not self.secret:
+            raise ValueError("WEBHOOK_SECRET не задан")
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Вебхук Payphoria слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    async def stop(self) -> None:
+        """Остановить HTTP-сервер."""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def verify(self, request: web.Request, body: bytes) -> bool:
+        """Проверить подпись и свежесть запроса."""
+        timestamp = request.headers.get(TIMESTAMP_HEADER, "")
+        signature = request.headers.get(SIGNATURE_HEADER, "")
+        try:
+            if abs(time.time() - float(timestamp)) > WEBHOOK_MAX_SKEW_SECONDS:
+                return False
+        except ValueError:
+            return False
+        return hmac.compare_digest(sign(self.secret, timestamp, body), signature)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Обработать уведомление о статусе сделки."""
+        self.received += 1
+        body = await request.read()
+        if not self.verify(request, body):
+            self.rejected += 1
+            logger.warning(f"Отклонён вебхук с неверной подписью от {request.remote}")
+            return web.json_response({"ok": False, "error": "bad signature"}, status=401)
+        try:
+            payload = json.loads(body)
+            order = payload.get("order", payload)
+            order_id, status = order["id"], order["status"]
+            deal_data = format_order(order)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.warning(f"Отклонён вебхук с некорректным телом от {request.remote}")
+            return web.json_response({"ok": False, "error": "bad payload"}, status=400)
+        logger.info(f"Вебхук: сделка {order_id} -> {status}")
+        deal_data = await self._deal_data(order, deal_data)
+        if await apply_transition(self.bot, self.db, order_id, deal_data):
+            self.applied += 1
+        return web.json_response({"ok": True})
+
+    async def _deal_data(self, order: Dict[str, Any], deal_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Данные сделки для перехода: из уведомления (deal_data) или, если оно неполное, из API."""
+        # Закэшированные данные сделки устарели. Наполняет кэш только полный ответ API:
+        # уведомление может быть неполным (без суммы, мерчанта и интегратора)
+        self.api.order_cache.invalidate(order["id"])
+        if "merchant_name" not in order:
+            # Для статистики нужно имя мерчанта, которого в коротком уведомлении может не быть
+            fetched = await self.api.get_order(order["id"], None, fresh=True)
+            if fetched and fetched.get("status") == deal_data["status"]:
+                return fetched
+        return deal_data
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики вебхука."""
+        return {"received": self.received, "rejected": self.rejected, "applied": self.applied}